@@ -0,0 +1,31 @@
+from dataclasses import dataclass
+from typing import Union
+
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class DateRange:
+    start: pd.Timestamp
+    end: pd.Timestamp
+
+    @classmethod
+    def parse(cls, serialized: str) -> 'DateRange':
+        start, end = serialized.split(" ")
+        return cls(pd.Timestamp(start), pd.Timestamp(end))
+
+    @classmethod
+    def from_months(cls, start, end) -> 'DateRange':
+        first = pd.Timestamp(start.year, start.month, 1)
+        last = pd.Timestamp(end.year, end.month, 1) + pd.offsets.MonthEnd(0)
+        return cls(first, last)
+
+    @classmethod
+    def coerce(cls, daterange: Union['DateRange', str]) -> 'DateRange':
+        return daterange if isinstance(daterange, cls) else cls.parse(daterange)
+
+    def serialize(self) -> str:
+        return f'{self.start.strftime("%Y-%m-%d")} {self.end.strftime("%Y-%m-%d")}'
+
+    def __str__(self) -> str:
+        return self.serialize()
@@ -0,0 +1,147 @@
+import time
+import zipfile
+import zlib
+from typing import AsyncIterator, Dict, Iterable, Iterator
+
+import pandas as pd
+
+import Metrics
+from FetchExecutor import run_compute
+
+CSV = 'csv'
+CSV_GZ = 'csv.gz'
+PARQUET = 'parquet'
+ARROW = 'arrow'
+FORMATS = {CSV: 'CSV', CSV_GZ: 'Compressed CSV', PARQUET: 'Parquet', ARROW: 'Arrow IPC'}
+
+CHUNK_ROWS = 50_000
+
+
+class _ChunkSink:
+    # A write-only file that hands out whatever was written since the last drain, so
+    # writers that expect a file can still be streamed chunk by chunk
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _chunks(frame: pd.DataFrame, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    # A meaningful index, like the dates of raw Google data, becomes a column chunk by chunk. Row
+    # numbers left over from filtering a frame are not exported
+    keep_index = isinstance(frame.index, pd.DatetimeIndex) or any(name is not None for name in frame.index.names)
+    for start in range(0, max(len(frame), 1), chunk_rows):
+        chunk = frame.iloc[start:start + chunk_rows]
+        yield chunk.reset_index() if keep_index else chunk
+
+
+def _csv(frame: pd.DataFrame, chunk_rows: int) -> Iterator[bytes]:
+    for i, chunk in enumerate(_chunks(frame, chunk_rows)):
+        yield chunk.to_csv(header=i == 0, index=False).encode('utf-8')
+
+
+def _csv_gz(frame: pd.DataFrame, chunk_rows: int) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for data in _csv(frame, chunk_rows):
+        yield compressor.compress(data)
+    yield compressor.flush()
+
+
+def _parquet(frame: pd.DataFrame, chunk_rows: int) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    for chunk in _chunks(frame, chunk_rows):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema, compression='zstd')
+        # Every chunk is a row group of its own, which is what readers page through anyway
+        writer.write_table(table)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _arrow(frame: pd.DataFrame, chunk_rows: int) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    # The IPC file format, so pyarrow.memory_map() and pandas.read_feather() load it without copying
+    sink = _ChunkSink()
+    writer = None
+    for chunk in _chunks(frame, chunk_rows):
+        batch = pa.RecordBatch.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pa.ipc.new_file(sink, batch.schema)
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+_WRITERS = {CSV: _csv, CSV_GZ: _csv_gz, PARQUET: _parquet, ARROW: _arrow}
+
+
+def stream(frame: pd.DataFrame, fmt: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    if fmt not in _WRITERS:
+        raise ValueError(f'Unknown export format {fmt}, expected one of {list(_WRITERS)}')
+    return (data for data in _WRITERS[fmt](frame, chunk_rows) if data)
+
+
+def stream_bundle(frames: Dict[str, pd.DataFrame], fmt: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    # Zip entries are written with data descriptors, so nothing has to be seekable or held in memory
+    sink = _ChunkSink()
+    compression = zipfile.ZIP_STORED if fmt in (CSV_GZ, PARQUET) else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(sink, 'w', compression=compression) as bundle:
+        for name, frame in frames.items():
+            with bundle.open(f'{name}.{fmt}', 'w', force_zip64=True) as entry:
+                for data in stream(frame, fmt, chunk_rows):
+                    entry.write(data)
+                    yield sink.drain()
+    yield sink.drain()
+
+
+async def iterate_blocking(chunks: Iterable[bytes], stage: str = 'export') -> AsyncIterator[bytes]:
+    # Encoding happens on the worker threads, the event loop only passes the chunks on
+    iterator = iter(chunks)
+    started = time.perf_counter()
+    encoding = 0.0
+    try:
+        while True:
+            chunk_started = time.perf_counter()
+            data = await run_compute(next, iterator, None)
+            encoding += time.perf_counter() - chunk_started
+            if data is None:
+                break
+            if data:
+                yield data
+    finally:
+        # Time spent encoding only, a slow client reading the download doesn't count
+        Metrics.observe(stage, encoding, started)
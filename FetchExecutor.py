@@ -0,0 +1,31 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+
+MAX_FETCH_WORKERS = 4
+MAX_COMPUTE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Imported modules are shared by every Shiny session of the process, so this bounds
+# the number of blocking fetches running at once across all connected users
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix='fetch')
+
+# Fetch threads sit blocked on scheduler and Wordstat futures for as long as upstream takes.
+# Rendering, scans and export chunks get threads of their own, so slow fetches don't hold them up
+_compute_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_COMPUTE_WORKERS, thread_name_prefix='compute')
+
+
+async def _run_in(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Unlike asyncio.to_thread, run_in_executor drops the caller's context, the trace has to go along
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def run_blocking(func, *args, **kwargs):
+    return await _run_in(_executor, func, *args, **kwargs)
+
+
+async def run_compute(func, *args, **kwargs):
+    return await _run_in(_compute_executor, func, *args, **kwargs)
@@ -1,29 +1,174 @@
+import numpy as np
+import pandas as pd
 from pytrends.request import TrendReq
 
+import Metrics
+
 class GoogleTrendsFetcher():
+  MAX_PAYLOAD_KEYWORDS = 5
+
+  DAILY = "D"
+  WEEKLY = "W"
+  # Trends answers with days below 270 days and with weeks below about five years. A longer range
+  # is fetched in windows of that length, overlapping enough to rescale them onto one another
+  WINDOWS = {
+    DAILY: (pd.Timedelta(days=269), pd.Timedelta(days=90)),
+    WEEKLY: (pd.Timedelta(days=1820), pd.Timedelta(days=364)),
+  }
+
   pytrends_fetcher = None
 
-  def __init__(self, host_language='en-US', time_zone=180):
+  DEFAULT_USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:121.0) Gecko/20100101 Firefox/121.0"
+
+  def __init__(self, host_language='en-US', time_zone=180, user_agent=None, proxy=None):
     requests_args = {
       'headers': {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:121.0) Gecko/20100101 Firefox/121.0",
+        "User-Agent": user_agent or self.DEFAULT_USER_AGENT,
       },
       'verify': False
     }
 
-    self.pytrends_fetcher = TrendReq(hl=host_language, tz=time_zone, requests_args=requests_args)
+    self.pytrends_fetcher = TrendReq(hl=host_language, tz=time_zone, proxies=[proxy] if proxy else '', requests_args=requests_args)
 
   def BuildPayload(self, keywords, timeframe="today 5-y", geo="", cat=0):
     self.pytrends_fetcher.build_payload(kw_list=keywords, timeframe=timeframe, geo=geo, cat=cat)
 
   def FetchInterestOverTime(self):
-    return self.pytrends_fetcher.interest_over_time().drop(columns='isPartial')
+    with Metrics.timed('google.interest_over_time'):
+      return self.pytrends_fetcher.interest_over_time().drop(columns='isPartial')
+
+  def FetchInterestOverTimeBatch(self, keywords, anchor=None, timeframe="today 5-y", geo="", cat=0):
+    def fetch(payloads):
+      frames = []
+      for payload in payloads:
+        self.BuildPayload(payload, timeframe=timeframe, geo=geo, cat=cat)
+        frames.append(self.FetchInterestOverTime())
+      return frames
+
+    return self.CollectBatch(fetch, keywords, anchor)
+
+  @classmethod
+  def CollectBatch(cls, fetch, keywords, anchor=None):
+    # fetch gets a list of payloads, each a list of keywords, and returns their frames in the same order
+    keywords = list(dict.fromkeys(keywords))
+    if anchor is not None:
+      return cls.RescaleBatches(fetch(cls.BatchPayloads(keywords, anchor)), anchor, keywords)
+
+    # The first payload goes alone and its keyword of middling popularity anchors the others. A rare
+    # anchor rounds to 0 or 1 next to a dominant keyword, a dominant one flattens the rare keywords
+    first = keywords[:cls.MAX_PAYLOAD_KEYWORDS]
+    frames = fetch([first])
+    rest = keywords[len(first):]
+    if not rest:
+      return frames[0].astype(float)[keywords]
+
+    anchor = cls.MiddleKeyword(frames[0])
+    if anchor is None:
+      raise RuntimeError(f'None of {first} has interest, there is no anchor for the rest of the batch')
+    return cls.RescaleBatches(frames + fetch(cls.BatchPayloads(rest, anchor)), anchor, keywords)
+
+  @staticmethod
+  def MiddleKeyword(data):
+    levels = data.astype(float).sum()
+    levels = levels[levels > 0].sort_values(kind="stable")
+    if levels.empty:
+      return None
+    return levels.index[len(levels) // 2]
+
+  @classmethod
+  def BatchPayloads(cls, keywords, anchor):
+    # Every payload carries the anchor term, so its level tells how each batch was scaled by Trends
+    others = [keyword for keyword in keywords if keyword != anchor]
+    batch_size = cls.MAX_PAYLOAD_KEYWORDS - 1
+    return [[anchor] + others[i:i + batch_size] for i in range(0, len(others), batch_size)] or [[anchor]]
+
+  @staticmethod
+  def RescaleBatches(frames, anchor, keywords):
+    rescaled = []
+    reference_level = None
+    for data in frames:
+      data = data.astype(float)
+      anchor_level = data[anchor].sum()
+      if anchor_level <= 0:
+        raise RuntimeError(f'Anchor keyword {anchor} has no interest next to {list(data.columns)}, choose a more popular anchor')
+
+      if reference_level is None:
+        reference_level = anchor_level
+        rescaled.append(data)
+      else:
+        rescaled.append(data.drop(columns=anchor) * (reference_level / anchor_level))
+
+    result = pd.concat(rescaled, axis=1)
+    peak = result.to_numpy().max()
+    if peak > 0:
+      result *= 100 / peak
+
+    return result[keywords]
+
+  @staticmethod
+  def Timeframe(start, end):
+    return f"{start.strftime('%Y-%m-%d')} {end.strftime('%Y-%m-%d')}"
+
+  @classmethod
+  def SplitWindows(cls, start, end, resolution):
+    if resolution not in cls.WINDOWS:
+      raise ValueError(f"Unknown resolution {resolution}, expected one of {list(cls.WINDOWS)}")
+    length, overlap = cls.WINDOWS[resolution]
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+
+    # Every window is full length, a shorter one would come back at a finer resolution. The first
+    # one may start before the range and the last one overlaps more, both are trimmed when stitched
+    window_start = min(start, end - length)
+    windows = []
+    while True:
+      window_end = min(window_start + length, end)
+      windows.append((window_end - length, window_end))
+      if window_end >= end:
+        return windows
+      window_start = window_end - overlap
+
+  @staticmethod
+  def StitchWindows(frames, start=None, end=None):
+    # Each window is scaled to its own peak. The level of a window over its overlap with the
+    # previous one gives their ratio, and the ratios chain every window onto the first one's scale
+    stacked = pd.concat([frame.astype(float) for frame in frames], keys=range(len(frames)), names=["window", "date"])
+    totals = stacked.sum(axis=1).unstack("window").reindex(columns=range(len(frames))).to_numpy()
+
+    previous, current = totals[:, :-1], totals[:, 1:]
+    shared = ~np.isnan(previous) & ~np.isnan(current)
+    previous_level = np.where(shared, previous, 0).sum(axis=0)
+    current_level = np.where(shared, current, 0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+      ratios = previous_level / current_level
+
+    # Nothing searched in an overlap leaves nothing to compare, the window keeps the scale it came with
+    unanchored = ~np.isfinite(ratios) | (ratios <= 0)
+    if unanchored.any():
+      Metrics.events.inc("google.stitch_unanchored", int(unanchored.sum()))
+      ratios[unanchored] = 1
+    scales = np.concatenate([[1.0], np.cumprod(ratios)])
+
+    windows = stacked.index.get_level_values("window").to_numpy()
+    rescaled = stacked * scales[windows][:, None]
+    result = rescaled.groupby(level="date").mean()
+    if start is not None:
+      result = result[result.index >= pd.Timestamp(start)]
+    if end is not None:
+      result = result[result.index <= pd.Timestamp(end)]
+
+    peak = result.to_numpy().max() if not result.empty else 0
+    if peak > 0:
+      result *= 100 / peak
+    return result
 
   def FetchSuggestions(self, keyword):
-    return self.pytrends_fetcher.suggestions(keyword)
+    with Metrics.timed('google.suggestions'):
+      return self.pytrends_fetcher.suggestions(keyword)
 
   def FetchSearchedWith(self):
-    return self.pytrends_fetcher.related_topics()
+    with Metrics.timed('google.related_topics'):
+      return self.pytrends_fetcher.related_topics()
 
   def FetchSearchedAlso(self):
-    return self.pytrends_fetcher.related_queries()
\ No newline at end of file
+    with Metrics.timed('google.related_queries'):
+      return self.pytrends_fetcher.related_queries()
\ No newline at end of file
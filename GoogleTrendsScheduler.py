@@ -0,0 +1,172 @@
+import concurrent.futures
+import contextvars
+import itertools
+import queue
+import random
+import threading
+import time
+
+import requests
+from pytrends.exceptions import ResponseError, TooManyRequestsError
+
+import Metrics
+from DateRange import DateRange
+from GoogleTrendsFetcher import GoogleTrendsFetcher
+
+
+class TokenBucket():
+  def __init__(self, rate, capacity):
+    self.rate = rate
+    self.capacity = capacity
+
+    self.__lock = threading.Lock()
+    self.__tokens = capacity
+    self.__updated = time.monotonic()
+
+  def Acquire(self):
+    while True:
+      with self.__lock:
+        now = time.monotonic()
+        if now >= self.__updated:
+          self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+          self.__updated = now
+          if self.__tokens >= 1:
+            self.__tokens -= 1
+            return
+          wait = (1 - self.__tokens) / self.rate
+        else:
+          wait = self.__updated - now
+      time.sleep(wait)
+
+  def Pause(self, seconds):
+    # Nothing is handed out until the pause is over, and the bucket refills from empty after it
+    with self.__lock:
+      self.__tokens = 0
+      self.__updated = max(self.__updated, time.monotonic() + seconds)
+
+
+class GoogleTrendsScheduler():
+  INTERACTIVE = 0
+  BATCH = 10
+
+  def __init__(self, rate=0.2, burst=3, workers=1, identities=None, max_retries=5, base_delay=5, max_delay=300, fetcher_factory=GoogleTrendsFetcher):
+    self.max_retries = max_retries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.fetcher_factory = fetcher_factory
+    self.identities = identities or [{}]
+
+    self.__bucket = TokenBucket(rate, burst)
+    self.__jobs = queue.PriorityQueue()
+    self.__order = itertools.count()
+
+    # pytrends keeps the payload on the client, so every worker owns its fetcher
+    self.__threads = [threading.Thread(target=self.__WorkerLoop, args=(i,), name=f"google-trends-{i}", daemon=True) for i in range(workers)]
+    for thread in self.__threads:
+      thread.start()
+
+  @staticmethod
+  def BuildIdentities(proxies=(), user_agents=()):
+    if not proxies and not user_agents:
+      return [{}]
+    user_agents = list(user_agents) or [None]
+    proxies = list(proxies) or [None]
+    count = max(len(proxies), len(user_agents))
+    return [{"proxy": proxies[i % len(proxies)], "user_agent": user_agents[i % len(user_agents)]} for i in range(count)]
+
+  @staticmethod
+  def IsRetryable(err):
+    if isinstance(err, TooManyRequestsError):
+      return True
+    if isinstance(err, ResponseError):
+      return err.response is not None and err.response.status_code >= 500
+    return isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+  def __Delay(self, attempt):
+    return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+  def __WorkerLoop(self, index):
+    identity = index % len(self.identities)
+    fetcher = None
+
+    while True:
+      _, _, job, future, context, submitted = self.__jobs.get()
+      if job is None:
+        break
+      if not future.set_running_or_notify_cancel():
+        continue
+      context.run(Metrics.observe, "google.queue_wait", time.perf_counter() - submitted, submitted)
+
+      for attempt in range(self.max_retries + 1):
+        waiting = time.perf_counter()
+        self.__bucket.Acquire()
+        context.run(Metrics.observe, "google.rate_limit_wait", time.perf_counter() - waiting, waiting)
+        try:
+          if fetcher is None:
+            fetcher = self.fetcher_factory(**self.identities[identity])
+          future.set_result(context.run(job, fetcher))
+          break
+        except Exception as err:
+          if not self.IsRetryable(err) or attempt == self.max_retries:
+            future.set_exception(err)
+            break
+
+          # Throttling applies to every worker, the failed one also moves on to the next identity
+          Metrics.events.inc("google.retried")
+          self.__bucket.Pause(self.__Delay(attempt))
+          identity = (identity + 1) % len(self.identities)
+          fetcher = None
+
+  def Submit(self, job, priority=BATCH):
+    future = concurrent.futures.Future()
+    # The job runs in the submitter's context, so its timings land in the submitter's trace
+    self.__jobs.put((priority, next(self.__order), job, future, contextvars.copy_context(), time.perf_counter()))
+    return future
+
+  def FetchInterestOverTime(self, keywords, timeframe="today 5-y", geo="", cat=0, priority=BATCH, resolution=None):
+    return self.__Gather([self.__SubmitPayload(keywords, timeframe, geo, cat, priority, resolution)], timeframe, resolution)[0]
+
+  def FetchInterestOverTimeBatch(self, keywords, anchor=None, timeframe="today 5-y", geo="", cat=0, priority=BATCH, resolution=None):
+    # Every payload is a job of its own, so each request waits for its own token and a retry after
+    # throttling repeats only the request that was throttled, the anchor rescaling runs on the results
+    def fetch(payloads):
+      return self.__Gather([self.__SubmitPayload(payload, timeframe, geo, cat, priority, resolution) for payload in payloads], timeframe, resolution)
+
+    return GoogleTrendsFetcher.CollectBatch(fetch, keywords, anchor)
+
+  def __SubmitPayload(self, keywords, timeframe, geo, cat, priority, resolution):
+    # Windows of a stitched series are separate jobs too, so they spread over the workers and share the rate budget
+    if resolution is None:
+      windows = [timeframe]
+    else:
+      daterange = DateRange.coerce(timeframe)
+      windows = [GoogleTrendsFetcher.Timeframe(*window) for window in GoogleTrendsFetcher.SplitWindows(daterange.start, daterange.end, resolution)]
+
+    def job(fetcher, window):
+      fetcher.BuildPayload(keywords, timeframe=window, geo=geo, cat=cat)
+      return fetcher.FetchInterestOverTime()
+
+    return [self.Submit(lambda fetcher, window=window: job(fetcher, window), priority) for window in windows]
+
+  def __Gather(self, payloads, timeframe, resolution):
+    futures = [future for windows in payloads for future in windows]
+    try:
+      results = iter([future.result() for future in futures])
+    except Exception:
+      for future in futures:
+        future.cancel()
+      raise
+
+    frames = [[next(results) for _ in windows] for windows in payloads]
+    if resolution is None:
+      return [windows[0] for windows in frames]
+
+    daterange = DateRange.coerce(timeframe)
+    with Metrics.timed("google.stitch"):
+      return [GoogleTrendsFetcher.StitchWindows(windows, daterange.start, daterange.end) for windows in frames]
+
+  def Shutdown(self):
+    for _ in self.__threads:
+      self.__jobs.put((float("inf"), next(self.__order), None, None, None, None))
+    for thread in self.__threads:
+      thread.join()
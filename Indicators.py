@@ -1,19 +1,34 @@
+from collections import OrderedDict
+from typing import Union
+
+import numpy as np
 import pandas as pd
 
+import Metrics
+from Panel import KeywordPanel, MonthlyPanel
+
+
+def _series_frame(panel: MonthlyPanel, values: np.ndarray) -> pd.DataFrame:
+    observed = ~np.isnan(values)
+    return pd.DataFrame({'date': panel.index[observed], 'value': values[observed]})
+
 
 class BaseIndicator:
     name: str
     description: str
+    sources: tuple[str]
 
     @staticmethod
-    def aggregate(google_df: pd.DataFrame, yandex_df: pd.DataFrame) -> pd.DataFrame:
+    def aggregate(panel: MonthlyPanel) -> pd.DataFrame:
         pass
 
 
 class IndicatorsManager:
-    def __init__(self, indicators: tuple[BaseIndicator]):
+    def __init__(self, indicators: tuple[BaseIndicator], cache_size: int = 64):
         self._indicators = indicators
         self._names_dict = {}
+        self._cache_size = cache_size
+        self._results = OrderedDict()
 
         for i, indicator in enumerate(self._indicators):
             self._names_dict[indicator.name] = i
@@ -26,44 +41,134 @@ class IndicatorsManager:
             raise RuntimeError(f'No indicator with name {name} in _names_dict {self._names_dict}')
         return self._indicators[self._names_dict[name]]
 
+    def get_applicable(self, panel: Union[MonthlyPanel, KeywordPanel]) -> tuple[BaseIndicator]:
+        return tuple(indicator for indicator in self._indicators if set(indicator.sources) <= panel.sources())
+
+    def compute(self, indicator: Union[BaseIndicator, str], panel: Union[MonthlyPanel, KeywordPanel]) -> pd.DataFrame:
+        if isinstance(indicator, str):
+            indicator = self.get_indicator_by_name(indicator)
+
+        key = (panel.version, indicator.name)
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        with Metrics.timed(f'indicator.{indicator.name}'):
+            result = indicator.aggregate(panel)
+        self._results[key] = result
+        if len(self._results) > self._cache_size:
+            self._results.popitem(last=False)
+        return result
+
 
 class GoogleRelativeIndicator(BaseIndicator):
     name = 'Google Relative Indicator'
     description = 'Google Relative Indicator - индикатор, соответствующий относительной популярности запроса по статистике Google Trends'
+    sources = ('google',)
 
     @staticmethod
-    def aggregate(google_df: pd.DataFrame, yandex_df: pd.DataFrame) -> pd.DataFrame:
-        return google_df.rename(columns={'relative_value': 'value'})
+    def aggregate(panel: MonthlyPanel) -> pd.DataFrame:
+        return _series_frame(panel, panel.column('google', 'relative_value'))
 
 
 class YandexRelativeIndicator(BaseIndicator):
     name = 'Yandex Relative Indicator'
     description = 'Yandex Relative Indicator - индикатор, соответствующий относительной популярности запроса по статистике Yandex Wordstat'
+    sources = ('yandex',)
 
     @staticmethod
-    def aggregate(google_df: pd.DataFrame, yandex_df: pd.DataFrame) -> pd.DataFrame:
-        return yandex_df.rename(columns={'relative_value': 'value'}).drop(columns=['absolute_value'])
+    def aggregate(panel: MonthlyPanel) -> pd.DataFrame:
+        return _series_frame(panel, panel.column('yandex', 'relative_value'))
 
 
 class YandexAbsoluteIndicator(BaseIndicator):
     name = 'Yandex Absolute Indicator'
     description = 'Yandex Absolute Indicator - индикатор, соответствующий абсолютной популярности запроса по статистике Yandex Wordstat'
+    sources = ('yandex',)
 
     @staticmethod
-    def aggregate(google_df: pd.DataFrame, yandex_df: pd.DataFrame) -> pd.DataFrame:
-        return yandex_df.rename(columns={'absolute_value': 'value'}).drop(columns=['relative_value'])
+    def aggregate(panel: MonthlyPanel) -> pd.DataFrame:
+        return _series_frame(panel, panel.column('yandex', 'absolute_value'))
 
 
 class RelativeNormalizedSumIndicator(BaseIndicator):
     name = 'Relative Sum Indicator'
     description = 'Relative Sum Indicator - индикатор, соответствующий сумме долей относительных популярностей, деленных на максимум за период времени'
+    sources = ('google', 'yandex')
+
+    @staticmethod
+    def aggregate(panel: MonthlyPanel) -> pd.DataFrame:
+        google = panel.column('google', 'relative_value')
+        yandex = panel.column('yandex', 'relative_value')
+
+        # A month present in one source only contributes just that source's share
+        shares = np.stack([google / np.nanmax(google), yandex / np.nanmax(yandex)])
+        observed = ~np.isnan(shares).all(axis=0)
+        return pd.DataFrame({'date': panel.index[observed], 'value': np.nansum(shares, axis=0)[observed]})
+
+
+def _composite_frame(panel: KeywordPanel, values: np.ndarray) -> pd.DataFrame:
+    observed = np.isfinite(values)
+    return pd.DataFrame({'date': panel.index[observed], 'value': values[observed]})
+
+
+class CompositeIndicator(BaseIndicator):
+    # Combines every (keyword, source) series of one metric in a KeywordPanel
+    sources = ()
+    metric = 'relative_value'
+
+    @classmethod
+    def inputs(cls, panel: KeywordPanel):
+        moments = panel.moments(cls.metric)
+        return moments, panel.ordered(cls.metric, moments.labels)
 
     @staticmethod
-    def aggregate(google_df: pd.DataFrame, yandex_df: pd.DataFrame) -> pd.DataFrame:
-        print(yandex_df['date'], google_df['date'])
-
-        google_df['relative_value'] /= google_df['relative_value'].max()
-        yandex_df['relative_value'] /= yandex_df['relative_value'].max()
-        result = pd.concat([google_df, yandex_df.drop(columns=['absolute_value'])])
-        result = result.groupby('date').sum().reset_index()
-        return result.rename(columns={'relative_value': 'value'})
+    def combine(standardized: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        # A date missing some series is scaled up to the weight of all of them, dates with none are NaN
+        observed = ~np.isnan(standardized)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            present = np.abs(weights) @ observed.T
+            return np.where(observed, standardized, 0.0) @ weights * (np.abs(weights).sum() / present)
+
+
+class FirstComponentIndicator(CompositeIndicator):
+    name = 'First Component Indicator'
+    description = 'First Component Indicator - общий фактор всех запросов: первая главная компонента их стандартизованных рядов'
+
+    @classmethod
+    def aggregate(cls, panel: KeywordPanel) -> pd.DataFrame:
+        moments, values = cls.inputs(panel)
+        return _composite_frame(panel, cls.combine(moments.standardize(values), moments.leading_component()))
+
+
+class DiffusionIndexIndicator(CompositeIndicator):
+    name = 'Diffusion Index Indicator'
+    description = 'Diffusion Index Indicator - доля запросов, популярность которых выросла по сравнению с предыдущим периодом, в процентах'
+
+    @classmethod
+    def aggregate(cls, panel: KeywordPanel) -> pd.DataFrame:
+        _, values = cls.inputs(panel)
+        changes = np.diff(values, axis=0)
+        observed = ~np.isnan(changes)
+
+        # An unchanged series counts as half rising, half falling
+        rising = np.where(observed, (changes > 0) + 0.5 * (changes == 0), 0.0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            index = 100 * rising / observed.sum(axis=1)
+        return _composite_frame(panel, np.concatenate([[np.nan], index]))
+
+
+class WeightedZScoreIndicator(CompositeIndicator):
+    name = 'Weighted Z-Score Indicator'
+    description = 'Weighted Z-Score Indicator - среднее стандартизованных рядов запросов с весами, обратными их шуму от периода к периоду'
+
+    @classmethod
+    def aggregate(cls, panel: KeywordPanel) -> pd.DataFrame:
+        moments, values = cls.inputs(panel)
+        standardized = moments.standardize(values)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            noise = np.nanstd(np.diff(standardized, axis=0), axis=0)
+            weights = np.where(noise > 0, 1 / noise, 0.0)
+        weights = np.nan_to_num(weights)
+        return _composite_frame(panel, cls.combine(standardized, weights / weights.sum() if weights.sum() > 0 else weights))
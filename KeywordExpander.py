@@ -0,0 +1,155 @@
+import concurrent.futures
+import pickle
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from GoogleTrendsScheduler import GoogleTrendsScheduler
+from ResultCache import ResultCache
+from SqliteDatabase import SqliteDatabase
+
+SUGGESTIONS = 'suggestions'
+QUERIES = 'queries'
+TOPICS = 'topics'
+RELATIONS = (SUGGESTIONS, QUERIES, TOPICS)
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+
+
+def normalize(query: str) -> str:
+    # 'Bank  Loans', 'bank-loans' and 'loans bank' are one node, ё and е are one letter in Wordstat as well
+    text = unicodedata.normalize('NFKC', query).casefold().replace('ё', 'е')
+    return ' '.join(sorted(set(_PUNCTUATION.sub(' ', text).split())))
+
+
+def _related(frames, relation: str) -> List[Tuple[str, str, float]]:
+    column = 'query' if relation == QUERIES else 'topic_title'
+    edges = []
+    for kind in ('top', 'rising'):
+        frame = frames.get(kind) if frames else None
+        if frame is None or frame.empty:
+            continue
+        values = pd.to_numeric(frame['value'], errors='coerce').to_numpy(dtype=float)
+        edges += [(f'{kind}_{relation}', title, value) for title, value in zip(frame[column], values)]
+    return edges
+
+
+class RelatedStore(SqliteDatabase):
+    # Keyed like the expander's in-memory cache, so another run of expand.py starts from every
+    # response fetched before. Related searches move slowly, a week old answer picks keywords as well
+    def __init__(self, path: str = './.cache/related.sqlite3', ttl: float = 7 * 24 * 60 * 60):
+        super().__init__(path, [
+            'CREATE TABLE IF NOT EXISTS related ('
+            'relation TEXT NOT NULL, query TEXT NOT NULL, timeframe TEXT NOT NULL, geo TEXT NOT NULL, '
+            'fetched_at REAL NOT NULL, payload BLOB NOT NULL, '
+            'PRIMARY KEY (relation, query, timeframe, geo))',
+        ])
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    def load(self, key: Tuple[str, str, str, str]) -> Optional[List[Tuple[str, str, float]]]:
+        row = self._connection().execute(
+            'SELECT fetched_at, payload FROM related WHERE relation = ? AND query = ? AND timeframe = ? AND geo = ?', key,
+        ).fetchone()
+        fresh = row is not None and time.time() - row[0] < self._ttl
+        with self._lock:
+            self._counters['hits' if fresh else 'misses'] += 1
+        return pickle.loads(row[1]) if fresh else None
+
+    def save(self, key: Tuple[str, str, str, str], edges: List[Tuple[str, str, float]]):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO related (relation, query, timeframe, geo, fetched_at, payload) VALUES (?, ?, ?, ?, ?, ?)',
+                (*key, time.time(), pickle.dumps(edges, protocol=pickle.HIGHEST_PROTOCOL)),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+class KeywordExpander:
+    def __init__(self, scheduler: GoogleTrendsScheduler, workers: int = 4, relations: Iterable[str] = RELATIONS, timeframe: str = 'today 5-y', geo: str = '',
+                 priority: int = GoogleTrendsScheduler.BATCH, cache: ResultCache = None, store: Optional[RelatedStore] = None):
+        self.scheduler = scheduler
+        self.workers = workers
+        self.relations = tuple(relations)
+        self.timeframe = timeframe
+        self.geo = geo
+        self.priority = priority
+        # Responses are keyed by the normalized query, so overlapping seed sets share them
+        self.cache = cache or ResultCache(max_entries=4096, ttl=24 * 60 * 60)
+        self.store = store
+
+    def _fetch(self, relation: str, keyword: str) -> List[Tuple[str, str, float]]:
+        def job(fetcher):
+            if relation == SUGGESTIONS:
+                return [(SUGGESTIONS, suggestion['title'], np.nan) for suggestion in fetcher.FetchSuggestions(keyword)]
+            fetcher.BuildPayload([keyword], timeframe=self.timeframe, geo=self.geo)
+            related = fetcher.FetchSearchedAlso() if relation == QUERIES else fetcher.FetchSearchedWith()
+            return _related((related or {}).get(keyword), relation)
+
+        return self.scheduler.Submit(job, self.priority).result()
+
+    def _stored(self, key: Tuple[str, str, str, str], relation: str, keyword: str) -> List[Tuple[str, str, float]]:
+        edges = self.store.load(key) if self.store is not None else None
+        if edges is None:
+            edges = self._fetch(relation, keyword)
+            if self.store is not None:
+                self.store.save(key, edges)
+        return edges
+
+    def neighbours(self, keyword: str) -> List[Tuple[str, str, float]]:
+        edges = []
+        for relation in self.relations:
+            key = (relation, normalize(keyword), self.timeframe, self.geo)
+            edges += self.cache.get(key, lambda: self._stored(key, relation, keyword))
+        return edges
+
+    def expand(self, seeds: Iterable[str], max_depth: int = 2, max_nodes: int = 200) -> pd.DataFrame:
+        nodes = {}
+        rows = []
+
+        def accept(keyword, depth, parent, relation, value):
+            key = normalize(keyword)
+            if not key or key in nodes or len(nodes) >= max_nodes:
+                return False
+            nodes[key] = keyword
+            rows.append((keyword, depth, parent, relation, value))
+            return True
+
+        frontier = [seed for seed in seeds if accept(seed, 0, None, 'seed', np.nan)]
+
+        # Breadth first, one level at a time, the executor bounds how many nodes are in flight and
+        # the scheduler's token bucket paces the requests they make
+        executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='expander')
+        try:
+            for depth in range(1, max_depth + 1):
+                if not frontier or len(nodes) >= max_nodes:
+                    break
+                futures = [executor.submit(self.neighbours, keyword) for keyword in frontier]
+
+                next_frontier = []
+                for parent, future in zip(frontier, futures):
+                    if len(nodes) >= max_nodes:
+                        break
+                    try:
+                        edges = future.result()
+                    except Exception as err:
+                        print(f'Failed to expand {parent}: {err}')
+                        continue
+                    # Google returns each relation strongest first, so the budget goes to the strongest edges
+                    for relation, keyword, value in edges:
+                        if accept(keyword, depth, parent, relation, value):
+                            next_frontier.append(keyword)
+                frontier = next_frontier
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        return pd.DataFrame(rows, columns=['keyword', 'depth', 'parent', 'relation', 'value'])
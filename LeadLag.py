@@ -0,0 +1,187 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import Metrics
+
+MIN_OBSERVATIONS = 12
+CHUNK_SIZE = 512
+
+
+def read_target(source) -> pd.Series:
+    # The first column is the date, the second one the value, anything finer than a month is averaged
+    data = pd.read_csv(source)
+    if data.shape[1] < 2:
+        raise ValueError(f'Target series needs a date and a value column, got {list(data.columns)}')
+    dates = pd.to_datetime(data.iloc[:, 0]).dt.to_period('M').dt.to_timestamp()
+    values = pd.to_numeric(data.iloc[:, 1], errors='coerce')
+    return values.groupby(dates.to_numpy()).mean().rename_axis('date')
+
+
+def candidate_matrix(indicators: pd.DataFrame, index: pd.DatetimeIndex) -> Tuple[pd.DataFrame, np.ndarray]:
+    # indicators is long, with keyword, indicator, date and value columns like batch.py writes them
+    dates = pd.to_datetime(indicators['date']).dt.to_period('M').dt.to_timestamp()
+    wide = indicators.assign(date=dates).pivot_table(index=['keyword', 'indicator'], columns='date', values='value', aggfunc='mean')
+    wide = wide.reindex(columns=index)
+    return wide.index.to_frame(index=False), wide.to_numpy(dtype=float)
+
+
+def _standardize(values: np.ndarray) -> np.ndarray:
+    # Every statistic here is scale free, and unit scale keeps the FFT sums well conditioned
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centered = values - np.nanmean(values, axis=-1, keepdims=True)
+        return centered / np.nanstd(centered, axis=-1, keepdims=True)
+
+
+def _lagged_sums(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    # sum over t of left[..., t - lag] * right[t] for every lag at once, left rows against one right series
+    months = left.shape[-1]
+    size = 1 << (2 * months - 1).bit_length()
+    sums = np.fft.irfft(np.conj(np.fft.rfft(left, size)) * np.fft.rfft(right, size), size)
+    return sums[..., :months]
+
+
+def _fingerprint(*arrays: np.ndarray) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        digest.update(repr(array.shape).encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+class _Scan:
+    def __init__(self, values: np.ndarray, target: np.ndarray):
+        self.values = _standardize(values)
+        self.target = _standardize(target)
+        self.oos = {}
+        self.lock = threading.Lock()
+
+        observed = ~np.isnan(self.values)
+        x = np.where(observed, self.values, 0)
+        y_observed = ~np.isnan(self.target)
+        y = np.where(y_observed, self.target, 0)
+
+        # Cross-correlation over the months both series are observed, for all lags in one FFT
+        n = np.rint(_lagged_sums(observed, y_observed))
+        sx, sy = _lagged_sums(x, y_observed), _lagged_sums(observed, y)
+        sxx, syy, sxy = _lagged_sums(x * x, y_observed), _lagged_sums(observed, y * y), _lagged_sums(x, y)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.correlation = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+        self.correlation[n < MIN_OBSERVATIONS] = np.nan
+        self.observations = n
+
+        # Granger-style test: does x lagged add to y's own previous month, F test of the extra term
+        z = np.concatenate([[0], y[:-1]])
+        w = (y_observed & np.concatenate([[False], y_observed[:-1]])).astype(float)
+        n = np.rint(_lagged_sums(observed, w))
+        sx, sy, sz = _lagged_sums(x, w), _lagged_sums(observed, y * w), _lagged_sums(observed, z * w)
+        sxx, sxy, sxz = _lagged_sums(x * x, w), _lagged_sums(x, y * w), _lagged_sums(x, z * w)
+        syy, szz, syz = _lagged_sums(observed, y * y * w), _lagged_sums(observed, z * z * w), _lagged_sums(observed, y * z * w)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cxx, cyy, czz = sxx - sx ** 2 / n, syy - sy ** 2 / n, szz - sz ** 2 / n
+            cxy, cxz, cyz = sxy - sx * sy / n, sxz - sx * sz / n, syz - sy * sz / n
+            restricted = cyy - cyz ** 2 / czz
+            unrestricted = cyy - (czz * cxy ** 2 - 2 * cxz * cxy * cyz + cxx * cyz ** 2) / (czz * cxx - cxz ** 2)
+            self.granger_f = (restricted - unrestricted) / (unrestricted / (n - 3))
+        self.granger_f[n < MIN_OBSERVATIONS] = np.nan
+        self.granger_df = n - 3
+
+    def out_of_sample(self, lags: np.ndarray, min_train: int) -> np.ndarray:
+        missing = np.array([lag for lag in lags if (lag, min_train) not in self.oos], dtype=int)
+        if len(missing):
+            months = self.values.shape[1]
+            padded = np.pad(self.values, ((0, 0), (missing.max(), 0)), constant_values=np.nan)
+            windows = sliding_window_view(padded, months, axis=1)
+            for start in range(0, len(self.values), CHUNK_SIZE):
+                result = self._out_of_sample(windows[start:start + CHUNK_SIZE, missing.max() - missing], min_train)
+                for i, lag in enumerate(missing):
+                    self.oos.setdefault((lag, min_train), []).append(result[:, i])
+            for lag in missing:
+                self.oos[(lag, min_train)] = np.concatenate(self.oos[(lag, min_train)])
+        return np.stack([self.oos[(lag, min_train)] for lag in lags], axis=1)
+
+    def _out_of_sample(self, x: np.ndarray, min_train: int) -> np.ndarray:
+        # Expanding window: month t is predicted by a line fitted on the months before it and
+        # compared with the mean of those months, the usual out-of-sample R squared
+        y = self.target
+        observed = ~np.isnan(x) & ~np.isnan(y)
+        x0, y0 = np.where(observed, x, 0), np.where(observed, y, 0)
+
+        def before(values):
+            return np.cumsum(values, axis=-1) - values
+
+        n, sx, sy = before(observed.astype(float)), before(x0), before(y0)
+        sxx, sxy = before(x0 * x0), before(x0 * y0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            denominator = n * sxx - sx ** 2
+            slope = (n * sxy - sx * sy) / denominator
+            prediction = (sy - slope * sx) / n + slope * x
+            benchmark = sy / n
+            scored = observed & (n >= min_train) & (denominator > 1e-9)
+            model_error = np.where(scored, (y - prediction) ** 2, 0).sum(axis=-1)
+            benchmark_error = np.where(scored, (y - benchmark) ** 2, 0).sum(axis=-1)
+            return np.where(scored.sum(axis=-1) > 0, 1 - model_error / benchmark_error, np.nan)
+
+
+class LeadLagScanner:
+    def __init__(self, cache_size: int = 16):
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._scans = OrderedDict()
+
+    def _scan(self, values: np.ndarray, target: np.ndarray) -> _Scan:
+        # All lags come out of the FFT anyway, so a new lag window only slices a cached scan
+        key = _fingerprint(values, target)
+        with self._lock:
+            if key in self._scans:
+                self._scans.move_to_end(key)
+                return self._scans[key]
+
+        with Metrics.timed('leadlag.scan'):
+            scan = _Scan(values, target)
+        with self._lock:
+            self._scans[key] = scan
+            if len(self._scans) > self._cache_size:
+                self._scans.popitem(last=False)
+        return scan
+
+    def scan(self, labels: pd.DataFrame, values: np.ndarray, target: np.ndarray, lags: Tuple[int, int], min_train: int = 24) -> pd.DataFrame:
+        if values.shape[1] != len(target):
+            raise ValueError(f'Candidates cover {values.shape[1]} months, the target {len(target)}')
+        min_lag, max_lag = lags
+        max_lag = min(max_lag, len(target) - MIN_OBSERVATIONS)
+        if min_lag < 0 or min_lag > max_lag:
+            raise ValueError(f'Lag window {lags} does not fit a series of {len(target)} months')
+
+        scan = self._scan(values, target)
+        with scan.lock:
+            window = np.arange(min_lag, max_lag + 1)
+            with Metrics.timed('leadlag.out_of_sample'):
+                oos = scan.out_of_sample(window, min_train)
+
+        # Each candidate is reported at the lag where it correlates with the target the most
+        correlation = scan.correlation[:, window]
+        best = np.argmax(np.nan_to_num(np.abs(correlation), nan=-1), axis=1)
+        rows = np.arange(len(values))
+        result = labels.assign(
+            lag=window[best],
+            correlation=correlation[rows, best],
+            granger_f=scan.granger_f[rows, window[best]],
+            granger_df=scan.granger_df[rows, window[best]].astype(int),
+            oos_r2=oos[rows, best],
+            observations=scan.observations[rows, window[best]].astype(int),
+        )
+        result = result[~np.isnan(result['correlation'])]
+        return result.iloc[np.argsort(-np.abs(result['correlation'].to_numpy()), kind='stable')].reset_index(drop=True)
+
+
+def scan_frame(scanner: LeadLagScanner, indicators: pd.DataFrame, target: pd.Series, lags: Tuple[int, int], min_train: int = 24) -> pd.DataFrame:
+    index = pd.DatetimeIndex(sorted(set(target.index) | set(pd.to_datetime(indicators['date']).dt.to_period('M').dt.to_timestamp())), name='date')
+    index = index[(index >= target.index.min()) & (index <= target.index.max())]
+    labels, values = candidate_matrix(indicators, index)
+    return scanner.scan(labels, values, target.reindex(index).to_numpy(dtype=float), lags, min_train)
@@ -0,0 +1,167 @@
+import bisect
+import collections
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+MAX_TRACES = 50
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, label: str, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, label_value: str, value: float):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def snapshot(self) -> Dict[str, Tuple[int, float]]:
+        with self._lock:
+            return {label_value: (series['count'], series['sum']) for label_value, series in self._series.items()}
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                label = f'{self.label}="{_escape(label_value)}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else repr(float(bound))
+                    lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+                lines.append(f'{self.name}_sum{{{label}}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{label}}} {series["count"]}')
+        return '\n'.join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, description: str, label: str):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = collections.Counter()
+
+    def inc(self, label_value: str, amount: float = 1):
+        with self._lock:
+            self._values[label_value] += amount
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            lines += [f'{self.name}{{{self.label}="{_escape(label_value)}"}} {value}' for label_value, value in sorted(self._values.items())]
+        return '\n'.join(lines)
+
+
+stage_seconds = Histogram('stage_seconds', 'Duration of each fetching, processing and rendering stage', 'stage')
+stage_errors = Counter('stage_errors_total', 'Stages that ended with an exception', 'stage')
+events = Counter('events_total', 'Things worth counting that are not stages, like throttled requests', 'event')
+
+# Other modules keep their own statistics, they are read only when metrics are scraped
+_collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+_collectors_lock = threading.Lock()
+
+_trace: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar('trace', default=None)
+_traces = collections.deque(maxlen=MAX_TRACES)
+
+
+def register_stats(name: str, stats: Callable[[], Dict[str, float]]):
+    with _collectors_lock:
+        _collectors[name] = stats
+
+
+def observe(stage: str, seconds: float, started: Optional[float] = None):
+    stage_seconds.observe(stage, seconds)
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((stage, started if started is not None else time.perf_counter() - seconds, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, started)
+
+
+@contextmanager
+def trace(name: str, enabled: bool = True, log: bool = False):
+    # Stages timed anywhere below, including worker threads that were handed this context, become spans
+    if not enabled:
+        yield None
+        return
+
+    spans = []
+    token = _trace.set(spans)
+    started = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+        record = {
+            'name': name,
+            'at': time.time(),
+            'seconds': time.perf_counter() - started,
+            'spans': [{'stage': stage, 'offset': span_start - started, 'seconds': seconds} for stage, span_start, seconds in sorted(spans, key=lambda span: span[1])],
+        }
+        _traces.append(record)
+        if log:
+            print(format_trace(record))
+
+
+def format_trace(record: dict) -> str:
+    lines = [f'Trace {record["name"]} took {record["seconds"]:.3f}s']
+    lines += [f'  +{span["offset"]:8.3f}s {span["stage"]:<32} {span["seconds"]:.3f}s' for span in record['spans']]
+    return '\n'.join(lines)
+
+
+def traces() -> list:
+    return list(_traces)
+
+
+def expose() -> str:
+    parts = [stage_seconds.expose(), stage_errors.expose(), events.expose()]
+    with _collectors_lock:
+        collectors = list(_collectors.items())
+    for name, stats in collectors:
+        lines = [f'# TYPE {name} gauge']
+        try:
+            lines += [f'{name}{{key="{_escape(key)}"}} {float(value)}' for key, value in stats().items()]
+        except Exception as err:
+            lines.append(f'# {name} failed: {_escape(err)}')
+        parts.append('\n'.join(lines))
+    return '\n'.join(parts) + '\n'
+
+
+def routes() -> list:
+    # Mounted on the app itself, so every worker process answers on the port the app is served on
+    from starlette.responses import JSONResponse, PlainTextResponse
+    from starlette.routing import Route
+
+    return [
+        Route('/metrics', lambda request: PlainTextResponse(expose(), media_type='text/plain; version=0.0.4'), methods=['GET']),
+        Route('/traces', lambda request: JSONResponse(traces()), methods=['GET']),
+    ]
@@ -0,0 +1,340 @@
+import itertools
+import threading
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import Metrics
+
+_versions = itertools.count(1)
+
+
+class MonthlyPanel:
+    # Named for the monthly pipeline, the index can be any date grid the preprocessors produce
+    def __init__(self, index: pd.DatetimeIndex, columns: Sequence[Tuple[str, str]], values: np.ndarray):
+        if values.shape != (len(index), len(columns)):
+            raise ValueError(f'Panel values of shape {values.shape} do not match {len(index)} dates and {len(columns)} columns')
+
+        self.index = index
+        self.columns = tuple(columns)
+        self._positions = {column: i for i, column in enumerate(self.columns)}
+
+        # Fortran order keeps every (source, metric) column contiguous, so column() is a plain view
+        self._values = np.asfortranarray(values, dtype=float)
+        self._values.setflags(write=False)
+
+        # Panels are never modified, a new version means new data
+        self.version = next(_versions)
+
+    @classmethod
+    def from_frames(cls, frames: Dict[str, pd.DataFrame]) -> 'MonthlyPanel':
+        index = pd.DatetimeIndex(sorted(set().union(*(frame['date'] for frame in frames.values()))), name='date')
+
+        columns = [(source, metric) for source, frame in frames.items() for metric in frame.columns if metric != 'date']
+        values = np.full((len(index), len(columns)), np.nan, order='F')
+
+        for source, frame in frames.items():
+            rows = index.get_indexer(frame['date'])
+            for metric in frame.columns:
+                if metric != 'date':
+                    values[rows, columns.index((source, metric))] = frame[metric].to_numpy(dtype=float)
+
+        return cls(index, columns, values)
+
+    def has(self, source: str, metric: str) -> bool:
+        return (source, metric) in self._positions
+
+    def sources(self) -> set:
+        return {source for source, _ in self.columns}
+
+    def column(self, source: str, metric: str) -> np.ndarray:
+        if not self.has(source, metric):
+            raise KeyError(f'No column {(source, metric)} in panel with columns {self.columns}')
+        return self._values[:, self._positions[(source, metric)]]
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self._values, index=self.index, columns=pd.MultiIndex.from_tuples(self.columns, names=['source', 'metric']))
+
+
+class _Moments:
+    # Sums over the dates two variables are both observed on, all of them additive, so a date is
+    # a rank one update and a variable one new row and column instead of a pass over the panel.
+    # Updates replace the arrays instead of writing into them, so a copy may share them
+    def __init__(self, labels: List[Hashable], count: np.ndarray, pair_count: np.ndarray, cross: np.ndarray, pair_sum: np.ndarray, pair_square: np.ndarray):
+        self.labels = list(labels)
+        self.count = count
+        self.pair_count = pair_count
+        self.cross = cross
+        self.pair_sum = pair_sum
+        self.pair_square = pair_square
+        # Leading eigenvector of the correlation matrix, a close start for the next panel's
+        self.component: Optional[np.ndarray] = None
+        self._correlation: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_values(cls, labels: Sequence[Hashable], values: np.ndarray) -> '_Moments':
+        observed = ~np.isnan(values)
+        filled = np.where(observed, values, 0.0)
+        mask = observed.astype(float)
+        return cls(labels, mask.sum(axis=0), mask.T @ mask, filled.T @ filled, filled.T @ mask, (filled ** 2).T @ mask)
+
+    def copy(self) -> '_Moments':
+        moments = _Moments(self.labels, self.count, self.pair_count, self.cross, self.pair_sum, self.pair_square)
+        moments.component = self.component
+        moments._correlation = self._correlation
+        return moments
+
+    def add_rows(self, values: np.ndarray, sign: float = 1.0):
+        observed = ~np.isnan(values)
+        filled = np.where(observed, values, 0.0)
+        mask = observed.astype(float)
+        self.count = self.count + sign * mask.sum(axis=0)
+        self.pair_count = self.pair_count + sign * (mask.T @ mask)
+        self.cross = self.cross + sign * (filled.T @ filled)
+        self.pair_sum = self.pair_sum + sign * (filled.T @ mask)
+        self.pair_square = self.pair_square + sign * ((filled ** 2).T @ mask)
+        # Every pair has one more date now
+        self._correlation = None
+
+    def remove(self, labels: Sequence[Hashable]):
+        removed = set(labels)
+        if not removed.intersection(self.labels):
+            return
+        keep = np.array([label not in removed for label in self.labels], dtype=bool)
+        self.labels = [label for label in self.labels if label not in removed]
+        self.count = self.count[keep]
+        for name in ('pair_count', 'cross', 'pair_sum', 'pair_square', '_correlation'):
+            if getattr(self, name) is not None:
+                setattr(self, name, getattr(self, name)[np.ix_(keep, keep)])
+        if self.component is not None:
+            self.component = self.component[keep]
+
+    def add(self, labels: Sequence[Hashable], added: np.ndarray, existing: np.ndarray):
+        # existing holds the current variables on the same dates as added, in self.labels order
+        old_observed, new_observed = ~np.isnan(existing), ~np.isnan(added)
+        old, new = np.where(old_observed, existing, 0.0), np.where(new_observed, added, 0.0)
+        old_mask, new_mask = old_observed.astype(float), new_observed.astype(float)
+
+        def grow(block: np.ndarray, upper: np.ndarray, lower: np.ndarray, corner: np.ndarray) -> np.ndarray:
+            return np.block([[block, upper], [lower, corner]])
+
+        size = len(self.labels)
+        self.count = np.concatenate([self.count, new_mask.sum(axis=0)])
+        self.pair_count = grow(self.pair_count, old_mask.T @ new_mask, new_mask.T @ old_mask, new_mask.T @ new_mask)
+        self.cross = grow(self.cross, old.T @ new, new.T @ old, new.T @ new)
+        self.pair_sum = grow(self.pair_sum, old.T @ new_mask, new.T @ old_mask, new.T @ new_mask)
+        self.pair_square = grow(self.pair_square, (old ** 2).T @ new_mask, (new ** 2).T @ old_mask, (new ** 2).T @ new_mask)
+        self.labels += list(labels)
+
+        # Pairs of the old variables keep their correlation, only the new rows and columns are computed
+        if self._correlation is not None:
+            columns = self._pairwise(slice(None), slice(size, None))
+            self._correlation = grow(self._correlation, columns[:size], columns[:size].T, columns[size:])
+        if self.component is not None:
+            self.component = np.concatenate([self.component, np.zeros(len(labels))])
+
+    def _pairwise(self, rows: slice, columns: slice) -> np.ndarray:
+        # Pairwise complete correlation, every pair over the dates both are observed on.
+        # Slices keep the blocks views of the moments instead of copies
+        block = (rows, columns)
+        transposed = (columns, rows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n = self.pair_count[block]
+            row_sum, column_sum = self.pair_sum[block], self.pair_sum[transposed].T
+            covariance = self.cross[block] - row_sum * column_sum / n
+            row_variance = self.pair_square[block] - row_sum ** 2 / n
+            column_variance = self.pair_square[transposed].T - column_sum ** 2 / n
+            correlation = covariance / np.sqrt(row_variance * column_variance)
+
+        correlation[n < 3] = 0.0
+        np.nan_to_num(correlation, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        np.clip(correlation, -1.0, 1.0, out=correlation)
+        everything = np.arange(len(self.labels))
+        on_diagonal = np.intersect1d(everything[rows], everything[columns])
+        if len(on_diagonal):
+            correlation[on_diagonal - everything[rows][0], on_diagonal - everything[columns][0]] = 1.0
+        return correlation
+
+    def correlation(self) -> np.ndarray:
+        if self._correlation is None:
+            self._correlation = self._pairwise(slice(None), slice(None))
+            self._correlation.setflags(write=False)
+        return self._correlation
+
+    def leading_component(self, tolerance: float = 1e-8, max_iterations: int = 200) -> np.ndarray:
+        correlation = self.correlation()
+        size = len(correlation)
+        if size == 0:
+            return np.zeros(0)
+
+        # A panel a date or a keyword away barely moves the component, power iteration from the
+        # previous one converges in a few matrix-vector products. Without one, queries that share
+        # a factor are mostly positively correlated and equal loadings are a fair start
+        warm = self.component is not None and np.linalg.norm(self.component) > 0
+        vector = self.component / np.linalg.norm(self.component) if warm else np.full(size, 1 / np.sqrt(size))
+
+        for _ in range(max_iterations):
+            # Shifted by the identity, so the largest eigenvalue dominates although pairwise
+            # correlations may leave small negative ones
+            following = correlation @ vector + vector
+            following /= np.linalg.norm(following)
+            converged = np.linalg.norm(following - vector) < tolerance
+            vector = following
+            if converged:
+                Metrics.events.inc('composite.component_updated' if warm else 'composite.component_iterated')
+                break
+        else:
+            # A small gap between the two largest eigenvalues, a full decomposition settles it
+            Metrics.events.inc('composite.component_refit')
+            vector = np.linalg.eigh(correlation)[1][:, -1]
+
+        # Eigenvectors have no sign, the factor rises with most of its queries
+        if vector.sum() < 0:
+            vector = -vector
+        self.component = vector
+        return vector
+
+    def standardize(self, values: np.ndarray) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sums = np.diagonal(self.pair_sum)
+            mean = sums / self.count
+            std = np.sqrt((np.diagonal(self.pair_square) - sums * mean) / (self.count - 1))
+            return (values - mean) / np.where(std > 0, std, np.nan)
+
+
+class KeywordPanel:
+    # keywords x sources x dates, the input of indicators that combine many queries
+    def __init__(self, index: pd.DatetimeIndex, keywords: Sequence[str], columns: Sequence[Tuple[str, str]], values: np.ndarray,
+                 moments: Optional[Dict[str, _Moments]] = None):
+        if values.shape != (len(index), len(keywords), len(columns)):
+            raise ValueError(f'Panel values of shape {values.shape} do not match {len(index)} dates, {len(keywords)} keywords and {len(columns)} columns')
+
+        self.index = index
+        self.keywords = tuple(keywords)
+        self.columns = tuple(columns)
+        self._keyword_positions = {keyword: i for i, keyword in enumerate(self.keywords)}
+        self._positions = {column: i for i, column in enumerate(self.columns)}
+
+        self._values = np.asarray(values, dtype=float)
+        self._values.setflags(write=False)
+        self._moments = moments or {}
+        self._lock = threading.Lock()
+
+        self.version = next(_versions)
+
+    @classmethod
+    def from_long(cls, rows: pd.DataFrame, metrics: Sequence[str] = ('relative_value', 'absolute_value')) -> 'KeywordPanel':
+        # rows are long, with keyword, source, date and metric columns like batch.py writes them
+        dates = pd.to_datetime(rows['date'])
+        index = pd.DatetimeIndex(sorted(dates.unique()), name='date')
+        keywords = list(dict.fromkeys(rows['keyword']))
+        columns = [(source, metric) for source in dict.fromkeys(rows['source']) for metric in metrics
+                   if metric in rows and rows.loc[rows['source'] == source, metric].notna().any()]
+
+        values = np.full((len(index), len(keywords), len(columns)), np.nan)
+        date_rows = index.get_indexer(dates)
+        keyword_rows = pd.Index(keywords).get_indexer(rows['keyword'])
+        for i, (source, metric) in enumerate(columns):
+            selected = (rows['source'] == source).to_numpy()
+            values[date_rows[selected], keyword_rows[selected], i] = rows.loc[selected, metric].to_numpy(dtype=float)
+        return cls(index, keywords, columns, values)
+
+    @classmethod
+    def from_frames(cls, frames: Dict[str, Dict[str, pd.DataFrame]]) -> 'KeywordPanel':
+        # keyword -> source -> preprocessed frame, what Pipeline.preprocess gives for each keyword
+        return cls.from_long(_long_rows(frames))
+
+    def has(self, source: str, metric: str) -> bool:
+        return (source, metric) in self._positions
+
+    def sources(self) -> set:
+        return {source for source, _ in self.columns}
+
+    def matrix(self, source: str, metric: str) -> np.ndarray:
+        if not self.has(source, metric):
+            raise KeyError(f'No column {(source, metric)} in panel with columns {self.columns}')
+        return self._values[:, :, self._positions[(source, metric)]]
+
+    def variables(self, metric: str) -> Tuple[List[Tuple[str, str]], np.ndarray]:
+        # Every (keyword, source) series of one metric, dates x variables
+        labels = [(keyword, source) for source, column_metric in self.columns if column_metric == metric for keyword in self.keywords]
+        columns = [self._positions[(source, metric)] for source, column_metric in self.columns if column_metric == metric]
+        values = self._values[:, :, columns].transpose(0, 2, 1).reshape(len(self.index), -1)
+        return labels, values
+
+    def ordered(self, metric: str, labels: Sequence[Hashable]) -> np.ndarray:
+        own_labels, values = self.variables(metric)
+        positions = {label: i for i, label in enumerate(own_labels)}
+        return values[:, [positions[label] for label in labels]]
+
+    def moments(self, metric: str) -> _Moments:
+        with self._lock:
+            if metric not in self._moments:
+                labels, values = self.variables(metric)
+                self._moments[metric] = _Moments.from_values(labels, values)
+            return self._moments[metric]
+
+    def with_keyword(self, keyword: str, frames: Dict[str, pd.DataFrame]) -> 'KeywordPanel':
+        # Adds a keyword or replaces its series, the moments of this panel carry over with the
+        # keyword's rows and columns swapped instead of being summed up again
+        added = KeywordPanel.from_frames({keyword: frames})
+        index = self.index.union(added.index)
+        keywords = list(self.keywords) + ([keyword] if keyword not in self._keyword_positions else [])
+        columns = list(self.columns) + [column for column in added.columns if column not in self._positions]
+
+        values = np.full((len(index), len(keywords), len(columns)), np.nan)
+        values[np.ix_(index.get_indexer(self.index), np.arange(len(self.keywords)), np.arange(len(self.columns)))] = self._values
+        position = keywords.index(keyword)
+        values[:, position, :] = np.nan
+        values[np.ix_(index.get_indexer(added.index), [position], [columns.index(column) for column in added.columns])] = added._values
+        panel = KeywordPanel(index, keywords, columns, values)
+
+        for metric, moments in self._moments.items():
+            moments = moments.copy()
+            # A replaced series keeps its loading as the start for the next component
+            loadings = dict(zip(moments.labels, moments.component)) if moments.component is not None else {}
+            moments.remove([label for label in moments.labels if label[0] == keyword])
+            new_labels = [label for label in panel.variables(metric)[0] if label[0] == keyword or label not in moments.labels]
+            if new_labels:
+                moments.add(new_labels, panel.ordered(metric, new_labels), panel.ordered(metric, moments.labels))
+                if moments.component is not None:
+                    moments.component[-len(new_labels):] = [loadings.get(label, 0.0) for label in new_labels]
+            panel._moments[metric] = moments
+        return panel
+
+    def without_keyword(self, keyword: str) -> 'KeywordPanel':
+        keep = [i for i, own in enumerate(self.keywords) if own != keyword]
+        panel = KeywordPanel(self.index, [self.keywords[i] for i in keep], self.columns, self._values[:, keep, :])
+        for metric, moments in self._moments.items():
+            moments = moments.copy()
+            moments.remove([label for label in moments.labels if label[0] == keyword])
+            panel._moments[metric] = moments
+        return panel
+
+    def with_month(self, date, values: np.ndarray) -> 'KeywordPanel':
+        # values is keywords x columns for one date, a date already in the panel is replaced
+        date = pd.Timestamp(date)
+        values = np.asarray(values, dtype=float).reshape(len(self.keywords), len(self.columns))
+        index = self.index if date in self.index else self.index.union(pd.DatetimeIndex([date]))
+
+        updated = np.full((len(index), len(self.keywords), len(self.columns)), np.nan)
+        updated[index.get_indexer(self.index)] = self._values
+        row = index.get_loc(date)
+        updated[row] = values
+        panel = KeywordPanel(index, self.keywords, self.columns, updated)
+
+        for metric, moments in self._moments.items():
+            moments = moments.copy()
+            if date in self.index:
+                moments.add_rows(self.ordered(metric, moments.labels)[[self.index.get_loc(date)]], sign=-1.0)
+            moments.add_rows(panel.ordered(metric, moments.labels)[[row]])
+            panel._moments[metric] = moments
+        return panel
+
+
+def _long_rows(frames: Dict[str, Dict[str, pd.DataFrame]]) -> pd.DataFrame:
+    parts = [frame.assign(keyword=keyword, source=source) for keyword, sources in frames.items() for source, frame in sources.items()]
+    if not parts:
+        return pd.DataFrame(columns=['keyword', 'source', 'date', 'relative_value', 'absolute_value'])
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,96 @@
+from typing import Dict, Optional, Sequence, Union
+
+import pandas as pd
+
+import Indicators
+import Metrics
+import Preprocessors
+from DateRange import DateRange
+from GoogleTrendsFetcher import GoogleTrendsFetcher
+from GoogleTrendsScheduler import GoogleTrendsScheduler
+from Panel import KeywordPanel, MonthlyPanel
+from SeriesStore import SeriesStore, fetch_through, fetch_through_batch
+
+GOOGLE = 'google'
+YANDEX = 'yandex'
+
+# Monthly data comes in one request, a finer frequency is stitched from windows Trends answers at it
+GOOGLE_RESOLUTIONS = {
+    Preprocessors.MONTHLY: None,
+    Preprocessors.WEEKLY: GoogleTrendsFetcher.WEEKLY,
+    Preprocessors.DAILY: GoogleTrendsFetcher.DAILY,
+}
+
+INDICATORS = (
+    Indicators.GoogleRelativeIndicator,
+    Indicators.YandexRelativeIndicator,
+    Indicators.YandexAbsoluteIndicator,
+    Indicators.RelativeNormalizedSumIndicator,
+)
+
+# Computed over a KeywordPanel of many keywords, their rows carry COMPOSITE in place of a keyword
+COMPOSITE_INDICATORS = (
+    Indicators.FirstComponentIndicator,
+    Indicators.DiffusionIndexIndicator,
+    Indicators.WeightedZScoreIndicator,
+)
+COMPOSITE = 'composite'
+
+
+def google_months(data: pd.DataFrame):
+    return data.index.strftime('%Y-%m')
+
+
+def yandex_months(data: pd.DataFrame):
+    return Preprocessors.YandexPreprocessor.parse_periods(data['Period']).dt.strftime('%Y-%m')
+
+
+def google_source(freq: str) -> str:
+    # Stitched series are stored apart, a month of days must not be served where weeks were asked for
+    resolution = GOOGLE_RESOLUTIONS[freq]
+    return GOOGLE if resolution is None else f'{GOOGLE}.{resolution}'
+
+
+def fetch_google_data(scheduler: GoogleTrendsScheduler, store: SeriesStore, keyword: str, daterange: DateRange, priority: int = GoogleTrendsScheduler.BATCH,
+                      freq: str = Preprocessors.MONTHLY) -> pd.DataFrame:
+    def fetch_span(span):
+        return scheduler.FetchInterestOverTime([keyword], timeframe=DateRange.from_months(*span).serialize(), priority=priority, resolution=GOOGLE_RESOLUTIONS[freq])
+
+    with Metrics.timed(f'fetch.{GOOGLE}'):
+        return fetch_through(store, google_source(freq), keyword, '', (daterange.start, daterange.end), fetch_span, google_months, rescale_column=keyword)
+
+
+def fetch_google_batch(scheduler: GoogleTrendsScheduler, store: SeriesStore, keywords: Sequence[str], daterange: DateRange, priority: int = GoogleTrendsScheduler.BATCH,
+                       freq: str = Preprocessors.MONTHLY) -> Dict[str, pd.DataFrame]:
+    # Keywords missing the same months share requests, four of them next to an anchor keyword in each
+    def fetch_span(group, span):
+        return scheduler.FetchInterestOverTimeBatch(group, timeframe=DateRange.from_months(*span).serialize(), priority=priority, resolution=GOOGLE_RESOLUTIONS[freq])
+
+    with Metrics.timed(f'fetch.{GOOGLE}.batch'):
+        return fetch_through_batch(store, google_source(freq), keywords, '', (daterange.start, daterange.end), fetch_span, google_months, rescale=True)
+
+
+def fetch_yandex_data(pool, store: SeriesStore, keyword: str, daterange: DateRange) -> pd.DataFrame:
+    with Metrics.timed(f'fetch.{YANDEX}'):
+        return fetch_through(store, YANDEX, keyword, '', (daterange.start, daterange.end), lambda span: pool.FetchInterestOverTime(keyword, span), yandex_months)
+
+
+PREPROCESSORS = {GOOGLE: Preprocessors.GooglePreprocessor, YANDEX: Preprocessors.YandexPreprocessor}
+
+
+def preprocess_source(source: str, data: pd.DataFrame, keyword: str, daterange: Union[DateRange, str], freq: str = Preprocessors.MONTHLY) -> pd.DataFrame:
+    with Metrics.timed(f'preprocess.{source}'):
+        return PREPROCESSORS[source].process(data, keyword, daterange, freq)
+
+
+def preprocess(raw: Dict[str, Optional[pd.DataFrame]], keyword: str, daterange: DateRange, freq: str = Preprocessors.MONTHLY) -> Dict[str, pd.DataFrame]:
+    return {source: preprocess_source(source, data, keyword, daterange, freq) for source, data in raw.items() if data is not None}
+
+
+def indicator_rows(keyword: str, manager: Indicators.IndicatorsManager, panel: Union[MonthlyPanel, KeywordPanel]) -> pd.DataFrame:
+    frames = [manager.compute(indicator, panel).assign(keyword=keyword, indicator=indicator.name) for indicator in manager.get_applicable(panel)]
+    return pd.concat(frames, ignore_index=True).reindex(columns=['keyword', 'indicator', 'date', 'value'])
+
+
+def composite_rows(manager: Indicators.IndicatorsManager, panel: KeywordPanel) -> pd.DataFrame:
+    return indicator_rows(COMPOSITE, manager, panel)
@@ -0,0 +1,107 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from htmltools import HTMLDependency, TagList, tags
+
+import Metrics
+
+DPI = 96
+
+PLOTLY_DEPENDENCY = HTMLDependency(
+    'plotly', '2.32.0',
+    source={'href': 'https://cdn.plot.ly'},
+    script={'src': 'plotly-2.32.0.min.js'},
+)
+
+
+def fingerprint(frame: pd.DataFrame, x: str, y: str) -> str:
+    hashes = pd.util.hash_pandas_object(frame[[x, y]], index=False).to_numpy()
+    return hashlib.blake2b(hashes.tobytes(), digest_size=16).hexdigest()
+
+
+def render_line_png(frame: pd.DataFrame, x: str, y: str, width: float, height: float, pixelratio: float = 1) -> bytes:
+    # matplotlib takes most of a second to import, so it is loaded by the first render or the prewarm
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+
+    # A Figure of its own instead of pyplot's global one, so concurrent sessions can render side by side
+    figure = Figure(figsize=(width / DPI, height / DPI), dpi=DPI * pixelratio, layout='tight')
+    ax = figure.add_subplot()
+    ax.plot(frame[x], frame[y])
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    ax.xaxis.set_major_locator(mdates.DayLocator(interval=365))
+
+    with io.BytesIO() as buf:
+        figure.savefig(buf, format='png')
+        return buf.getvalue()
+
+
+def series_json(frame: pd.DataFrame, x: str, y: str) -> str:
+    # Only the points go to the browser, the chart itself is drawn client side
+    values = frame[y].to_numpy(dtype=float)
+    return json.dumps({
+        'x': frame[x].dt.strftime('%Y-%m-%d').tolist(),
+        'y': np.where(np.isnan(values), None, values).tolist(),
+    })
+
+
+def interactive_chart(element_id: str, frame: pd.DataFrame, x: str, y: str, height: str = '400px') -> TagList:
+    layout = {'xaxis': {'title': x}, 'yaxis': {'title': y}, 'margin': {'t': 10}}
+    return TagList(
+        PLOTLY_DEPENDENCY,
+        tags.div(id=element_id, style=f'height: {height};'),
+        tags.script(
+            f"Plotly.newPlot({json.dumps(element_id)}, [Object.assign({series_json(frame, x, y)}, {{mode: 'lines'}})], "
+            f"{json.dumps(layout)}, {{responsive: true}});"
+        ),
+    )
+
+
+class PlotCache:
+    def __init__(self, directory: str = './.cache/plots', max_entries: int = 256):
+        # render.image serves files, so the rendered pngs live on disk and this only tracks them
+        self._directory = directory
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._paths = OrderedDict()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(self._directory, exist_ok=True)
+
+    def render(self, frame: pd.DataFrame, x: str, y: str, width: float, height: float, pixelratio: float = 1) -> str:
+        key = (fingerprint(frame, x, y), x, y, round(width), round(height), pixelratio)
+
+        with self._lock:
+            if key in self._paths:
+                self._paths.move_to_end(key)
+                self._counters['hits'] += 1
+                return self._paths[key]
+            self._counters['misses'] += 1
+
+        path = os.path.join(self._directory, hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest() + '.png')
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with Metrics.timed('plot.render'), open(tmp_path, 'wb') as f:
+            f.write(render_line_png(frame, x, y, width, height, pixelratio))
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._paths[key] = path
+            self._paths.move_to_end(key)
+            while len(self._paths) > self._max_entries:
+                _, evicted = self._paths.popitem(last=False)
+                self._counters['evictions'] += 1
+                if os.path.exists(evicted):
+                    os.remove(evicted)
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, entries=len(self._paths))
@@ -1,36 +1,117 @@
+from typing import Dict, Tuple, Union
+
+import numpy as np
 import pandas as pd
 
+from DateRange import DateRange
+
+MONTHLY = 'MS'
+WEEKLY = 'W'
+DAILY = 'D'
+
+FREQUENCIES = {MONTHLY: 'Monthly', WEEKLY: 'Weekly', DAILY: 'Daily'}
+
 
 class BasePreprocessor:
     @staticmethod
-    def process(data: pd.DataFrame, keyword: str, serialized_daterange) -> pd.DataFrame:
+    def process(data: pd.DataFrame, keyword: str, serialized_daterange: Union[DateRange, str], freq: str = MONTHLY) -> pd.DataFrame:
         pass
 
+    @classmethod
+    def process_batch(cls, frames: Dict[str, pd.DataFrame], serialized_daterange: Union[DateRange, str], freq: str = MONTHLY) -> Dict[str, pd.DataFrame]:
+        daterange = DateRange.coerce(serialized_daterange)
+        return {keyword: cls.process(data, keyword, daterange, freq) for keyword, data in frames.items()}
+
+
+def _within(result: pd.DataFrame, daterange: DateRange) -> pd.DataFrame:
+    return result[(result['date'] > daterange.start) & (result['date'] < daterange.end)]
+
 
 class YandexPreprocessor(BasePreprocessor):
-    @staticmethod
-    def process(data: pd.DataFrame, keyword: str, serialized_daterange) -> pd.DataFrame:
+    # Wordstat exports English month names regardless of the server locale, '%B' doesn't
+    MONTHS = {name: number for number, name in enumerate(
+        ('january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october', 'november', 'december'), start=1)}
+
+    @classmethod
+    def parse_periods(cls, periods: pd.Series) -> pd.Series:
+        period = periods.astype(str).str.split(' ', n=1, expand=True)
+        months = period[0].str.lower().map(cls.MONTHS)
+        if months.isna().any():
+            raise ValueError(f'Unknown month names in Wordstat periods: {sorted(period[0][months.isna()].unique())}')
+        return pd.to_datetime(period[1].astype('int64') * 100 + months.astype('int64'), format='%Y%m')
+
+    @classmethod
+    def _convert(cls, data: pd.DataFrame) -> pd.DataFrame:
         result = data.rename(columns={'Period': 'date', 'Number of queries': 'absolute_value', 'Percentage of total queries, %': 'relative_value'})
-        result['date'] = pd.to_datetime(result['date'], format='%B %Y')
-        result['absolute_value'] = result['absolute_value'].apply(lambda x: int("".join(str(x).split(" "))))
-        result['relative_value'] = result['relative_value'].apply(lambda x: float(str(x).replace(',', '.')))
+        result['date'] = cls.parse_periods(result['date'])
 
-        result = result[(result['date'] > serialized_daterange.split(" ")[0]) & (result['date'] < serialized_daterange.split(" ")[1])]
+        result['absolute_value'] = result['absolute_value'].astype(str).str.replace(' ', '', regex=False).astype('int64')
+        result['relative_value'] = result['relative_value'].astype(str).str.replace(',', '.', regex=False).astype(float)
         return result
 
+    @staticmethod
+    def _spread(result: pd.DataFrame, daterange: DateRange, freq: str) -> pd.DataFrame:
+        # Wordstat only counts months, on a finer grid every period carries the figures of its month.
+        # Each row is repeated once per grid date in its month, for all keywords of a batch at once
+        dates = pd.date_range(daterange.start, daterange.end, freq=freq)
+        months = dates.to_period('M').to_timestamp()
+        first = months.searchsorted(result['date'], 'left')
+        counts = months.searchsorted(result['date'], 'right') - first
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        spread = result.iloc[np.repeat(np.arange(len(result)), counts)].assign(date=dates[np.repeat(first, counts) + offsets])
+        if spread.index.nlevels > 1:
+            spread.index = pd.MultiIndex.from_arrays([spread.index.get_level_values(0), np.arange(len(spread))])
+            return spread
+        return spread.reset_index(drop=True)
+
+    @classmethod
+    def process(cls, data: pd.DataFrame, keyword: str, serialized_daterange: Union[DateRange, str], freq: str = MONTHLY) -> pd.DataFrame:
+        daterange = DateRange.coerce(serialized_daterange)
+        result = cls._convert(data)
+        if freq != MONTHLY:
+            result = cls._spread(result, daterange, freq)
+        return _within(result, daterange)
+
+    @classmethod
+    def process_batch(cls, frames: Dict[str, pd.DataFrame], serialized_daterange: Union[DateRange, str], freq: str = MONTHLY) -> Dict[str, pd.DataFrame]:
+        if not frames:
+            return {}
+
+        daterange = DateRange.coerce(serialized_daterange)
+        result = cls._convert(pd.concat(frames))
+        if freq != MONTHLY:
+            result = cls._spread(result, daterange, freq)
+        result = _within(result, daterange)
+        parts = dict(tuple(result.groupby(level=0, sort=False)))
+        return {keyword: parts[keyword].droplevel(0) if keyword in parts else result.iloc[0:0].droplevel(0) for keyword in frames}
+
 
 class GooglePreprocessor(BasePreprocessor):
     @staticmethod
-    def process(data: pd.DataFrame, keyword: str, serialized_daterange) -> pd.DataFrame:
-        tmp = data.reset_index()
-        tmp = tmp.rename(columns={keyword: 'relative_value'})
+    def _resample(data: pd.DataFrame, freq: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        resampled = data.resample(freq)
+        return resampled.mean(), resampled.count()
+
+    @classmethod
+    def process(cls, data: pd.DataFrame, keyword: str, serialized_daterange: Union[DateRange, str], freq: str = MONTHLY) -> pd.DataFrame:
+        means, counts = cls._resample(data.rename(columns={keyword: 'relative_value'}), freq)
+
+        # resample also emits periods without any observations, groupby by month never did
+        result = means[counts.max(axis=1) > 0].rename_axis('date').reset_index()
+        return _within(result, DateRange.coerce(serialized_daterange))
 
-        tmp['month'] = tmp['date'].dt.month
-        tmp['year'] = tmp['date'].dt.year
+    @classmethod
+    def process_batch(cls, frames: Dict[str, pd.DataFrame], serialized_daterange: Union[DateRange, str], freq: str = MONTHLY) -> Dict[str, pd.DataFrame]:
+        if not frames:
+            return {}
 
-        result = tmp.groupby(['year', 'month']).mean().reset_index()
-        result['date'] = pd.to_datetime(result[['year', 'month']].assign(day=1))
-        result = result.drop(['year', 'month'], axis=1)
+        daterange = DateRange.coerce(serialized_daterange)
+        means, counts = cls._resample(pd.concat([data[keyword] for keyword, data in frames.items()], axis=1, keys=list(frames)), freq)
 
-        result = result[(result['date'] > serialized_daterange.split(" ")[0]) & (result['date'] < serialized_daterange.split(" ")[1])]
-        return result
\ No newline at end of file
+        results = {}
+        for keyword in frames:
+            observed = counts[keyword].to_numpy() > 0
+            result = pd.DataFrame({'date': means.index[observed], 'relative_value': means[keyword].to_numpy()[observed]})
+            results[keyword] = _within(result, daterange)
+        return results
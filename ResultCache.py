@@ -0,0 +1,89 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 256, ttl: float = 15 * 60):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight: Dict[Hashable, concurrent.futures.Future] = {}
+        self._tasks = set()
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'errors': 0}
+
+    def lookup(self, key: Hashable) -> Tuple[concurrent.futures.Future, bool]:
+        # Returns the future to wait on and whether the caller has to produce the value
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    future = concurrent.futures.Future()
+                    future.set_result(value)
+                    return future, False
+                del self._entries[key]
+
+            if key in self._in_flight:
+                self._counters['coalesced'] += 1
+                return self._in_flight[key], False
+
+            self._counters['misses'] += 1
+            future = concurrent.futures.Future()
+            self._in_flight[key] = future
+            return future, True
+
+    def resolve(self, key: Hashable, future: concurrent.futures.Future, value: Any = None, error: BaseException = None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if error is None:
+                self._entries[key] = (time.monotonic() + self._ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                    self._counters['evictions'] += 1
+            else:
+                self._counters['errors'] += 1
+
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def get(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        future, owner = self.lookup(key)
+        if owner:
+            try:
+                self.resolve(key, future, value=fetch())
+            except Exception as err:
+                self.resolve(key, future, error=err)
+        return future.result()
+
+    async def get_async(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        future, owner = self.lookup(key)
+        if owner:
+            # The fetch runs as its own task, so a cancelled owner doesn't strand the other waiters
+            async def produce():
+                try:
+                    self.resolve(key, future, value=await fetch())
+                except BaseException as err:
+                    self.resolve(key, future, error=err)
+
+            task = asyncio.ensure_future(produce())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries), in_flight=len(self._in_flight))
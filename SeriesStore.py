@@ -0,0 +1,174 @@
+import datetime
+import pickle
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from SqliteDatabase import SqliteDatabase
+
+
+def month_key(date) -> str:
+    return f'{date.year:04d}-{date.month:02d}'
+
+
+def month_range(start, end) -> List[str]:
+    return [str(period) for period in pd.period_range(month_key(start), month_key(end), freq='M')]
+
+
+def month_bounds(month: str) -> Tuple[datetime.date, datetime.date]:
+    period = pd.Period(month, freq='M')
+    return period.start_time.date(), period.end_time.date()
+
+
+def month_end_timestamp(month: str) -> float:
+    year, number = int(month[:4]), int(month[5:])
+    return datetime.datetime(year + number // 12, number % 12 + 1, 1).timestamp()
+
+
+def shift_month(month: str, offset: int) -> str:
+    return str(pd.Period(month, freq='M') + offset)
+
+
+def _contiguous_spans(months: Sequence[str]) -> List[Tuple[str, str]]:
+    spans = []
+    for month in months:
+        if spans and shift_month(spans[-1][1], 1) == month:
+            spans[-1] = (spans[-1][0], month)
+        else:
+            spans.append((month, month))
+    return spans
+
+
+class SeriesStore(SqliteDatabase):
+    def __init__(self, path: str = './.cache/series.sqlite3', partial_ttl: float = 6 * 60 * 60, ttl: Optional[float] = None):
+        super().__init__(path, [
+            'CREATE TABLE IF NOT EXISTS months ('
+            'source TEXT NOT NULL, keyword TEXT NOT NULL, geo TEXT NOT NULL, month TEXT NOT NULL, '
+            'fetched_at REAL NOT NULL, payload BLOB NOT NULL, '
+            'PRIMARY KEY (source, keyword, geo, month))',
+        ])
+        self._partial_ttl = partial_ttl
+        self._ttl = ttl
+
+    def _is_fresh(self, month: str, fetched_at: float, now: float) -> bool:
+        # a month fetched before it was over was still being filled upstream, so it expires much
+        # sooner, also once it has ended, which is when its final figures are fetched
+        if fetched_at < month_end_timestamp(month):
+            return now - fetched_at < self._partial_ttl
+        return self._ttl is None or now - fetched_at < self._ttl
+
+    def load(self, source: str, keyword: str, geo: str, months: Sequence[str]) -> Dict[str, pd.DataFrame]:
+        if not months:
+            return {}
+
+        rows = self._connection().execute(
+            'SELECT month, fetched_at, payload FROM months '
+            'WHERE source = ? AND keyword = ? AND geo = ? AND month BETWEEN ? AND ?',
+            (source, keyword, geo, min(months), max(months)),
+        ).fetchall()
+
+        now = time.time()
+        wanted = set(months)
+        return {
+            month: pickle.loads(payload)
+            for month, fetched_at, payload in rows
+            if month in wanted and self._is_fresh(month, fetched_at, now)
+        }
+
+    def save(self, source: str, keyword: str, geo: str, frames: Dict[str, pd.DataFrame]):
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO months (source, keyword, geo, month, fetched_at, payload) VALUES (?, ?, ?, ?, ?, ?)',
+                [(source, keyword, geo, month, now, pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)) for month, frame in frames.items()],
+            )
+
+    def invalidate(self, source: Optional[str] = None, keyword: Optional[str] = None, geo: Optional[str] = None):
+        conditions = [(column, value) for column, value in (('source', source), ('keyword', keyword), ('geo', geo)) if value is not None]
+        where = ' AND '.join(f'{column} = ?' for column, _ in conditions) or '1'
+        with self._connection() as conn:
+            conn.execute(f'DELETE FROM months WHERE {where}', [value for _, value in conditions])
+
+
+def _split_by_month(data: pd.DataFrame, month_of: Callable[[pd.DataFrame], Sequence[str]]) -> Dict[str, pd.DataFrame]:
+    if data.empty:
+        return {}
+    return {month: part for month, part in data.groupby(np.asarray(month_of(data)), sort=False)}
+
+
+def _planned_spans(cached: Dict[str, pd.DataFrame], months: Sequence[str], rescale: bool) -> List[Tuple[str, str, Optional[str], datetime.date, datetime.date]]:
+    # The missing months in contiguous spans, each with the dates to fetch it over
+    planned = []
+    for first, last in _contiguous_spans([month for month in months if month not in cached]):
+        start, end = month_bounds(first)[0], month_bounds(last)[1]
+
+        # relative sources are scaled to the maximum of the requested window, so a neighbouring
+        # stored month is fetched again and used to bring the new span onto the stored scale
+        overlap = None
+        if rescale:
+            for candidate in (shift_month(first, -1), shift_month(last, 1)):
+                if candidate in cached and not cached[candidate].empty:
+                    overlap = candidate
+                    break
+            if overlap is not None:
+                start, end = min(start, month_bounds(overlap)[0]), max(end, month_bounds(overlap)[1])
+
+        planned.append((first, last, overlap, start, end))
+    return planned
+
+
+def fetch_through(store: SeriesStore, source: str, keyword: str, geo: str, daterange,
+                  fetch: Callable[[Tuple[datetime.date, datetime.date]], pd.DataFrame],
+                  month_of: Callable[[pd.DataFrame], Sequence[str]],
+                  rescale_column: Optional[str] = None) -> pd.DataFrame:
+    months = month_range(*daterange)
+    cached = store.load(source, keyword, geo, months)
+    empty = None
+
+    for first, last, overlap, start, end in _planned_spans(cached, months, rescale_column is not None):
+        fetched = fetch((start, end))
+        empty = fetched.iloc[0:0]
+        parts = _split_by_month(fetched, month_of)
+
+        if overlap is not None and overlap in parts:
+            stored_level = cached[overlap][rescale_column].mean()
+            fetched_level = parts[overlap][rescale_column].mean()
+            if stored_level > 0 and fetched_level > 0:
+                ratio = stored_level / fetched_level
+                parts = {month: part.assign(**{rescale_column: part[rescale_column] * ratio}) for month, part in parts.items()}
+
+        span = {month: parts.get(month, empty) for month in month_range(start, end) if first <= month <= last}
+        store.save(source, keyword, geo, span)
+        cached.update(span)
+
+    frames = [cached[month] for month in months if not cached[month].empty]
+    if not frames:
+        return empty if empty is not None else cached[months[0]]
+    return pd.concat(frames)
+
+
+def fetch_through_batch(store: SeriesStore, source: str, keywords: Sequence[str], geo: str, daterange,
+                        fetch: Callable[[List[str], Tuple[datetime.date, datetime.date]], pd.DataFrame],
+                        month_of: Callable[[pd.DataFrame], Sequence[str]],
+                        rescale: bool = False) -> Dict[str, pd.DataFrame]:
+    # Keywords missing the same dates are fetched together, fetch returns a column for each of them.
+    # Every keyword is still stored on its own, rescaled by its own column with rescale set
+    months = month_range(*daterange)
+    groups: Dict[Tuple[datetime.date, datetime.date], List[str]] = {}
+    for keyword in keywords:
+        for _, _, _, start, end in _planned_spans(store.load(source, keyword, geo, months), months, rescale):
+            groups.setdefault((start, end), []).append(keyword)
+
+    fetched = {}
+    for span, group in groups.items():
+        data = fetch(group, span)
+        fetched.update({(keyword, span): data[[keyword]] for keyword in group})
+
+    def fetch_one(keyword):
+        # A span nobody planned, stored or expired meanwhile by another writer, is fetched alone
+        return lambda span: fetched.pop((keyword, span)) if (keyword, span) in fetched else fetch([keyword], span)[[keyword]]
+
+    return {keyword: fetch_through(store, source, keyword, geo, daterange, fetch_one(keyword), month_of, rescale_column=keyword if rescale else None)
+            for keyword in keywords}
@@ -0,0 +1,88 @@
+import threading
+
+import Metrics
+import Startup
+
+with Startup.stage('import GoogleTrendsScheduler'):
+    from GoogleTrendsScheduler import GoogleTrendsScheduler
+with Startup.stage('import LeadLag'):
+    from LeadLag import LeadLagScanner
+with Startup.stage('import Plots'):
+    from Plots import PlotCache
+with Startup.stage('import ResultCache'):
+    from ResultCache import ResultCache
+with Startup.stage('import SeriesStore'):
+    from SeriesStore import SeriesStore
+with Startup.stage('import Watchlist'):
+    from Pipeline import GOOGLE, YANDEX
+    from Watchlist import Watchlist, WatchlistRefresher
+with Startup.stage('import WordstatPool'):
+    from WordstatPool import WordstatPool
+
+GOOGLE_REQUESTS_PER_SECOND = 0.2
+GOOGLE_BURST = 3
+GOOGLE_WORKERS = 1
+GOOGLE_PROXIES = []
+GOOGLE_USER_AGENTS = []
+WORDSTAT_WORKERS = 2
+WORDSTAT_BROWSERLESS = False
+# Starting Chrome costs every process a few seconds and is wasted on Google-only users
+WORDSTAT_PREWARM_BROWSERS = False
+FETCH_CACHE_ENTRIES = 256
+FETCH_CACHE_TTL = 15 * 60
+PLOT_CACHE_ENTRIES = 256
+LEAD_LAG_CACHE_ENTRIES = 16
+# Watched keywords are refreshed in the app every so many seconds, None leaves it to a `python watch.py run` sidecar.
+# Nothing is fetched until a keyword is watched, and the refreshes queue behind the sessions' requests. Every worker
+# process starts a refresher, a lease in the watchlist database lets only one of them, or a running sidecar, refresh
+WATCHLIST_REFRESH_INTERVAL = 60 * 60
+# Recent request traces on /traces, Prometheus text on /metrics is always served by app.py
+TRACE_REQUESTS = False
+
+# main.py is executed once per Shiny session, objects that have to be shared
+# by all sessions of the process live here
+with Startup.stage('init SeriesStore'):
+    series_store = SeriesStore()
+with Startup.stage('init GoogleTrendsScheduler'):
+    google_scheduler = GoogleTrendsScheduler(
+        rate=GOOGLE_REQUESTS_PER_SECOND, burst=GOOGLE_BURST, workers=GOOGLE_WORKERS,
+        identities=GoogleTrendsScheduler.BuildIdentities(GOOGLE_PROXIES, GOOGLE_USER_AGENTS),
+    )
+with Startup.stage('init WordstatPool'):
+    wordstat_pool = WordstatPool(size=WORDSTAT_WORKERS, browserless=WORDSTAT_BROWSERLESS)
+fetch_cache = ResultCache(max_entries=FETCH_CACHE_ENTRIES, ttl=FETCH_CACHE_TTL)
+plot_cache = PlotCache(max_entries=PLOT_CACHE_ENTRIES)
+lead_lag_scanner = LeadLagScanner(cache_size=LEAD_LAG_CACHE_ENTRIES)
+watchlist = Watchlist()
+watchlist_refresher = None
+if WATCHLIST_REFRESH_INTERVAL is not None:
+    # Background refreshes queue behind the sessions' requests, Wordstat joins once a user has logged in
+    watchlist_refresher = WatchlistRefresher.for_services(watchlist, series_store, google_scheduler, wordstat_pool, interval=WATCHLIST_REFRESH_INTERVAL).start(
+        lambda: [GOOGLE, YANDEX] if wordstat_pool.IsAuthorized() else [GOOGLE])
+
+Metrics.register_stats('fetch_cache', fetch_cache.stats)
+Metrics.register_stats('plot_cache', plot_cache.stats)
+Metrics.register_stats('startup_seconds', Startup.report)
+Metrics.register_stats('wordstat_workers_alive', lambda: {f'{name} {state}': alive for name, (alive, state) in wordstat_pool.HealthCheck().items()})
+
+_prewarm_started = threading.Event()
+
+
+def _prewarm():
+    with Startup.stage('prewarm matplotlib'):
+        import matplotlib.figure  # noqa: F401
+    with Startup.stage('prewarm selenium'):
+        import YandexWordstat2Scraper  # noqa: F401
+    if WORDSTAT_PREWARM_BROWSERS:
+        with Startup.stage('prewarm wordstat browsers'):
+            for future in wordstat_pool.Prewarm():
+                future.exception()
+    print(Startup.format_report('Prewarm finished'))
+
+
+def prewarm():
+    # Loads what the first plot and the first Wordstat request need, once the app already serves pages
+    if _prewarm_started.is_set():
+        return
+    _prewarm_started.set()
+    threading.Thread(target=_prewarm, name='prewarm', daemon=True).start()
@@ -0,0 +1,28 @@
+import os
+import sqlite3
+import threading
+from typing import Sequence
+
+
+class SqliteDatabase:
+    # A file under ./.cache by default, so the app, batch.py and the sidecars in other processes share it
+    def __init__(self, path: str, schema: Sequence[str]):
+        self._path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connection() as conn:
+            for statement in schema:
+                conn.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, so every thread gets its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,43 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+# Imported first by main.py, so this is close enough to the moment the app started loading
+STARTED_AT = time.perf_counter()
+
+_lock = threading.Lock()
+_stages: Dict[str, float] = {}
+_reported = False
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        # main.py runs once per session, only the first, cold run of a stage is of interest
+        with _lock:
+            _stages.setdefault(name, time.perf_counter() - started)
+
+
+def report() -> Dict[str, float]:
+    with _lock:
+        return dict(_stages)
+
+
+def format_report(title: str) -> str:
+    lines = [f'{title} in {time.perf_counter() - STARTED_AT:.3f}s']
+    lines += [f'  {name:<32} {seconds:.3f}s' for name, seconds in report().items()]
+    return '\n'.join(lines)
+
+
+def ready():
+    global _reported
+    with _lock:
+        if _reported:
+            return
+        _reported = True
+        _stages.setdefault('ready', time.perf_counter() - STARTED_AT)
+    print(format_report('Application ready'))
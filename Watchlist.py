@@ -0,0 +1,270 @@
+import datetime
+import os
+import pickle
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+import Indicators
+import Metrics
+import Pipeline
+import Preprocessors
+from DateRange import DateRange
+from GoogleTrendsScheduler import GoogleTrendsScheduler
+from Panel import KeywordPanel, MonthlyPanel
+from SeriesStore import SeriesStore, month_key
+from SqliteDatabase import SqliteDatabase
+
+
+@dataclass(frozen=True)
+class WatchedKeyword:
+    keyword: str
+    freq: str
+    start: str
+
+
+@dataclass
+class WatchResult:
+    keyword: str
+    freq: str
+    daterange: DateRange
+    refreshed_at: float
+    raw: Dict[str, pd.DataFrame]
+    preprocessed: Dict[str, pd.DataFrame]
+    indicators: pd.DataFrame
+
+    def covers(self, daterange: DateRange, sources: Sequence[str]) -> bool:
+        return self.daterange.start <= daterange.start and daterange.end <= self.daterange.end and set(sources) <= set(self.raw)
+
+
+class Watchlist(SqliteDatabase):
+    # Lives next to the series store, so the app and a refresher in another process share it
+    def __init__(self, path: str = './.cache/watchlist.sqlite3'):
+        super().__init__(path, [
+            'CREATE TABLE IF NOT EXISTS watched ('
+            'keyword TEXT NOT NULL, freq TEXT NOT NULL, start TEXT NOT NULL, added_at REAL NOT NULL, '
+            'PRIMARY KEY (keyword, freq))',
+            'CREATE TABLE IF NOT EXISTS results ('
+            'keyword TEXT NOT NULL, freq TEXT NOT NULL, refreshed_at REAL NOT NULL, payload BLOB NOT NULL, '
+            'PRIMARY KEY (keyword, freq))',
+            'CREATE TABLE IF NOT EXISTS composites (freq TEXT PRIMARY KEY, refreshed_at REAL NOT NULL, payload BLOB NOT NULL)',
+            'CREATE TABLE IF NOT EXISTS leases ('
+            'name TEXT PRIMARY KEY, holder TEXT NOT NULL, priority INTEGER NOT NULL, expires_at REAL NOT NULL)',
+        ])
+
+    def add(self, keyword: str, start, freq: str = Preprocessors.MONTHLY):
+        # Watching a keyword again from an earlier month widens what it covers
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT INTO watched (keyword, freq, start, added_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (keyword, freq) DO UPDATE SET start = MIN(start, excluded.start)',
+                (keyword, freq, month_key(pd.Timestamp(start)), time.time()),
+            )
+
+    def remove(self, keyword: str, freq: Optional[str] = None):
+        conditions = [('keyword', keyword)] + ([('freq', freq)] if freq is not None else [])
+        where = ' AND '.join(f'{column} = ?' for column, _ in conditions)
+        with self._connection() as conn:
+            for table in ('watched', 'results'):
+                conn.execute(f'DELETE FROM {table} WHERE {where}', [value for _, value in conditions])
+
+    def entries(self) -> List[WatchedKeyword]:
+        rows = self._connection().execute('SELECT keyword, freq, start FROM watched ORDER BY added_at').fetchall()
+        return [WatchedKeyword(*row) for row in rows]
+
+    def refreshed_at(self) -> Dict[WatchedKeyword, float]:
+        rows = self._connection().execute(
+            'SELECT w.keyword, w.freq, w.start, r.refreshed_at FROM watched w JOIN results r ON r.keyword = w.keyword AND r.freq = w.freq'
+        ).fetchall()
+        return {WatchedKeyword(keyword, freq, start): refreshed_at for keyword, freq, start, refreshed_at in rows}
+
+    def save(self, result: WatchResult):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results (keyword, freq, refreshed_at, payload) VALUES (?, ?, ?, ?)',
+                (result.keyword, result.freq, result.refreshed_at, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)),
+            )
+
+    def result(self, keyword: str, freq: str = Preprocessors.MONTHLY) -> Optional[WatchResult]:
+        row = self._connection().execute('SELECT payload FROM results WHERE keyword = ? AND freq = ?', (keyword, freq)).fetchone()
+        return pickle.loads(row[0]) if row is not None else None
+
+    def results(self, freq: str = Preprocessors.MONTHLY) -> List[WatchResult]:
+        rows = self._connection().execute('SELECT payload FROM results WHERE freq = ?', (freq,)).fetchall()
+        return [pickle.loads(payload) for payload, in rows]
+
+    def save_composites(self, freq: str, rows: pd.DataFrame):
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO composites (freq, refreshed_at, payload) VALUES (?, ?, ?)',
+                         (freq, time.time(), pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def hold_lease(self, name: str, holder: str, ttl: float, priority: int = 0) -> bool:
+        # Taken or renewed when it is free, expired, already ours or held with a lower priority
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT INTO leases (name, holder, priority, expires_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, priority = excluded.priority, expires_at = excluded.expires_at '
+                'WHERE leases.holder = excluded.holder OR leases.expires_at < ? OR leases.priority < excluded.priority',
+                (name, holder, priority, now + ttl, now),
+            )
+            row = conn.execute('SELECT holder FROM leases WHERE name = ?', (name,)).fetchone()
+        return row[0] == holder
+
+    def release_lease(self, name: str, holder: str):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+
+    def indicator_rows(self, freq: str = Preprocessors.MONTHLY) -> pd.DataFrame:
+        # Precomputed indicators of every watched keyword and the composites of all of them,
+        # shaped like batch.py's indicators.csv
+        frames = [result.indicators for result in self.results(freq)]
+        row = self._connection().execute('SELECT payload FROM composites WHERE freq = ?', (freq,)).fetchone()
+        if row is not None:
+            frames.append(pickle.loads(row[0]))
+        if not frames:
+            return pd.DataFrame(columns=['keyword', 'indicator', 'date', 'value'])
+        return pd.concat(frames, ignore_index=True)
+
+
+class WatchlistRefresher:
+    # A refresh asks the series store for everything from the keyword's first month to the current
+    # one. Finished months are stored already, so only the months that were incomplete when last
+    # fetched go upstream, for Google with one stored month to rescale them by
+    LEASE = 'refresher'
+
+    def __init__(self, watchlist: Watchlist, fetchers: Dict[str, Callable[[List[str], DateRange, str], Dict[str, pd.DataFrame]]],
+                 interval: float = 60 * 60, manager: Indicators.IndicatorsManager = None, lease_ttl: float = 15 * 60, priority: int = 0):
+        self.watchlist = watchlist
+        self.fetchers = fetchers
+        self.interval = interval
+        # Every app worker and a watch.py sidecar run a refresher against the same watchlist, only the
+        # one holding the lease refreshes, so each keyword goes upstream once. A sidecar takes it over
+        # with a higher priority, a holder that died loses it after lease_ttl
+        self.lease_ttl = lease_ttl
+        self.priority = priority
+        self._holder = f'{socket.gethostname()}:{os.getpid()}:{id(self)}'
+        self.manager = manager or Indicators.IndicatorsManager(Pipeline.INDICATORS)
+        self.composite_manager = Indicators.IndicatorsManager(Pipeline.COMPOSITE_INDICATORS)
+
+        # One panel of all watched keywords per frequency, a refreshed keyword swaps its own series
+        # in, so the composites are updated instead of being fitted again on every keyword
+        self._panels: Dict[str, KeywordPanel] = {}
+
+        self._failed_at: Dict[WatchedKeyword, float] = {}
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def for_services(cls, watchlist: Watchlist, store: SeriesStore, scheduler: Optional[GoogleTrendsScheduler] = None, pool=None, **kwargs) -> 'WatchlistRefresher':
+        fetchers = {}
+        if scheduler is not None:
+            fetchers[Pipeline.GOOGLE] = lambda keywords, daterange, freq: Pipeline.fetch_google_batch(scheduler, store, keywords, daterange, freq=freq)
+        if pool is not None:
+            fetchers[Pipeline.YANDEX] = lambda keywords, daterange, freq: {keyword: Pipeline.fetch_yandex_data(pool, store, keyword, daterange) for keyword in keywords}
+        return cls(watchlist, fetchers, **kwargs)
+
+    def refresh(self, entry: WatchedKeyword, sources: Optional[Sequence[str]] = None) -> WatchResult:
+        return self.refresh_group([entry], sources)[0]
+
+    def refresh_group(self, entries: Sequence[WatchedKeyword], sources: Optional[Sequence[str]] = None) -> List[WatchResult]:
+        # Entries of one frequency and first month, every source fetches them in one go, Google in shared requests
+        freq, start = entries[0].freq, entries[0].start
+        daterange = DateRange.from_months(pd.Timestamp(f'{start}-01'), pd.Timestamp(datetime.date.today()))
+        keywords = [entry.keyword for entry in entries]
+        sources = [source for source in self.fetchers if sources is None or source in sources]
+        if not sources:
+            raise RuntimeError(f'No source to refresh {", ".join(keywords)} from, expected some of {list(self.fetchers)}')
+
+        results = []
+        with Metrics.timed('watchlist.refresh'):
+            fetched = {source: self.fetchers[source](keywords, daterange, freq) for source in sources}
+            for keyword in keywords:
+                raw = {source: data[keyword] for source, data in fetched.items()}
+                preprocessed = Pipeline.preprocess(raw, keyword, daterange, freq)
+                indicators = Pipeline.indicator_rows(keyword, self.manager, MonthlyPanel.from_frames(preprocessed))
+                results.append(WatchResult(keyword, freq, daterange, time.time(), raw, preprocessed, indicators))
+
+        for result in results:
+            self.watchlist.save(result)
+            if freq in self._panels:
+                self._panels[freq] = self._panels[freq].with_keyword(result.keyword, result.preprocessed)
+        return results
+
+    def refresh_composites(self, freq: str):
+        watched = {entry.keyword for entry in self.watchlist.entries() if entry.freq == freq}
+        panel = self._panels.get(freq)
+        if panel is None:
+            panel = KeywordPanel.from_frames({result.keyword: result.preprocessed for result in self.watchlist.results(freq) if result.keyword in watched})
+        for keyword in set(panel.keywords) - watched:
+            panel = panel.without_keyword(keyword)
+        self._panels[freq] = panel
+
+        if len(panel.keywords) >= 2:
+            with Metrics.timed('watchlist.composites'):
+                self.watchlist.save_composites(freq, Pipeline.composite_rows(self.composite_manager, panel))
+
+    def due(self, now: Optional[float] = None) -> List[WatchedKeyword]:
+        now = time.time() if now is None else now
+        refreshed = self.watchlist.refreshed_at()
+        # A failed keyword waits a whole interval as well instead of going upstream on every pass
+        return [entry for entry in self.watchlist.entries() if now - max(refreshed.get(entry, 0), self._failed_at.get(entry, 0)) >= self.interval]
+
+    def refresh_due(self, sources: Optional[Sequence[str]] = None) -> int:
+        groups: Dict[tuple, List[WatchedKeyword]] = {}
+        for entry in self.due():
+            groups.setdefault((entry.freq, entry.start), []).append(entry)
+
+        refreshed = 0
+        frequencies = set()
+        for (freq, _), entries in groups.items():
+            if self._stopped.is_set() or not self.watchlist.hold_lease(self.LEASE, self._holder, self.lease_ttl, self.priority):
+                break
+            try:
+                self.refresh_group(entries, sources)
+                for entry in entries:
+                    self._failed_at.pop(entry, None)
+                frequencies.add(freq)
+                refreshed += len(entries)
+            except Exception as err:
+                for entry in entries:
+                    self._failed_at[entry] = time.time()
+                Metrics.events.inc('watchlist.failed', len(entries))
+                print(f'Failed to refresh watched keywords {", ".join(entry.keyword for entry in entries)}: {err}')
+
+        for freq in frequencies:
+            try:
+                self.refresh_composites(freq)
+            except Exception as err:
+                Metrics.events.inc('watchlist.failed')
+                print(f'Failed to refresh composite indicators: {err}')
+        return refreshed
+
+    def _loop(self, sources: Optional[Callable[[], Sequence[str]]]):
+        while not self._stopped.is_set():
+            self.refresh_due(sources() if sources is not None else None)
+            # A pass is cheap when nothing is due, so a keyword added meanwhile waits at most a minute
+            self._wake.wait(min(self.interval, 60))
+            self._wake.clear()
+
+    def start(self, sources: Optional[Callable[[], Sequence[str]]] = None) -> 'WatchlistRefresher':
+        # sources() picks what a pass may fetch, e.g. Wordstat only once the pool is authorized
+        self._thread = threading.Thread(target=self._loop, args=(sources,), name='watchlist-refresher', daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.watchlist.release_lease(self.LEASE, self._holder)
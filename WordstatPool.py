@@ -0,0 +1,257 @@
+import concurrent.futures
+import contextvars
+import os
+import queue
+import threading
+
+import Metrics
+from YandexWordstatApiFetcher import YandexWordstatApiFetcher
+
+
+def DefaultScraperFactory(**kwargs):
+  # selenium and undetected_chromedriver are only imported once a browser is actually needed
+  from YandexWordstat2Scraper import YandexWordstatScraper
+  return YandexWordstatScraper(**kwargs)
+
+
+class _SharedBrowser():
+  def __init__(self, scraper_factory, download_dir):
+    self.scraper_factory = scraper_factory
+    self.download_dir = download_dir
+
+    self.__lock = threading.Lock()
+    self.__scraper = None
+    self.__credentials = None
+    self.__cookies = None
+    self.__cookies_generation = 0
+
+  def __Ready(self, credentials):
+    if self.__scraper is not None and not self.__scraper.IsAlive():
+      self.__scraper.Quit()
+      self.__scraper = None
+
+    if self.__scraper is None:
+      self.__scraper = self.scraper_factory(download_dir=self.download_dir)
+      self.__credentials = None
+
+    if self.__credentials != credentials:
+      self.__scraper.DoAuth(*credentials)
+      self.__cookies = self.__scraper.ExportCookies()
+      self.__cookies_generation += 1
+      self.__credentials = credentials
+
+    return self.__scraper
+
+  def ExportCookies(self, login, password, expired=None):
+    # expired is the generation of cookies the data endpoint turned down. Unless another worker
+    # has had them replaced meanwhile, the browser logs in again for a fresh session
+    with self.__lock:
+      if expired is not None and expired == self.__cookies_generation:
+        self.__credentials = None
+      self.__Ready((login, password))
+      return self.__cookies, self.__cookies_generation
+
+  def FetchInterestOverTime(self, credentials, keyword, timeframe):
+    with self.__lock:
+      return self.__Ready(credentials).FetchInterestOverTime(keyword, timeframe)
+
+  def Quit(self):
+    with self.__lock:
+      if self.__scraper is not None:
+        self.__scraper.Quit()
+        self.__scraper = None
+
+
+class _BrowserlessWorker():
+  def __init__(self, browser, api_fetcher=None):
+    self.browser = browser
+    self.api_fetcher = api_fetcher or YandexWordstatApiFetcher()
+    self.credentials = None
+    self.cookies_generation = None
+    self.alive = True
+
+  def IsAlive(self):
+    # Closed, or turned down by the data endpoint even with fresh cookies, the pool replaces it
+    return self.alive
+
+  def Quit(self):
+    self.alive = False
+    self.api_fetcher.Close()
+
+  def __LoadCookies(self, expired=None):
+    cookies, self.cookies_generation = self.browser.ExportCookies(*self.credentials, expired=expired)
+    self.api_fetcher.LoadCookies(cookies)
+
+  def DoAuth(self, login, password):
+    self.credentials = (login, password)
+    self.__LoadCookies()
+
+  def FetchInterestOverTime(self, keyword, timeframe):
+    try:
+      return self.api_fetcher.FetchInterestOverTime(keyword, timeframe)
+    except Exception as err:
+      if self.credentials is None:
+        raise
+      failure = err
+
+    # Expired cookies are replaced and the data endpoint is asked once more before paying for a scrape
+    if YandexWordstatApiFetcher.IsAuthError(failure):
+      Metrics.events.inc("wordstat.cookies_refreshed")
+      self.__LoadCookies(expired=self.cookies_generation)
+      try:
+        return self.api_fetcher.FetchInterestOverTime(keyword, timeframe)
+      except Exception as err:
+        self.alive = not YandexWordstatApiFetcher.IsAuthError(err)
+
+    Metrics.events.inc("wordstat.browser_fallback")
+    return self.browser.FetchInterestOverTime(self.credentials, keyword, timeframe)
+
+
+class WordstatPool():
+  def __init__(self, size=2, download_root=".tmp", max_attempts=2, recycle_after=200, health_check_interval=60, browserless=False, scraper_factory=DefaultScraperFactory):
+    self.size = size
+    self.download_root = download_root
+    self.max_attempts = max_attempts
+    self.recycle_after = recycle_after
+    self.health_check_interval = health_check_interval
+    self.scraper_factory = scraper_factory
+    self.browserless = browserless
+
+    # In browserless mode workers are plain HTTP sessions, one shared browser only logs in
+    # and exports its cookies, or serves as the fallback when the data endpoint fails
+    self.__browser = _SharedBrowser(scraper_factory, os.path.join(download_root, "browser")) if browserless else None
+
+    self.__jobs = queue.Queue()
+    self.__credentials = None
+    self.__auth_generation = 0
+    self.__authorized = False
+    self.__state_lock = threading.Lock()
+    self.__health = ["idle"] * size
+
+    # Browsers are started lazily by the workers themselves, so creating a pool is cheap
+    self.__threads = [threading.Thread(target=self.__WorkerLoop, args=(i,), name=f"wordstat-{i}", daemon=True) for i in range(size)]
+    for thread in self.__threads:
+      thread.start()
+
+  def __Submit(self, job):
+    future = concurrent.futures.Future()
+    # The job runs in the submitter's context, so its timings land in the submitter's trace
+    self.__jobs.put((job, future, contextvars.copy_context()))
+    return future
+
+  def __StartScraper(self, index):
+    if self.browserless:
+      return _BrowserlessWorker(self.__browser)
+    with Metrics.timed("wordstat.start"):
+      return self.scraper_factory(download_dir=os.path.join(self.download_root, f"worker-{index}"))
+
+  def __WorkerLoop(self, index):
+    scraper = None
+    scraper_generation = None
+    jobs_done = 0
+
+    while True:
+      try:
+        item = self.__jobs.get(timeout=self.health_check_interval)
+      except queue.Empty:
+        if scraper is not None and not scraper.IsAlive():
+          scraper.Quit()
+          scraper = None
+          self.__health[index] = "recycled"
+        continue
+
+      if item is None:
+        break
+
+      job, future, context = item
+      if not future.set_running_or_notify_cancel():
+        continue
+
+      for attempt in range(self.max_attempts):
+        try:
+          if scraper is not None and (not scraper.IsAlive() or jobs_done >= self.recycle_after):
+            scraper.Quit()
+            scraper = None
+
+          if scraper is None:
+            self.__health[index] = "starting"
+            scraper = context.run(self.__StartScraper, index)
+            scraper_generation = None
+            jobs_done = 0
+
+          with self.__state_lock:
+            credentials, generation = self.__credentials, self.__auth_generation
+          if credentials is not None and scraper_generation != generation:
+            self.__health[index] = "authorizing"
+            context.run(scraper.DoAuth, *credentials)
+            scraper_generation = generation
+
+          self.__health[index] = "busy"
+          result = context.run(job, scraper)
+          jobs_done += 1
+          self.__health[index] = "idle"
+          future.set_result(result)
+          break
+        except Exception as err:
+          self.__health[index] = "failed"
+          Metrics.events.inc("wordstat.job_failed")
+          # A dead browser is replaced, a live one is logged in again before the retry
+          if scraper is not None and not scraper.IsAlive():
+            scraper.Quit()
+            scraper = None
+          scraper_generation = None
+
+          if attempt + 1 == self.max_attempts:
+            future.set_exception(err)
+
+    if scraper is not None:
+      scraper.Quit()
+
+  def __ForgetCredentials(self, generation):
+    with self.__state_lock:
+      if self.__auth_generation == generation:
+        self.__credentials = None
+
+  def __MarkAuthorized(self, generation):
+    with self.__state_lock:
+      if self.__auth_generation == generation:
+        self.__authorized = True
+
+  def DoAuth(self, login, password):
+    with self.__state_lock:
+      self.__credentials = (login, password)
+      self.__auth_generation += 1
+      self.__authorized = False
+      generation = self.__auth_generation
+
+    # The worker that picks this up logs in first, the rest do it before their next job. The job
+    # itself only runs once that login went through
+    future = self.__Submit(lambda scraper: self.__MarkAuthorized(generation))
+    future.add_done_callback(lambda done: self.__ForgetCredentials(generation) if not done.cancelled() and done.exception() is not None else None)
+    return future
+
+  def Prewarm(self):
+    # Every worker that picks one of these up starts its browser ahead of the first real job
+    return [self.__Submit(lambda scraper: None) for _ in range(self.size)]
+
+  def IsAuthorized(self):
+    # Only a login that went through, not one still queued or being typed in
+    with self.__state_lock:
+      return self.__authorized
+
+  def Submit(self, keyword, timeframe):
+    return self.__Submit(lambda scraper: scraper.FetchInterestOverTime(keyword, timeframe))
+
+  def FetchInterestOverTime(self, keyword, timeframe):
+    return self.Submit(keyword, timeframe).result()
+
+  def HealthCheck(self):
+    return {thread.name: (thread.is_alive(), state) for thread, state in zip(self.__threads, self.__health)}
+
+  def Shutdown(self):
+    for _ in self.__threads:
+      self.__jobs.put(None)
+    for thread in self.__threads:
+      thread.join()
+    if self.__browser is not None:
+      self.__browser.Quit()
@@ -1,4 +1,6 @@
 import pandas as pd
+from contextlib import contextmanager
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -7,6 +9,8 @@ from datetime import datetime
 import os
 import time
 
+import Metrics
+
 class YandexWordstatScraper():
   class Locators():
     LOGIN_BUTTON = (By.XPATH, '/html/body/div[2]/table/tbody/tr/td[6]/table/tbody/tr[1]/td[2]/a/span')
@@ -32,60 +36,161 @@ class YandexWordstatScraper():
     DOWNLOAD_BUTTON = (By.XPATH, '/html/body/div[1]/div[2]/div/div[2]/div/div[3]/div[2]/div[1]/div/div/div[1]/div[2]/button')
     DOWNLOAD_CSV_BUTTON = (By.XPATH, '/html/body/div[5]/div[1]/div[1]/span/div/a/button')
 
-  def __init__(self):
+  class Timeouts():
+    def __init__(self, auth=10, query=5, datepicker=5, chart_refresh=10, chart=30, download=30, poll_interval=0.1):
+      self.auth = auth
+      self.query = query
+      self.datepicker = datepicker
+      self.chart_refresh = chart_refresh
+      self.chart = chart
+      self.download = download
+      self.poll_interval = poll_interval
+
+  RESULT_FILENAME = "wordstat_dynamic.csv"
+  AUTH_URL = "https://passport.yandex.com/auth?retpath=https%3A%2F%2Fwordstat-2.yandex.com"
+
+  def __init__(self, download_dir=".tmp", timeouts=None, auth_url=None, headless=False):
+    self.download_dir = os.path.abspath(download_dir)
+    os.makedirs(self.download_dir, exist_ok=True)
+    self.timeouts = timeouts or self.Timeouts()
+    self.timings = {}
+    # The benchmarks point the scraper at a local copy of the passport and Wordstat pages
+    self.auth_url = auth_url or self.AUTH_URL
+    # What the chart shows now. The page keeps the period across searches and doesn't re-render for a
+    # keyword or period it already shows, so those steps are skipped instead of waited on. None means
+    # a failed step left the page in an unknown state
+    self.shown_keyword = ""
+    self.shown_timeframe = None
+
     options = uc.ChromeOptions()
     options.add_argument("--disable-popup-blocking")
 
-    self.driver = uc.Chrome(options=options, version_main=126)
+    self.driver = uc.Chrome(options=options, version_main=126, headless=headless)
     params = {
         "behavior": "allow",
-        "downloadPath": ".tmp"
+        "downloadPath": self.download_dir
     }
     self.driver.execute_cdp_cmd("Page.setDownloadBehavior", params)
-   
+
+  @contextmanager
+  def __Timed(self, step):
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.timings[step] = time.perf_counter() - started
+      Metrics.observe(f"wordstat.{step}", self.timings[step], started)
+
+  def __Wait(self, timeout, condition):
+    return WebDriverWait(self.driver, timeout, poll_frequency=self.timeouts.poll_interval).until(condition)
+
+  def __WaitForChart(self, previous, change):
+    # Old chart controls are detached when the results are re-rendered. While they are still
+    # attached the chart is the previous one, and its CSV must not be taken for the new query's
+    if previous:
+      try:
+        self.__Wait(self.timeouts.chart_refresh, EC.staleness_of(previous[0]))
+      except TimeoutException:
+        raise TimeoutException(f"Wordstat chart did not re-render for {change} in {self.timeouts.chart_refresh}s") from None
+    return self.__Wait(self.timeouts.chart, EC.element_to_be_clickable(self.Locators.DOWNLOAD_BUTTON))
+
   def __DoAuth(self, login, password):
-    self.driver.get("https://passport.yandex.com/auth?retpath=https%3A%2F%2Fwordstat-2.yandex.com")
+    self.driver.get(self.auth_url)
 
-    WebDriverWait(self.driver, 10).until(EC.presence_of_element_located(self.Locators.LOGIN_BY_NAME_BUTTON)).click()
-    WebDriverWait(self.driver, 10).until(EC.presence_of_element_located(self.Locators.LOGIN_INPUT)).send_keys(login)
-    WebDriverWait(self.driver, 10).until(EC.presence_of_element_located(self.Locators.LOGIN_SUBMIT)).click()
-    WebDriverWait(self.driver, 10).until(EC.presence_of_element_located(self.Locators.PASSWORD_INPUT)).send_keys(password)
-    WebDriverWait(self.driver, 10).until(EC.presence_of_element_located(self.Locators.LOGIN_SUBMIT)).click()
+    self.__Wait(self.timeouts.auth, EC.element_to_be_clickable(self.Locators.LOGIN_BY_NAME_BUTTON)).click()
+    self.__Wait(self.timeouts.auth, EC.presence_of_element_located(self.Locators.LOGIN_INPUT)).send_keys(login)
+    self.__Wait(self.timeouts.auth, EC.element_to_be_clickable(self.Locators.LOGIN_SUBMIT)).click()
+    self.__Wait(self.timeouts.auth, EC.presence_of_element_located(self.Locators.PASSWORD_INPUT)).send_keys(password)
+    self.__Wait(self.timeouts.auth, EC.element_to_be_clickable(self.Locators.LOGIN_SUBMIT)).click()
+    # Login finishes with a redirect back to Wordstat, a rejected password stays on the passport page
+    self.__Wait(self.timeouts.auth, EC.url_contains("wordstat"))
 
   def __DoQuery(self, keyword):
-    for i in range(50):
-      WebDriverWait(self.driver, 5).until(EC.presence_of_element_located(self.Locators.SEARCH_FIELD)).send_keys('\b')
-
-    WebDriverWait(self.driver, 5).until(EC.presence_of_element_located(self.Locators.SEARCH_FIELD)).send_keys(keyword)
-    WebDriverWait(self.driver, 5).until(EC.presence_of_element_located(self.Locators.SEARCH_BUTTON)).click()
+    if self.shown_keyword is None:
+      self.driver.refresh()
+      self.shown_keyword, self.shown_timeframe = "", None
+    if keyword == self.shown_keyword:
+      return
+
+    field = self.__Wait(self.timeouts.query, EC.element_to_be_clickable(self.Locators.SEARCH_FIELD))
+    field.clear()
+    field.send_keys(keyword)
+    self.__Wait(self.timeouts.query, lambda driver: field.get_attribute("value") == keyword)
+
+    previous = self.driver.find_elements(*self.Locators.DOWNLOAD_BUTTON)
+    self.__Wait(self.timeouts.query, EC.element_to_be_clickable(self.Locators.SEARCH_BUTTON)).click()
+    self.__WaitForChart(previous, f"query {keyword!r}")
+    self.shown_keyword = keyword
 
   def __SetTimeframe(self, timeframe):
-    WebDriverWait(self.driver, 5).until(EC.visibility_of_element_located(self.Locators.DATEPICKER_BUTTON)).click()
+    if tuple(timeframe) == self.shown_timeframe:
+      return
 
-    WebDriverWait(self.driver, 5).until(EC.visibility_of_element_located(self.Locators.DATEPICKER_YEAR_BUTTON)).click()
-    WebDriverWait(self.driver, 5).until(EC.visibility_of_element_located(self.Locators.GetDatepickerYearButton(timeframe[0].year))).click()
-    WebDriverWait(self.driver, 5).until(EC.visibility_of_element_located(self.Locators.GetDatepickerMonthButton(timeframe[0].month - 1))).click()
+    self.__Wait(self.timeouts.datepicker, EC.element_to_be_clickable(self.Locators.DATEPICKER_BUTTON)).click()
 
-    WebDriverWait(self.driver, 5).until(EC.visibility_of_element_located(self.Locators.DATEPICKER_YEAR_BUTTON)).click()
-    WebDriverWait(self.driver, 5).until(EC.visibility_of_element_located(self.Locators.GetDatepickerYearButton(timeframe[1].year))).click()
-    WebDriverWait(self.driver, 5).until(EC.visibility_of_element_located(self.Locators.GetDatepickerMonthButton(timeframe[1].month - 1))).click()
+    self.__Wait(self.timeouts.datepicker, EC.element_to_be_clickable(self.Locators.DATEPICKER_YEAR_BUTTON)).click()
+    self.__Wait(self.timeouts.datepicker, EC.element_to_be_clickable(self.Locators.GetDatepickerYearButton(timeframe[0].year))).click()
+    self.__Wait(self.timeouts.datepicker, EC.element_to_be_clickable(self.Locators.GetDatepickerMonthButton(timeframe[0].month - 1))).click()
+
+    self.__Wait(self.timeouts.datepicker, EC.element_to_be_clickable(self.Locators.DATEPICKER_YEAR_BUTTON)).click()
+    self.__Wait(self.timeouts.datepicker, EC.element_to_be_clickable(self.Locators.GetDatepickerYearButton(timeframe[1].year))).click()
+
+    previous = self.driver.find_elements(*self.Locators.DOWNLOAD_BUTTON)
+    self.__Wait(self.timeouts.datepicker, EC.element_to_be_clickable(self.Locators.GetDatepickerMonthButton(timeframe[1].month - 1))).click()
+    self.__WaitForChart(previous, f"period {timeframe[0]:%Y-%m} to {timeframe[1]:%Y-%m}")
+    self.shown_timeframe = tuple(timeframe)
+
+  def __ResultPath(self):
+    return os.path.join(self.download_dir, self.RESULT_FILENAME)
+
+  def __WaitForFile(self, path, timeout):
+    # Chrome writes into <name>.crdownload and renames it once the download is complete
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+      if os.path.exists(path) and not os.path.exists(path + ".crdownload") and os.path.getsize(path) > 0:
+        return
+      time.sleep(self.timeouts.poll_interval)
+    raise TimeoutError(f"Wordstat download {path} did not complete in {timeout}s")
 
   def __DownloadResult(self):
-    if os.path.exists("./.tmp/wordstat_dynamic.csv"):
-      os.remove("./.tmp/wordstat_dynamic.csv")
+    if os.path.exists(self.__ResultPath()):
+      os.remove(self.__ResultPath())
 
-    time.sleep(5)
-    WebDriverWait(self.driver, 30).until(EC.visibility_of_element_located(self.Locators.DOWNLOAD_BUTTON)).click()
-    WebDriverWait(self.driver, 5).until(EC.visibility_of_element_located(self.Locators.DOWNLOAD_CSV_BUTTON)).click()
-    time.sleep(5)
-    assert(os.path.exists("./.tmp/wordstat_dynamic.csv"))
+    self.__Wait(self.timeouts.chart, EC.element_to_be_clickable(self.Locators.DOWNLOAD_BUTTON)).click()
+    self.__Wait(self.timeouts.query, EC.element_to_be_clickable(self.Locators.DOWNLOAD_CSV_BUTTON)).click()
+    self.__WaitForFile(self.__ResultPath(), self.timeouts.download)
 
   def DoAuth(self, login, password):
-    self.__DoAuth(login, password)
+    with self.__Timed("auth"):
+      self.__DoAuth(login, password)
+    self.shown_keyword, self.shown_timeframe = "", None
+
+  def ExportCookies(self):
+    # DoAuth has waited for the redirect back to Wordstat, so the session cookies are set
+    return self.driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+
+  def IsAlive(self):
+    try:
+      return len(self.driver.window_handles) > 0
+    except Exception:
+      return False
+
+  def Quit(self):
+    try:
+      self.driver.quit()
+    except Exception:
+      pass
 
   def FetchInterestOverTime(self, keyword, timeframe):
-    self.__DoQuery(keyword)
-    self.__SetTimeframe(timeframe)
-    self.__DownloadResult()
-
-    return pd.read_csv("./.tmp/wordstat_dynamic.csv", delimiter=";").iloc[:, :-1]
\ No newline at end of file
+    try:
+      with self.__Timed("query"):
+        self.__DoQuery(keyword)
+      with self.__Timed("timeframe"):
+        self.__SetTimeframe(timeframe)
+      with self.__Timed("download"):
+        self.__DownloadResult()
+    except Exception:
+      self.shown_keyword = None
+      raise
+
+    return pd.read_csv(self.__ResultPath(), delimiter=";").iloc[:, :-1]
\ No newline at end of file
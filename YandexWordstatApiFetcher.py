@@ -0,0 +1,78 @@
+import calendar
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import Metrics
+
+
+class YandexWordstatApiFetcher():
+  # The endpoint the Wordstat web UI itself queries for the dynamics chart. It isn't a
+  # documented API, so the path and payload are kept in one place to follow UI changes
+  BASE_URL = "https://wordstat.yandex.com"
+  DYNAMICS_PATH = "/wordstat/api/search"
+  MONTH_NAMES = np.array(["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"])
+
+  def __init__(self, base_url=None, pool_size=4, timeout=10):
+    self.base_url = base_url or self.BASE_URL
+    self.timeout = timeout
+
+    self.session = requests.Session()
+    self.session.headers["User-Agent"] = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:121.0) Gecko/20100101 Firefox/121.0"
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+  def LoadCookies(self, cookies):
+    self.session.cookies.clear()
+    for cookie in cookies:
+      self.session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain", ""), path=cookie.get("path", "/"))
+
+  def Close(self):
+    self.session.close()
+
+  @staticmethod
+  def IsAuthError(err):
+    # The endpoint answers 401 or 403 once the session cookies have expired
+    return isinstance(err, requests.HTTPError) and err.response is not None and err.response.status_code in (401, 403)
+
+  def __BuildRequest(self, keyword, timeframe):
+    start, end = timeframe
+    last_day = calendar.monthrange(end.year, end.month)[1]
+    return {
+      "currentDevice": "desktop,phone,tablet",
+      "filters": {
+        "region": "all",
+        "tableType": "dynamics",
+        "periodType": "monthly",
+        "startDate": f"01.{start.month:02d}.{start.year}",
+        "endDate": f"{last_day:02d}.{end.month:02d}.{end.year}",
+      },
+      "searchValue": keyword,
+    }
+
+  @classmethod
+  def ParseDynamics(cls, payload):
+    rows = (payload.get("table") or {}).get("tableData")
+    if rows is None:
+      rows = (payload.get("graph") or {}).get("tableData")
+    if rows is None:
+      raise ValueError(f"Unexpected Wordstat dynamics payload with keys {sorted(payload)}")
+
+    table = pd.DataFrame(rows, columns=["date", "absoluteValue", "value"])
+    dates = pd.DatetimeIndex(pd.to_datetime(table["date"], format="mixed", dayfirst=True))
+
+    # Same frame the CSV export gives, so YandexPreprocessor handles both paths
+    return pd.DataFrame({
+      "Period": pd.Series(cls.MONTH_NAMES[dates.month - 1]).str.cat(dates.year.astype(str), sep=" "),
+      "Number of queries": table["absoluteValue"].astype("int64").to_numpy(),
+      "Percentage of total queries, %": table["value"].astype(float).to_numpy(),
+    })
+
+  def FetchInterestOverTime(self, keyword, timeframe):
+    with Metrics.timed("wordstat_api.dynamics"):
+      response = self.session.post(self.base_url + self.DYNAMICS_PATH, json=self.__BuildRequest(keyword, timeframe), timeout=self.timeout)
+      response.raise_for_status()
+    return self.ParseDynamics(response.json())
@@ -0,0 +1,16 @@
+from pathlib import Path
+
+import Metrics
+
+
+def _app():
+    # Imported here, `shiny run` takes a file importing shiny.express at the top for an express app itself
+    from shiny.express import wrap_express_app
+
+    app = wrap_express_app(Path(__file__).parent / 'main.py')
+    # Ahead of the catch-all mount that serves the page's static dependencies
+    app.starlette_app.router.routes[0:0] = Metrics.routes()
+    return app
+
+
+app = _app()
@@ -0,0 +1,251 @@
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+from typing import Dict, List
+
+import pandas as pd
+
+import Indicators
+import Pipeline
+import Preprocessors
+from DateRange import DateRange
+from GoogleTrendsScheduler import GoogleTrendsScheduler
+from Panel import KeywordPanel, MonthlyPanel
+from SeriesStore import SeriesStore
+from WordstatPool import WordstatPool
+
+CHECKPOINT_FILENAME = 'checkpoint.json'
+PREPROCESSED_FILENAME = 'preprocessed.csv'
+INDICATORS_FILENAME = 'indicators.csv'
+COMPOSITES_FILENAME = 'composites.csv'
+
+
+def read_keywords(path: str) -> List[str]:
+    with open(path, encoding='utf-8') as f:
+        keywords = [line.strip() for line in f]
+    return list(dict.fromkeys(keyword for keyword in keywords if keyword and not keyword.startswith('#')))
+
+
+class Checkpoint:
+    def __init__(self, directory: str, daterange: DateRange, sources: List[str], restart: bool, freq: str = Preprocessors.MONTHLY):
+        self.path = os.path.join(directory, CHECKPOINT_FILENAME)
+        self.state = {'daterange': daterange.serialize(), 'sources': sorted(sources), 'freq': freq, 'done': [], 'failed': {}, 'offsets': {}}
+
+        if os.path.exists(self.path) and not restart:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+            # Checkpoints from before frequencies were selectable are monthly
+            saved.setdefault('freq', Preprocessors.MONTHLY)
+            if saved['daterange'] != self.state['daterange'] or saved['sources'] != self.state['sources'] or saved['freq'] != self.state['freq']:
+                raise SystemExit(f'Checkpoint {self.path} was made for {saved["daterange"]} {saved["sources"]} {saved["freq"]}, use --restart to start over')
+            self.state = saved
+
+        self.done = set(self.state['done'])
+
+    def offset(self, filename: str) -> int:
+        return self.state['offsets'].get(filename, 0)
+
+    def mark_done(self, keyword: str, offsets: Dict[str, int]):
+        self.done.add(keyword)
+        self.state['done'].append(keyword)
+        self.state['failed'].pop(keyword, None)
+        self.state['offsets'].update(offsets)
+        self.save()
+
+    def mark_failed(self, keyword: str, err: Exception):
+        self.state['failed'][keyword] = f'{type(err).__name__}: {err}'
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+class CsvAppender:
+    def __init__(self, path: str, offset: int):
+        # Rows past the checkpointed offset belong to a keyword that never got marked done
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+
+        self.filename = os.path.basename(path)
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+
+    def append(self, frame: pd.DataFrame):
+        frame.to_csv(self.file, header=self.file.tell() == 0, index=False)
+
+    def offset(self) -> int:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def preprocessed_rows(keyword: str, preprocessed: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    frames = [frame.assign(keyword=keyword, source=source) for source, frame in preprocessed.items()]
+    return pd.concat(frames).reindex(columns=['keyword', 'source', 'date', 'relative_value', 'absolute_value'])
+
+
+def write_composites(directory: str) -> int:
+    # Recomputed from every keyword done so far, resumed runs included
+    path = os.path.join(directory, PREPROCESSED_FILENAME)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    panel = KeywordPanel.from_long(pd.read_csv(path))
+    if len(panel.keywords) < 2:
+        return 0
+
+    manager = Indicators.IndicatorsManager(Pipeline.COMPOSITE_INDICATORS)
+    Pipeline.composite_rows(manager, panel).to_csv(os.path.join(directory, COMPOSITES_FILENAME), index=False)
+    return len(panel.keywords)
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Build leading indicators for a list of keywords without the Shiny app')
+    parser.add_argument('keywords', help='file with one keyword per line, lines starting with # are skipped')
+    parser.add_argument('--start', required=True, help='first month of the range, YYYY-MM')
+    parser.add_argument('--end', required=True, help='last month of the range, YYYY-MM')
+    parser.add_argument('--output', default='./batch_output', help='directory for results and the checkpoint')
+    parser.add_argument('--sources', nargs='+', choices=[Pipeline.GOOGLE, Pipeline.YANDEX], default=[Pipeline.GOOGLE, Pipeline.YANDEX])
+    parser.add_argument('--frequency', choices=list(Preprocessors.FREQUENCIES), default=Preprocessors.MONTHLY,
+                        help='MS for months, W for weeks or D for days, Google is stitched from overlapping windows below a month and Wordstat stays monthly')
+    parser.add_argument('--google-workers', type=int, default=1)
+    parser.add_argument('--google-rate', type=float, default=0.2, help='Google Trends requests per second')
+    parser.add_argument('--google-proxies', nargs='*', default=[], help='proxies to rotate through when Google throttles')
+    parser.add_argument('--google-user-agents', nargs='*', default=[], help='user agents to rotate through when Google throttles')
+    parser.add_argument('--google-batch', type=int, default=20, help='keywords fetched from Google together, four share a request next to an anchor keyword')
+    parser.add_argument('--yandex-workers', type=int, default=2)
+    parser.add_argument('--browserless', action='store_true', help='fetch Wordstat data over HTTP after a browser login')
+    parser.add_argument('--yandex-login', default=os.environ.get('YANDEX_LOGIN'))
+    parser.add_argument('--yandex-password', default=os.environ.get('YANDEX_PASSWORD'), help='defaults to the YANDEX_PASSWORD environment variable')
+    parser.add_argument('--store', default='./.cache/series.sqlite3', help='series store shared with the app')
+    parser.add_argument('--max-consecutive-failures', type=int, default=10, help='stop when a source looks banned, 0 never stops')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    parser.add_argument('--no-composites', action='store_true', help='skip the indicators combining all keywords')
+    return parser.parse_args(argv)
+
+
+def run(args: argparse.Namespace) -> int:
+    daterange = DateRange.from_months(pd.Timestamp(args.start), pd.Timestamp(args.end))
+    sources = list(dict.fromkeys(args.sources))
+    keywords = read_keywords(args.keywords)
+
+    os.makedirs(args.output, exist_ok=True)
+    checkpoint = Checkpoint(args.output, daterange, sources, args.restart, args.frequency)
+    todo = iter([keyword for keyword in keywords if keyword not in checkpoint.done])
+    print(f'{len(checkpoint.done)} of {len(keywords)} keywords already done')
+
+    store = SeriesStore(args.store)
+    manager = Indicators.IndicatorsManager(Pipeline.INDICATORS)
+    outputs = [CsvAppender(os.path.join(args.output, filename), checkpoint.offset(filename)) for filename in (PREPROCESSED_FILENAME, INDICATORS_FILENAME)]
+
+    executors = {}
+    scheduler = None
+    pool = None
+
+    def fetch_google(keywords):
+        return Pipeline.fetch_google_batch(scheduler, store, keywords, daterange, freq=args.frequency)
+
+    def fetch_yandex(keywords):
+        return {keyword: Pipeline.fetch_yandex_data(pool, store, keyword, daterange) for keyword in keywords}
+
+    fetchers = {Pipeline.GOOGLE: fetch_google, Pipeline.YANDEX: fetch_yandex}
+
+    if Pipeline.GOOGLE in sources:
+        scheduler = GoogleTrendsScheduler(
+            rate=args.google_rate, workers=args.google_workers,
+            identities=GoogleTrendsScheduler.BuildIdentities(args.google_proxies, args.google_user_agents),
+        )
+        executors[Pipeline.GOOGLE] = concurrent.futures.ThreadPoolExecutor(args.google_workers, thread_name_prefix='google')
+    if Pipeline.YANDEX in sources:
+        if not args.yandex_login or not args.yandex_password:
+            raise SystemExit('Yandex credentials are required, pass --yandex-login and set YANDEX_PASSWORD')
+        pool = WordstatPool(size=args.yandex_workers, browserless=args.browserless)
+        pool.DoAuth(args.yandex_login, args.yandex_password).result()
+        executors[Pipeline.YANDEX] = concurrent.futures.ThreadPoolExecutor(args.yandex_workers, thread_name_prefix='yandex')
+
+    window = 2 * ((args.google_workers if Pipeline.GOOGLE in sources else 0) + (args.yandex_workers if Pipeline.YANDEX in sources else 0))
+    in_flight = {}
+    consecutive_failures = 0
+    aborted = False
+
+    def refill():
+        while len(in_flight) < window and not aborted:
+            # Google fetches a group in shared requests, Wordstat has a request per keyword anyway
+            group = list(itertools.islice(todo, max(args.google_batch, 1) if Pipeline.GOOGLE in executors else 1))
+            if not group:
+                break
+            for source, executor in executors.items():
+                for chunk in [group] if source == Pipeline.GOOGLE else [[keyword] for keyword in group]:
+                    future = executor.submit(fetchers[source], chunk)
+                    for keyword in chunk:
+                        in_flight.setdefault(keyword, {})[source] = future
+
+    try:
+        refill()
+        while in_flight:
+            pending = [future for futures in in_flight.values() for future in futures.values() if not future.done()]
+            if pending:
+                concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for keyword, futures in list(in_flight.items()):
+                if not all(future.done() for future in futures.values()):
+                    continue
+                del in_flight[keyword]
+
+                try:
+                    raw = {source: future.result()[keyword] for source, future in futures.items()}
+                    preprocessed = Pipeline.preprocess(raw, keyword, daterange, args.frequency)
+                    panel = MonthlyPanel.from_frames(preprocessed)
+
+                    outputs[0].append(preprocessed_rows(keyword, preprocessed))
+                    outputs[1].append(Pipeline.indicator_rows(keyword, manager, panel))
+                    checkpoint.mark_done(keyword, {output.filename: output.offset() for output in outputs})
+
+                    consecutive_failures = 0
+                    print(f'[{len(checkpoint.done)}/{len(keywords)}] {keyword}')
+                except Exception as err:
+                    checkpoint.mark_failed(keyword, err)
+                    consecutive_failures += 1
+                    print(f'Failed to process {keyword}: {err}', file=sys.stderr)
+
+                if args.max_consecutive_failures and consecutive_failures >= args.max_consecutive_failures and not aborted:
+                    aborted = True
+                    print(f'{consecutive_failures} keywords failed in a row, stopping, run again later to resume', file=sys.stderr)
+                    for futures in in_flight.values():
+                        for future in futures.values():
+                            future.cancel()
+
+            if aborted:
+                in_flight = {keyword: futures for keyword, futures in in_flight.items() if not all(future.cancelled() for future in futures.values())}
+            refill()
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+        if scheduler is not None:
+            scheduler.Shutdown()
+        if pool is not None:
+            pool.Shutdown()
+        for output in outputs:
+            output.close()
+
+    failed = len(checkpoint.state['failed'])
+    print(f'Done {len(checkpoint.done)} of {len(keywords)} keywords, {failed} failed')
+    if not aborted and not args.no_composites:
+        combined = write_composites(args.output)
+        if combined:
+            print(f'Composite indicators of {combined} keywords written to {COMPOSITES_FILENAME}')
+    if aborted:
+        return 2
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args(sys.argv[1:])))
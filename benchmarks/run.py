@@ -0,0 +1,432 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import Exports
+import Indicators
+import Metrics
+import Pipeline
+import Plots
+from DateRange import DateRange
+from GoogleTrendsFetcher import GoogleTrendsFetcher
+from GoogleTrendsScheduler import GoogleTrendsScheduler
+from KeywordExpander import KeywordExpander
+from LeadLag import LeadLagScanner
+from Panel import KeywordPanel, MonthlyPanel
+from Preprocessors import DAILY, GooglePreprocessor, YandexPreprocessor
+from SeriesStore import SeriesStore
+from Watchlist import Watchlist, WatchlistRefresher
+from WordstatPool import WordstatPool
+from YandexWordstatApiFetcher import YandexWordstatApiFetcher
+from benchmarks import synthetic
+from benchmarks.trends_stub import TrendsStub, pytrends_pointed_at
+from benchmarks.wordstat_stub import WordstatStub
+
+BASELINES_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# Data ends at a fixed date, so a run next year measures the same amount of work
+END = pd.Timestamp('2024-12-31')
+SCALES = {
+    'small': {'keywords': 200, 'years': 5, 'candidates': 1000, 'export_rows': 200_000, 'plots': 20, 'google_keywords': 20, 'stitched_keywords': 4, 'expand_nodes': 100, 'wordstat_keywords': 5},
+    'large': {'keywords': 2000, 'years': 10, 'candidates': 10_000, 'export_rows': 2_000_000, 'plots': 100, 'google_keywords': 100, 'stitched_keywords': 10, 'expand_nodes': 500, 'wordstat_keywords': 20},
+}
+
+OK = 'ok'
+REGRESSION = 'REGRESSION'
+SKIPPED = 'skipped'
+
+
+def machine() -> str:
+    return f'{platform.machine()} {os.cpu_count()} cpus, python {platform.python_version()}'
+
+
+class Runner:
+    # A benchmark regresses when its p50 is more than tolerance above the recorded baseline p50, slack
+    # seconds on top keep millisecond benchmarks from failing on scheduler noise
+    def __init__(self, repeat: int, warmup: int, baselines: Dict[str, float], tolerance: float, slack: float):
+        self.repeat = repeat
+        self.warmup = warmup
+        self.baselines = baselines
+        self.tolerance = tolerance
+        self.slack = slack
+        self.results: List[Dict[str, Any]] = []
+
+    def measure(self, name: str, run: Callable, items: int, unit: str, setup: Optional[Callable[[], Any]] = None):
+        # setup() builds whatever a cold run needs and isn't timed, run() gets its result
+        def once() -> float:
+            state = setup() if setup is not None else None
+            started = time.perf_counter()
+            run(state) if setup is not None else run()
+            return time.perf_counter() - started
+
+        for _ in range(self.warmup):
+            once()
+        before = Metrics.stage_seconds.snapshot()
+        durations = np.array([once() for _ in range(self.repeat)])
+        after = Metrics.stage_seconds.snapshot()
+
+        # Stages timed inside the app code, averaged per run
+        stages = {}
+        for stage, (count, total) in after.items():
+            previous_count, previous_total = before.get(stage, (0, 0.0))
+            if count > previous_count:
+                stages[stage] = {'calls': (count - previous_count) / self.repeat, 'seconds': (total - previous_total) / self.repeat}
+
+        p50 = float(np.median(durations))
+        baseline = self.baselines.get(name)
+        limit = baseline * (1 + self.tolerance) + self.slack if baseline is not None else None
+        result = {
+            'name': name,
+            'items': items,
+            'unit': unit,
+            'runs': durations.tolist(),
+            'p50': p50,
+            'p95': float(np.percentile(durations, 95)),
+            'min': float(durations.min()),
+            'throughput': items / p50 if p50 > 0 else float('inf'),
+            'baseline': baseline,
+            'limit': limit,
+            'status': REGRESSION if limit is not None and p50 > limit else OK,
+            'stages': stages,
+        }
+        self.results.append(result)
+        print(format_result(result), flush=True)
+        return result
+
+    def skip(self, name: str, reason: str):
+        result = {'name': name, 'status': SKIPPED, 'reason': reason}
+        self.results.append(result)
+        print(format_result(result), flush=True)
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    if result['status'] == SKIPPED:
+        return f'{result["name"]:<34} skipped: {result["reason"]}'
+
+    baseline = result['baseline']
+    change = f'{result["p50"] / baseline - 1:+.0%}' if baseline else '-'
+    baseline = f'{baseline:.3f}s' if baseline is not None else '-'
+    lines = [
+        f'{result["name"]:<34} p50 {result["p50"]:8.3f}s  p95 {result["p95"]:8.3f}s  '
+        f'{result["throughput"]:>12.1f} {result["unit"]}/s  baseline {baseline:>8} {change:>6}  {result["status"]}'
+    ]
+    for stage, stats in sorted(result['stages'].items(), key=lambda item: -item[1]['seconds'])[:8]:
+        lines.append(f'    {stage:<36} {stats["seconds"]:8.3f}s in {stats["calls"]:g} calls')
+    return '\n'.join(lines)
+
+
+def _start(scale: dict) -> pd.Timestamp:
+    return END - pd.DateOffset(years=scale['years']) + pd.Timedelta(days=1)
+
+
+def suite_preprocess(runner: Runner, scale: dict, args: argparse.Namespace):
+    keywords = synthetic.keywords(scale['keywords'])
+    daterange = DateRange.from_months(_start(scale), END)
+    google = synthetic.google_frames(keywords, _start(scale), END, 'W')
+    yandex = synthetic.yandex_frames(keywords, _start(scale), END)
+
+    runner.measure('preprocess.google.batch', lambda: GooglePreprocessor.process_batch(google, daterange), len(keywords), 'keywords')
+    runner.measure('preprocess.google', lambda: [Pipeline.preprocess_source(Pipeline.GOOGLE, google[keyword], keyword, daterange) for keyword in keywords], len(keywords), 'keywords')
+    runner.measure('preprocess.yandex.batch', lambda: YandexPreprocessor.process_batch(yandex, daterange), len(keywords), 'keywords')
+    runner.measure('preprocess.yandex', lambda: [Pipeline.preprocess_source(Pipeline.YANDEX, yandex[keyword], keyword, daterange) for keyword in keywords], len(keywords), 'keywords')
+
+    # Stitched daily Google series, with Wordstat months spread onto the same days
+    daily = synthetic.google_frames(keywords, _start(scale), END, 'D')
+    runner.measure('preprocess.google.daily.batch', lambda: GooglePreprocessor.process_batch(daily, daterange, DAILY), len(keywords), 'keywords')
+    runner.measure('preprocess.yandex.daily.batch', lambda: YandexPreprocessor.process_batch(yandex, daterange, DAILY), len(keywords), 'keywords')
+
+
+def suite_indicators(runner: Runner, scale: dict, args: argparse.Namespace):
+    keywords = synthetic.keywords(scale['keywords'])
+    daterange = DateRange.from_months(_start(scale), END)
+    google = GooglePreprocessor.process_batch(synthetic.google_frames(keywords, _start(scale), END, 'W'), daterange)
+    yandex = YandexPreprocessor.process_batch(synthetic.yandex_frames(keywords, _start(scale), END), daterange)
+
+    def build_panels():
+        return [MonthlyPanel.from_frames({Pipeline.GOOGLE: google[keyword], Pipeline.YANDEX: yandex[keyword]}) for keyword in keywords]
+
+    def compute(manager: Indicators.IndicatorsManager):
+        return [Pipeline.indicator_rows(keyword, manager, panel) for keyword, panel in zip(keywords, panels)]
+
+    def manager() -> Indicators.IndicatorsManager:
+        return Indicators.IndicatorsManager(Pipeline.INDICATORS, cache_size=len(keywords) * len(Pipeline.INDICATORS))
+
+    runner.measure('panel.from_frames', build_panels, len(keywords), 'keywords')
+    panels = build_panels()
+    runner.measure('indicators.compute', compute, len(keywords), 'keywords', setup=manager)
+
+    # Switching the selected indicator on a keyword already shown, a memo hit per (panel, indicator).
+    # Filled before measuring, and without the long rows indicator_rows builds for exports
+    cached = manager()
+    compute(cached)
+
+    def switch():
+        return [cached.compute(indicator, panel) for panel in panels for indicator in cached.get_applicable(panel)]
+
+    runner.measure('indicators.cached', switch, len(keywords), 'keywords')
+
+
+def suite_composites(runner: Runner, scale: dict, args: argparse.Namespace):
+    keywords = synthetic.keywords(scale['keywords'])
+    daterange = DateRange.from_months(_start(scale), END)
+    google = GooglePreprocessor.process_batch(synthetic.google_frames(keywords, _start(scale), END, 'W'), daterange)
+    yandex = YandexPreprocessor.process_batch(synthetic.yandex_frames(keywords, _start(scale), END), daterange)
+    frames = {keyword: {Pipeline.GOOGLE: google[keyword], Pipeline.YANDEX: yandex[keyword]} for keyword in keywords}
+
+    def manager() -> Indicators.IndicatorsManager:
+        return Indicators.IndicatorsManager(Pipeline.COMPOSITE_INDICATORS)
+
+    def fitted(panel: KeywordPanel) -> KeywordPanel:
+        Pipeline.composite_rows(manager(), panel)
+        return panel
+
+    runner.measure('composite.compute', lambda: Pipeline.composite_rows(manager(), KeywordPanel.from_frames(frames)), len(keywords), 'keywords')
+
+    # One keyword or one month more than a panel whose composites are computed already
+    base = fitted(KeywordPanel.from_frames({keyword: frames[keyword] for keyword in keywords[:-1]}))
+    runner.measure('composite.add_keyword', lambda: Pipeline.composite_rows(manager(), base.with_keyword(keywords[-1], frames[keywords[-1]])), 1, 'keywords')
+
+    full = KeywordPanel.from_frames(frames)
+    last = full.index[-1]
+    without_last = fitted(KeywordPanel(full.index[:-1], full.keywords, full.columns, np.stack([full.matrix(*column) for column in full.columns], axis=-1)[:-1]))
+    month = np.stack([full.matrix(*column)[-1] for column in full.columns], axis=-1)
+    runner.measure('composite.add_month', lambda: Pipeline.composite_rows(manager(), without_last.with_month(last, month)), 1, 'months')
+
+
+def suite_leadlag(runner: Runner, scale: dict, args: argparse.Namespace):
+    labels, values, target = synthetic.lead_lag_inputs(scale['candidates'], scale['years'] * 12)
+    candidates = len(labels)
+
+    runner.measure('leadlag.scan', lambda scanner: scanner.scan(labels, values, target, (0, 12)), candidates, 'candidates', setup=lambda: LeadLagScanner(cache_size=1))
+    # Moving the lag slider on the same inputs, the card's most frequent request
+    scanner = LeadLagScanner(cache_size=1)
+    runner.measure('leadlag.scan.window', lambda: scanner.scan(labels, values, target, (0, 6)), candidates, 'candidates')
+
+
+def suite_exports(runner: Runner, scale: dict, args: argparse.Namespace):
+    rows = scale['export_rows']
+    rng = np.random.default_rng(0)
+    months = pd.date_range(_start(scale), END, freq='MS')
+    frame = pd.DataFrame({
+        'keyword': np.resize(np.repeat(synthetic.keywords(-(-rows // len(months))), len(months)), rows),
+        'indicator': Indicators.GoogleRelativeIndicator.name,
+        'date': np.resize(months.to_numpy(), rows),
+        'value': rng.random(rows) * 100,
+    })
+
+    for fmt in Exports.FORMATS:
+        runner.measure(f'export.{fmt}', functools.partial(lambda fmt: sum(len(chunk) for chunk in Exports.stream(frame, fmt)), fmt), rows, 'rows')
+    runner.measure('export.bundle', lambda: sum(len(chunk) for chunk in Exports.stream_bundle({'indicator_data': frame}, Exports.PARQUET)), rows, 'rows')
+
+
+def suite_plots(runner: Runner, scale: dict, args: argparse.Namespace):
+    keywords = synthetic.keywords(scale['plots'])
+    monthly = synthetic.levels(keywords, _start(scale), END, 'MS')
+    frames = [pd.DataFrame({'date': monthly.index, 'value': monthly[keyword].to_numpy()}) for keyword in keywords]
+
+    with tempfile.TemporaryDirectory(prefix='plots-') as root:
+        def render(cache: Plots.PlotCache):
+            return [cache.render(frame, 'date', 'value', 800, 400) for frame in frames]
+
+        runner.measure('plot.render', render, len(frames), 'plots', setup=lambda: Plots.PlotCache(tempfile.mkdtemp(dir=root), max_entries=len(frames)))
+        cache = Plots.PlotCache(tempfile.mkdtemp(dir=root), max_entries=len(frames))
+        runner.measure('plot.cached', lambda: render(cache), len(frames), 'plots')
+
+
+def suite_google(runner: Runner, scale: dict, args: argparse.Namespace):
+    keywords = synthetic.keywords(scale['google_keywords'], prefix='query')
+    daterange = DateRange.from_months(_start(scale), END)
+    timeframe = daterange.serialize()
+
+    with TrendsStub(recordings=args.recordings, upstream=args.upstream, latency=args.latency) as stub, pytrends_pointed_at(stub.url), \
+            tempfile.TemporaryDirectory(prefix='series-') as root:
+        # The token bucket isn't what is measured here, so it is sized to never hold a request back
+        scheduler = GoogleTrendsScheduler(rate=args.google_rate, burst=args.google_rate, workers=args.google_workers)
+        try:
+            def interest_over_time():
+                futures = [scheduler.Submit(functools.partial(_interest_over_time, keyword=keyword, timeframe=timeframe)) for keyword in keywords]
+                return [future.result() for future in futures]
+
+            def fetch_through(store: SeriesStore):
+                return [Pipeline.fetch_google_data(scheduler, store, keyword, daterange) for keyword in keywords]
+
+            def store() -> SeriesStore:
+                return SeriesStore(path=tempfile.mkstemp(dir=root, suffix='.sqlite3')[1])
+
+            runner.measure('google.interest_over_time', interest_over_time, len(keywords), 'keywords')
+            runner.measure('google.batch', lambda: scheduler.FetchInterestOverTimeBatch(keywords, timeframe=timeframe), len(keywords), 'keywords')
+            runner.measure('google.fetch_through', fetch_through, len(keywords), 'keywords', setup=store)
+            runner.measure('google.fetch_through.batch', lambda store: Pipeline.fetch_google_batch(scheduler, store, keywords, daterange), len(keywords), 'keywords', setup=store)
+            # Filled before measuring, so every timed run is a hit, also without warmup runs
+            cached = store()
+            fetch_through(cached)
+            runner.measure('google.fetch_through.cached', lambda: fetch_through(cached), len(keywords), 'keywords')
+
+            def watched() -> WatchlistRefresher:
+                # Everything stored, with only the current month expired the way it is an interval later
+                watchlist = Watchlist(tempfile.mkstemp(dir=root, suffix='.sqlite3')[1])
+                for keyword in keywords:
+                    watchlist.add(keyword, daterange.start)
+                refresher = WatchlistRefresher.for_services(watchlist, SeriesStore(path=tempfile.mkstemp(dir=root, suffix='.sqlite3')[1], partial_ttl=0), scheduler, interval=0)
+                refresher.refresh_due()
+                return refresher
+
+            runner.measure('watchlist.refresh.delta', lambda refresher: refresher.refresh_due(), len(keywords), 'keywords', setup=watched)
+            stitched = keywords[:scale['stitched_keywords']]
+            runner.measure('google.stitched.daily', lambda: [scheduler.FetchInterestOverTime([keyword], timeframe=timeframe, resolution=GoogleTrendsFetcher.DAILY) for keyword in stitched],
+                           len(stitched), 'keywords')
+            runner.measure('google.expand', lambda: KeywordExpander(scheduler, workers=args.google_workers).expand(keywords[:5], max_depth=3, max_nodes=scale['expand_nodes']),
+                           scale['expand_nodes'], 'keywords')
+        finally:
+            scheduler.Shutdown()
+        print(f'    trends stub answered {stub.requests} requests')
+
+
+def _interest_over_time(fetcher, keyword: str, timeframe: str) -> pd.DataFrame:
+    fetcher.BuildPayload([keyword], timeframe=timeframe)
+    return fetcher.FetchInterestOverTime()
+
+
+def suite_wordstat(runner: Runner, scale: dict, args: argparse.Namespace):
+    keywords = synthetic.keywords(scale['wordstat_keywords'], prefix='query')
+    # The datepicker on the real page starts in 2018
+    timeframe = (max(_start(scale), pd.Timestamp('2018-01-01')).date(), END.date())
+
+    with WordstatStub(render_delay=args.render_delay, latency=args.latency) as stub, tempfile.TemporaryDirectory(prefix='wordstat-') as root:
+        fetcher = YandexWordstatApiFetcher(base_url=stub.url)
+        try:
+            runner.measure('wordstat.api', lambda: [fetcher.FetchInterestOverTime(keyword, timeframe) for keyword in keywords], len(keywords), 'keywords')
+        finally:
+            fetcher.Close()
+
+        try:
+            from YandexWordstat2Scraper import YandexWordstatScraper
+        except ImportError as err:
+            runner.skip('wordstat.scrape', f'selenium or undetected_chromedriver is not installed ({err})')
+            return
+
+        factory = functools.partial(YandexWordstatScraper, auth_url=stub.auth_url, headless=not args.headful)
+        pool = WordstatPool(size=args.wordstat_workers, download_root=root, max_attempts=1, scraper_factory=factory)
+        try:
+            try:
+                pool.DoAuth('benchmark', 'benchmark').result()
+            except Exception as err:
+                runner.skip('wordstat.scrape', f'Chrome could not be started or logged in ({type(err).__name__}: {err})')
+                return
+
+            def scrape():
+                futures = [pool.Submit(keyword, timeframe) for keyword in keywords]
+                return [future.result() for future in futures]
+
+            runner.measure('wordstat.scrape', scrape, len(keywords), 'keywords')
+
+            # fetch_through asks for the same keyword once per missing span, one after another, so a
+            # worker searches for the keyword its chart already shows and picks the period it already shows
+            spans = [(timeframe[0], END.replace(month=6, day=30).date()), timeframe]
+
+            def requery():
+                return [pool.Submit(keyword, span).result() for keyword in keywords for span in spans]
+
+            runner.measure('wordstat.scrape.requery', requery, len(keywords) * len(spans), 'spans')
+            print(f'    wordstat stub served {stub.exports} exports')
+        finally:
+            pool.Shutdown()
+
+
+SUITES = {
+    'preprocess': suite_preprocess,
+    'indicators': suite_indicators,
+    'composites': suite_composites,
+    'leadlag': suite_leadlag,
+    'exports': suite_exports,
+    'plots': suite_plots,
+    'google': suite_google,
+    'wordstat': suite_wordstat,
+}
+
+
+def load_baselines(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baselines(path: str, baselines: dict):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark every stage against synthetic panels and local stand-ins for Google Trends and Wordstat')
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every benchmark')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs before the timed ones')
+    parser.add_argument('--baselines', default=BASELINES_FILENAME, help='p50 seconds per scale and benchmark recorded on the reference machine')
+    parser.add_argument('--update-baselines', action='store_true', help='record the measured p50 as the new baselines instead of checking them')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='fraction above the baseline p50 that still passes')
+    parser.add_argument('--slack', type=float, default=0.02, help='seconds allowed on top of the tolerance, for millisecond benchmarks')
+    parser.add_argument('--json', help='write every run and stage timing to this file')
+    parser.add_argument('--recordings', help='directory with recorded Trends responses, served instead of synthetic ones')
+    parser.add_argument('--upstream', help='forward requests without a recording to this Trends URL and record them, e.g. https://trends.google.com/trends')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stubs wait before answering, to mimic a real network')
+    parser.add_argument('--render-delay', type=int, default=50, help='milliseconds the Wordstat stub pages take to react to a click')
+    parser.add_argument('--google-rate', type=float, default=1000)
+    parser.add_argument('--google-workers', type=int, default=4)
+    parser.add_argument('--wordstat-workers', type=int, default=2)
+    parser.add_argument('--headful', action='store_true', help='show the Chrome windows of the scrape benchmark')
+    return parser.parse_args(argv)
+
+
+def run(args: argparse.Namespace) -> int:
+    scale = SCALES[args.scale]
+    baselines = load_baselines(args.baselines)
+    recorded = baselines.get(args.scale, {'machine': None, 'p50': {}})
+    runner = Runner(args.repeat, args.warmup, {} if args.update_baselines else recorded['p50'], args.tolerance, args.slack)
+
+    print(f'Scale {args.scale} {scale}, {args.repeat} runs after {args.warmup} warmup on {machine()}')
+    if not args.update_baselines and recorded['machine'] not in (None, machine()):
+        print(f'Baselines were recorded on {recorded["machine"]}, rerun with --update-baselines on this one before trusting regressions')
+    for suite in args.suites:
+        print(f'\n[{suite}]')
+        SUITES[suite](runner, scale, args)
+
+    measured = [result for result in runner.results if result['status'] != SKIPPED]
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'scale': args.scale, 'config': scale, 'results': runner.results}, f, indent=1)
+
+    if args.update_baselines:
+        # Baselines of other machines aren't comparable, a new one starts the scale over
+        if recorded['machine'] != machine():
+            recorded = {'machine': machine(), 'p50': {}}
+        recorded['p50'].update({result['name']: round(result['p50'], 4) for result in measured})
+        baselines[args.scale] = recorded
+        save_baselines(args.baselines, baselines)
+        print(f'\nStored {len(measured)} baselines for scale {args.scale} in {args.baselines}')
+        return 0
+
+    regressions = [result['name'] for result in measured if result['status'] == REGRESSION]
+    unchecked = [result['name'] for result in measured if result['baseline'] is None]
+    if unchecked:
+        print(f'\nNo baseline for {", ".join(unchecked)}, run with --update-baselines to add them')
+    if regressions:
+        print(f'\nMore than {args.tolerance:.0%} + {args.slack:g}s slower than the baseline: {", ".join(regressions)}')
+        return 1
+    print(f'\n{len(measured)} benchmarks within {args.tolerance:.0%} of their baselines')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args(sys.argv[1:])))
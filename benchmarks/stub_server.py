@@ -0,0 +1,104 @@
+import multiprocessing
+import queue
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+# A fresh interpreter, so the server neither inherits the benchmark's threads nor competes with it for the GIL
+_CONTEXT = multiprocessing.get_context('spawn')
+START_TIMEOUT = 60
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Headers and body are separate writes, with Nagle on every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.stub.serve(self)
+
+    def do_POST(self):
+        self.server.stub.serve(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self._requests = self.counter()
+        self._process = None
+        self._address = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        if self._address is None:
+            raise RuntimeError(f'{type(self).__name__} is not started')
+        return self._address
+
+    @property
+    def requests(self) -> int:
+        return self._requests.value
+
+    def start(self):
+        ready = _CONTEXT.Queue()
+        self._process = _CONTEXT.Process(target=self._serve_forever, args=(ready,), name=type(self).__name__, daemon=True)
+        self._process.start()
+
+        deadline = time.monotonic() + START_TIMEOUT
+        while self._address is None:
+            try:
+                self._address = ready.get(timeout=0.1)
+            except queue.Empty:
+                if not self._process.is_alive() or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f'{type(self).__name__} did not start')
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _serve_forever(self, ready):
+        server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        server.daemon_threads = True
+        server.stub = self
+        ready.put(server.server_address[:2])
+        server.serve_forever()
+
+    @staticmethod
+    def counter():
+        # Counts requests in the server process where the benchmark can read them
+        return _CONTEXT.Value('l', 0)
+
+    @staticmethod
+    def increment(counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def serve(self, request: BaseHTTPRequestHandler):
+        self.increment(self._requests)
+        self.handle(request)
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        raise NotImplementedError
+
+    @staticmethod
+    def reply(request: BaseHTTPRequestHandler, status: int, content_type: str, body: str, headers: dict = None):
+        data = body.encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
@@ -0,0 +1,125 @@
+import functools
+import zlib
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Every keyword has one daily popularity curve from EPOCH on, so overlapping windows and
+# coarser resolutions of the same keyword agree with each other the way real Trends data does
+EPOCH = pd.Timestamp('2004-01-01')
+HORIZON = pd.Timestamp('2030-12-31')
+DAYS = pd.date_range(EPOCH, HORIZON, freq='D')
+
+YANDEX_TOTAL_QUERIES = 2e9
+MONTH_NAMES = ('January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December')
+RELATED_WORDS = ('price', 'buy', 'online', 'near me', 'review', 'cheap', 'best', 'how to', 'rate', 'news', 'forecast', 'calculator', 'credit', 'rent', 'sale')
+
+
+def keywords(count: int, prefix: str = 'keyword') -> List[str]:
+    return [f'{prefix} {i:05d}' for i in range(count)]
+
+
+def _rng(keyword: str, salt: str = '') -> np.random.Generator:
+    return np.random.default_rng(zlib.crc32(f'{salt}{keyword}'.encode('utf-8')))
+
+
+@functools.lru_cache(maxsize=256)
+def daily_levels(keyword: str) -> np.ndarray:
+    rng = _rng(keyword)
+    t = np.arange(len(DAYS))
+    walk = np.cumsum(rng.normal(0, 0.01, len(DAYS)))
+    season = rng.uniform(0.1, 0.5) * np.sin(2 * np.pi * (t / 365.25 + rng.uniform()))
+    week = 0.1 * np.sin(2 * np.pi * t / 7)
+    return np.exp(rng.uniform(0, 3) + walk + season + week + rng.normal(0, 0.08, len(DAYS)))
+
+
+def periods(days: pd.DatetimeIndex, freq: str) -> pd.DatetimeIndex:
+    # Trends labels weeks by their Sunday and months by their first day
+    if freq == 'D':
+        return days
+    if freq == 'W':
+        return days - pd.to_timedelta((days.dayofweek + 1) % 7, unit='D')
+    if freq == 'MS':
+        return days.to_period('M').to_timestamp()
+    raise ValueError(f'Unknown frequency {freq}, expected D, W or MS')
+
+
+def levels(keywords: Sequence[str], start, end, freq: str = 'D') -> pd.DataFrame:
+    window = (DAYS >= pd.Timestamp(start)) & (DAYS <= pd.Timestamp(end))
+    days = DAYS[window]
+    daily = pd.DataFrame(np.stack([daily_levels(keyword)[window] for keyword in keywords], axis=1), index=days, columns=list(keywords))
+    result = daily.groupby(periods(days, freq)).mean()
+    return result.rename_axis('date')
+
+
+def trends_frame(keywords: Sequence[str], start, end, freq: str = 'W') -> pd.DataFrame:
+    # What interest_over_time() gives for one payload: integers scaled to the payload's peak
+    values = levels(keywords, start, end, freq)
+    return (values * (100 / values.to_numpy().max())).round().astype('int64')
+
+
+def google_frames(keywords: Sequence[str], start, end, freq: str = 'W') -> Dict[str, pd.DataFrame]:
+    values = levels(keywords, start, end, freq)
+    scaled = (values * (100 / values.max())).round().astype('int64')
+    return {keyword: scaled[[keyword]] for keyword in keywords}
+
+
+def _yandex_columns(keywords: Sequence[str], start, end) -> Tuple[pd.DatetimeIndex, np.ndarray, np.ndarray]:
+    monthly = levels(keywords, start, end, 'MS')
+    absolute = np.round(monthly.to_numpy() * 10_000).astype('int64')
+    months = np.arange(len(monthly))
+    totals = YANDEX_TOTAL_QUERIES * (1 + 0.005 * months)
+    return monthly.index, absolute, absolute / totals[:, None] * 100
+
+
+def _period_names(index: pd.DatetimeIndex) -> List[str]:
+    return [f'{MONTH_NAMES[date.month - 1]} {date.year}' for date in index]
+
+
+def yandex_frames(keywords: Sequence[str], start, end) -> Dict[str, pd.DataFrame]:
+    # The CSV export as read by the scraper: spaces between thousands and a decimal comma
+    index, absolute, relative = _yandex_columns(keywords, start, end)
+    period = _period_names(index)
+    frames = {}
+    for i, keyword in enumerate(keywords):
+        frames[keyword] = pd.DataFrame({
+            'Period': period,
+            'Number of queries': [f'{value:,}'.replace(',', ' ') for value in absolute[:, i]],
+            'Percentage of total queries, %': [f'{value:.6f}'.replace('.', ',') for value in relative[:, i]],
+        })
+    return frames
+
+
+def wordstat_csv(keyword: str, start, end) -> str:
+    frame = yandex_frames([keyword], start, end)[keyword]
+    lines = [';'.join(frame.columns) + ';'] + [';'.join(row) + ';' for row in frame.itertuples(index=False)]
+    return '\n'.join(lines) + '\n'
+
+
+def wordstat_dynamics(keyword: str, start, end) -> dict:
+    index, absolute, relative = _yandex_columns([keyword], start, end)
+    return {'table': {'tableData': [
+        {'date': date.strftime('%d.%m.%Y'), 'absoluteValue': int(count), 'value': float(share)}
+        for date, count, share in zip(index, absolute[:, 0], relative[:, 0])
+    ]}}
+
+
+def related(keyword: str, relation: str, count: int = 8) -> List[Tuple[str, int]]:
+    rng = _rng(keyword, relation)
+    words = rng.choice(RELATED_WORDS, size=min(count, len(RELATED_WORDS)), replace=False)
+    values = np.sort(rng.integers(1, 101, size=len(words)))[::-1]
+    return [(f'{keyword} {word}', int(value)) for word, value in zip(words, values)]
+
+
+def lead_lag_inputs(candidates: int, months: int, lead: int = 3, seed: int = 0) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    # A few candidates lead the target by `lead` months, the rest are noise with gaps
+    rng = np.random.default_rng(seed)
+    driver = np.cumsum(rng.normal(size=months + lead))
+    values = rng.normal(size=(candidates, months)).cumsum(axis=1)
+    leading = rng.choice(candidates, size=max(1, candidates // 100), replace=False)
+    values[leading] = driver[lead:] + rng.normal(0, 0.5, size=(len(leading), months))
+    values[rng.random(values.shape) < 0.02] = np.nan
+    target = driver[:months] + rng.normal(0, 0.5, size=months)
+    labels = pd.DataFrame({'keyword': [f'candidate {i}' for i in range(candidates)], 'indicator': 'synthetic'})
+    return labels, values, target
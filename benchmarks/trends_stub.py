@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from typing import Optional
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import pandas as pd
+import requests
+
+from benchmarks import synthetic
+from benchmarks.stub_server import StubServer
+
+GOOGLE_TRENDS_URL = 'https://trends.google.com/trends'
+# Trends prefixes its JSON to keep it from being evaluated as a script, pytrends cuts it off
+EXPLORE_PREFIX = ")]}'"
+WIDGET_PREFIX = ")]}',"
+# Params that change between identical requests and must not be part of a recording's key
+VOLATILE_PARAMS = ('token', 'tz')
+
+
+def parse_timeframe(timeframe: str, today: pd.Timestamp = None):
+    today = (today or pd.Timestamp.today()).normalize()
+    if timeframe == 'all':
+        return synthetic.EPOCH, today
+    if timeframe.startswith('today '):
+        amount, unit = timeframe.split(' ', 1)[1].split('-')
+        offset = pd.DateOffset(years=int(amount)) if unit == 'y' else pd.DateOffset(months=int(amount))
+        return today - offset, today
+    if timeframe.startswith('now '):
+        return today - pd.Timedelta(days=int(timeframe.split(' ', 1)[1].split('-')[0])), today
+    start, end = timeframe.split(' ')
+    return pd.Timestamp(start), pd.Timestamp(end)
+
+
+def resolution(start: pd.Timestamp, end: pd.Timestamp) -> str:
+    # The resolutions Trends picks on its own, there is no way to ask for another one
+    days = (end - start).days
+    if days < 270:
+        return 'D'
+    if days < 1900:
+        return 'W'
+    return 'MS'
+
+
+def recording_key(path: str, params: dict) -> str:
+    stable = sorted((name, value) for name, value in params.items() if name not in VOLATILE_PARAMS)
+    return hashlib.sha1(json.dumps([path, stable], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class _Synthetic:
+    @staticmethod
+    def explore(params: dict) -> dict:
+        request = json.loads(params['req'])
+        items = request['comparisonItem']
+        widgets = [{'id': 'TIMESERIES', 'token': 'timeseries', 'request': {'comparisonItem': items, 'category': request.get('category', 0)}}]
+        for item in items:
+            restriction = {'complexKeywordsRestriction': {'keyword': [{'type': 'BROAD', 'value': item['keyword']}]}, 'time': item['time'], 'geo': item.get('geo', '')}
+            widgets.append({'id': 'RELATED_TOPICS', 'token': 'topics', 'request': {'restriction': restriction, 'keywordType': 'ENTITY'}})
+            widgets.append({'id': 'RELATED_QUERIES', 'token': 'queries', 'request': {'restriction': restriction, 'keywordType': 'QUERY'}})
+        return {'widgets': widgets}
+
+    @staticmethod
+    def multiline(params: dict) -> dict:
+        items = json.loads(params['req'])['comparisonItem']
+        start, end = parse_timeframe(items[0]['time'])
+        freq = resolution(start, end)
+        frame = synthetic.trends_frame(list(dict.fromkeys(item['keyword'] for item in items)), start, end, freq)
+
+        current = synthetic.periods(pd.DatetimeIndex([pd.Timestamp.today().normalize()]), freq)[0]
+        timeline = []
+        for date, row in zip(frame.index, frame[[item['keyword'] for item in items]].to_numpy()):
+            point = {'time': str(int(date.timestamp())), 'formattedTime': date.strftime('%b %d, %Y'), 'value': [int(value) for value in row], 'hasData': [True] * len(row)}
+            if date >= current:
+                point['isPartial'] = True
+            timeline.append(point)
+        return {'default': {'timelineData': timeline, 'averages': []}}
+
+    @staticmethod
+    def related(params: dict) -> dict:
+        request = json.loads(params['req'])
+        keyword = request['restriction']['complexKeywordsRestriction']['keyword'][0]['value']
+        lists = []
+        for kind in ('top', 'rising'):
+            if request['keywordType'] == 'QUERY':
+                ranked = [{'query': title, 'value': value, 'formattedValue': str(value), 'link': ''} for title, value in synthetic.related(keyword, f'queries {kind}')]
+            else:
+                ranked = [{'topic': {'mid': f'/m/{i}', 'title': title, 'type': 'Topic'}, 'value': value, 'formattedValue': str(value), 'link': ''}
+                          for i, (title, value) in enumerate(synthetic.related(keyword, f'topics {kind}'))]
+            lists.append({'rankedKeyword': ranked})
+        return {'default': {'rankedList': lists}}
+
+    @staticmethod
+    def autocomplete(keyword: str) -> dict:
+        return {'default': {'topics': [{'mid': f'/m/{i}', 'title': title, 'type': 'Topic'} for i, (title, _) in enumerate(synthetic.related(keyword, 'suggestions', 5))]}}
+
+
+class TrendsStub(StubServer):
+    """A local stand-in for the Trends endpoints pytrends talks to.
+
+    Responses come from `recordings` when a recording of the request exists. Otherwise, with
+    `upstream` set, the request is forwarded to the real service and recorded, and without it a
+    deterministic response is synthesized.
+    """
+
+    def __init__(self, recordings: Optional[str] = None, upstream: Optional[str] = None, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        super().__init__(host, port)
+        self.recordings = recordings
+        self.upstream = upstream
+        self.latency = latency
+        if recordings:
+            os.makedirs(recordings, exist_ok=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f'http://{host}:{port}/trends'
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = urlsplit(request.path)
+        path = parts.path[len('/trends'):] if parts.path.startswith('/trends') else parts.path
+        params = dict(parse_qsl(parts.query))
+        length = int(request.headers.get('Content-Length') or 0)
+        if length:
+            params.update(parse_qsl(request.rfile.read(length).decode('utf-8')))
+
+        try:
+            status, content_type, body = self._respond(request.command, path, params, dict(request.headers))
+        except Exception as err:
+            status, content_type, body = 500, 'text/plain', f'{type(err).__name__}: {err}'
+        self.reply(request, status, content_type, body, {'Set-Cookie': 'NID=benchmark; Path=/'} if path.startswith('/explore') else None)
+
+    def _respond(self, method: str, path: str, params: dict, headers: dict):
+        key = recording_key(path, params)
+        if self.recordings:
+            recorded = os.path.join(self.recordings, f'{key}.json')
+            if os.path.exists(recorded):
+                with open(recorded, encoding='utf-8') as f:
+                    saved = json.load(f)
+                return saved['status'], saved['content_type'], saved['body']
+
+        if self.upstream:
+            return self._forward(method, path, params, headers, key)
+        return self._synthesize(path, params)
+
+    def _forward(self, method: str, path: str, params: dict, headers: dict, key: str):
+        response = requests.request(method, self.upstream + path, params=params, headers={'User-Agent': headers.get('User-Agent', ''), 'Accept-Language': headers.get('accept-language', '')}, timeout=30)
+        content_type = response.headers.get('Content-Type', 'application/json')
+        if self.recordings and response.status_code == 200:
+            with open(os.path.join(self.recordings, f'{key}.json'), 'w', encoding='utf-8') as f:
+                json.dump({'path': path, 'params': params, 'status': response.status_code, 'content_type': content_type, 'body': response.text}, f, ensure_ascii=False)
+        return response.status_code, content_type, response.text
+
+    @staticmethod
+    def _synthesize(path: str, params: dict):
+        if path.startswith('/explore'):
+            return 200, 'text/html', '<html></html>'
+        if path == '/api/explore':
+            return 200, 'application/json', EXPLORE_PREFIX + json.dumps(_Synthetic.explore(params))
+        if path == '/api/widgetdata/multiline':
+            return 200, 'application/json', WIDGET_PREFIX + json.dumps(_Synthetic.multiline(params))
+        if path == '/api/widgetdata/relatedsearches':
+            return 200, 'application/json', WIDGET_PREFIX + json.dumps(_Synthetic.related(params))
+        if path.startswith('/api/autocomplete/'):
+            return 200, 'application/json', WIDGET_PREFIX + json.dumps(_Synthetic.autocomplete(unquote(path[len('/api/autocomplete/'):])))
+        return 404, 'text/plain', f'No stub for {path}'
+
+
+@contextmanager
+def pytrends_pointed_at(base_url: str):
+    # pytrends builds its endpoint URLs from a module constant when it is imported
+    from pytrends import request as pytrends_request
+
+    saved = {name: value for name, value in vars(pytrends_request.TrendReq).items() if name.endswith('_URL') and isinstance(value, str)}
+    saved_base = pytrends_request.BASE_TRENDS_URL
+    try:
+        pytrends_request.BASE_TRENDS_URL = base_url
+        for name, value in saved.items():
+            setattr(pytrends_request.TrendReq, name, value.replace(GOOGLE_TRENDS_URL, base_url))
+        yield
+    finally:
+        pytrends_request.BASE_TRENDS_URL = saved_base
+        for name, value in saved.items():
+            setattr(pytrends_request.TrendReq, name, value)
@@ -0,0 +1,44 @@
+// The scraper finds everything by absolute XPath, so elements are placed at exactly those
+// paths. Missing ancestors and preceding siblings are filled in with empty elements.
+function place(xpath, element) {
+  const steps = xpath.replace(/^\/html\/body\//, '').split('/');
+  let parent = document.body;
+  steps.forEach((step, i) => {
+    const match = step.match(/^(\w+)(?:\[(\d+)\])?$/);
+    const tag = match[1].toUpperCase();
+    const position = Number(match[2] || 1);
+    const same = () => Array.from(parent.children).filter((child) => child.tagName === tag);
+    const last = i === steps.length - 1;
+
+    while (same().length < position - (last ? 1 : 0)) {
+      parent.appendChild(document.createElement(tag));
+    }
+    if (last) {
+      const existing = same()[position - 1];
+      if (existing) {
+        parent.replaceChild(element, existing);
+      } else {
+        parent.appendChild(element);
+      }
+    } else {
+      parent = same()[position - 1];
+    }
+  });
+  return element;
+}
+
+function create(tag, attributes, text) {
+  const element = document.createElement(tag);
+  Object.entries(attributes || {}).forEach(([name, value]) => element.setAttribute(name, value));
+  if (text) {
+    element.textContent = text;
+  }
+  return element;
+}
+
+function show(element, visible) {
+  element.style.display = visible ? '' : 'none';
+}
+
+// Responses of the real pages take a while, how long is set by the benchmark
+const RENDER_DELAY = Number(new URLSearchParams(location.search).get('delay') || document.body.dataset.delay || 0);
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler
+from typing import Optional
+from urllib.parse import parse_qsl, quote, urlsplit
+
+import pandas as pd
+
+from benchmarks import synthetic
+from benchmarks.stub_server import StubServer
+
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wordstat')
+DEFAULT_MONTHS = 24
+SESSION_COOKIE = 'Session_id=benchmark; Path=/'
+
+
+def _month(value: str, default: pd.Timestamp) -> pd.Timestamp:
+    return pd.Timestamp(f'{value}-01') if value else default
+
+
+class WordstatStub(StubServer):
+    """Local copies of the passport login form and the Wordstat dynamics page.
+
+    Every control sits at the absolute XPath YandexWordstatScraper.Locators expects, and the
+    CSV export is served with the same layout as the real one. The dynamics endpoint that
+    YandexWordstatApiFetcher queries is answered as well. `render_delay` is how long, in
+    milliseconds, the pages take to react to a click, `latency` is added to every request.
+    With `session` set, the dynamics endpoint answers 401 to requests without that Session_id
+    cookie, the way it does once the session has expired.
+    """
+
+    def __init__(self, render_delay: int = 50, latency: float = 0.0, session: Optional[str] = None, host: str = '127.0.0.1', port: int = 0):
+        super().__init__(host, port)
+        self.render_delay = render_delay
+        self.latency = latency
+        self.session = session
+        self._exports = self.counter()
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f'http://{host}:{port}'
+
+    @property
+    def auth_url(self) -> str:
+        return f'{self.url}/auth?retpath={quote(self.url + "/wordstat", safe="")}'
+
+    @property
+    def exports(self) -> int:
+        return self._exports.value
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = urlsplit(request.path)
+        params = dict(parse_qsl(parts.query))
+        headers = {}
+        try:
+            if parts.path == '/auth':
+                status, content_type, body = 200, 'text/html; charset=utf-8', self._page('auth.html')
+            elif parts.path == '/wordstat':
+                status, content_type, body = 200, 'text/html; charset=utf-8', self._page('wordstat.html')
+                headers['Set-Cookie'] = SESSION_COOKIE
+            elif parts.path == '/static/stub.js':
+                status, content_type, body = 200, 'application/javascript', self._page('stub.js')
+            elif parts.path == '/wordstat/export.csv':
+                status, content_type, body = 200, 'text/csv; charset=utf-8', self._export(params)
+                headers['Content-Disposition'] = 'attachment; filename="wordstat_dynamic.csv"'
+            elif parts.path == '/wordstat/api/search' and request.command == 'POST' and not self._authorized(request):
+                status, content_type, body = 401, 'application/json', json.dumps({'error': 'unauthorized'})
+            elif parts.path == '/wordstat/api/search' and request.command == 'POST':
+                payload = json.loads(request.rfile.read(int(request.headers.get('Content-Length') or 0)))
+                status, content_type, body = 200, 'application/json', json.dumps(self._dynamics(payload))
+            else:
+                status, content_type, body = 404, 'text/plain', f'No stub for {parts.path}'
+        except Exception as err:
+            status, content_type, body = 500, 'text/plain', f'{type(err).__name__}: {err}'
+        self.reply(request, status, content_type, body, headers)
+
+    def _authorized(self, request: BaseHTTPRequestHandler) -> bool:
+        if self.session is None:
+            return True
+        cookies = SimpleCookie(request.headers.get('Cookie', ''))
+        return 'Session_id' in cookies and cookies['Session_id'].value == self.session
+
+    def _page(self, name: str) -> str:
+        with open(os.path.join(PAGES, name), encoding='utf-8') as f:
+            return f.read().replace('{delay}', str(self.render_delay))
+
+    def _export(self, params: dict) -> str:
+        self.increment(self._exports)
+        end = _month(params.get('end'), pd.Timestamp.today().normalize().replace(day=1))
+        start = _month(params.get('start'), end - pd.DateOffset(months=DEFAULT_MONTHS - 1))
+        return synthetic.wordstat_csv(params.get('keyword', ''), start, end + pd.offsets.MonthEnd(0))
+
+    @staticmethod
+    def _dynamics(payload: dict) -> dict:
+        filters = payload['filters']
+        start = pd.to_datetime(filters['startDate'], format='%d.%m.%Y')
+        end = pd.to_datetime(filters['endDate'], format='%d.%m.%Y')
+        return synthetic.wordstat_dynamics(payload['searchValue'], start, end)
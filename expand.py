@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+from typing import List
+
+from GoogleTrendsScheduler import GoogleTrendsScheduler
+from KeywordExpander import RELATIONS, KeywordExpander, RelatedStore
+from batch import read_keywords
+
+KEYWORDS_FILENAME = 'keywords.txt'
+EXPANSION_FILENAME = 'expansion.csv'
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Expand seed keywords through Google Trends suggestions and related searches')
+    parser.add_argument('seeds', help='file with one seed keyword per line, lines starting with # are skipped')
+    parser.add_argument('--output', default='./expand_output', help='directory for keywords.txt, ready for batch.py, and expansion.csv')
+    parser.add_argument('--depth', type=int, default=2, help='how many relations away from a seed to go')
+    parser.add_argument('--budget', type=int, default=200, help='maximum number of keywords, seeds included')
+    parser.add_argument('--relations', nargs='+', choices=RELATIONS, default=list(RELATIONS))
+    parser.add_argument('--timeframe', default='today 5-y', help='Google Trends timeframe for related searches')
+    parser.add_argument('--geo', default='')
+    parser.add_argument('--workers', type=int, default=4, help='keywords expanded at the same time')
+    parser.add_argument('--store', default='./.cache/related.sqlite3', help='responses kept for later runs, next to the series store')
+    parser.add_argument('--google-workers', type=int, default=1)
+    parser.add_argument('--google-rate', type=float, default=0.2, help='Google Trends requests per second')
+    parser.add_argument('--google-proxies', nargs='*', default=[], help='proxies to rotate through when Google throttles')
+    parser.add_argument('--google-user-agents', nargs='*', default=[], help='user agents to rotate through when Google throttles')
+    return parser.parse_args(argv)
+
+
+def run(args: argparse.Namespace) -> int:
+    seeds = read_keywords(args.seeds)
+    os.makedirs(args.output, exist_ok=True)
+
+    store = RelatedStore(args.store)
+    scheduler = GoogleTrendsScheduler(
+        rate=args.google_rate, workers=args.google_workers,
+        identities=GoogleTrendsScheduler.BuildIdentities(args.google_proxies, args.google_user_agents),
+    )
+    try:
+        expander = KeywordExpander(scheduler, workers=args.workers, relations=args.relations, timeframe=args.timeframe, geo=args.geo, store=store)
+        expansion = expander.expand(seeds, max_depth=args.depth, max_nodes=args.budget)
+    finally:
+        scheduler.Shutdown()
+
+    expansion.to_csv(os.path.join(args.output, EXPANSION_FILENAME), index=False)
+    with open(os.path.join(args.output, KEYWORDS_FILENAME), 'w', encoding='utf-8') as f:
+        f.writelines(f'{keyword}\n' for keyword in expansion['keyword'])
+
+    print(f'{len(expansion)} keywords from {len(seeds)} seeds, cache {expander.cache.stats()}, store {store.stats()}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args(sys.argv[1:])))
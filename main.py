@@ -1,84 +1,132 @@
-import io
+import Startup
+import asyncio
 
 from shiny import reactive, render, req
 from shiny.express import input, ui
-import seaborn as sns
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import calendar
 
-from GoogleTrendsFetcher import GoogleTrendsFetcher
-from YandexWordstat2Scraper import YandexWordstatScraper
+from Services import TRACE_REQUESTS, fetch_cache, google_scheduler, lead_lag_scanner, plot_cache, prewarm, series_store, watchlist, watchlist_refresher, wordstat_pool
+from GoogleTrendsScheduler import GoogleTrendsScheduler
+from FetchExecutor import run_blocking, run_compute
+from DateRange import DateRange
+from Panel import MonthlyPanel
 from dataclasses import dataclass
 import datetime
+import Exports
 import Indicators
+import LeadLag
+import Metrics
+import Pipeline
+import Plots
 import Preprocessors
 from typing import Tuple
 
+import pandas as pd
+
 
 @dataclass
 class FetchingResult:
     keywords: str
     serialized_daterange: str
     data: any
+    frequency: str = Preprocessors.MONTHLY
 
-    def is_actual(self, keywords, serialized_daterange):
-        return self.keywords == keywords and self.serialized_daterange == serialized_daterange
+    def is_actual(self, keywords, serialized_daterange, frequency):
+        return self.keywords == keywords and self.serialized_daterange == serialized_daterange and self.frequency == frequency
 
 
 ui.page_opts(title="Application for Constructing Leading Indicators Based on Search Queries")
 
-google_client = GoogleTrendsFetcher()
-yandex_client = YandexWordstatScraper()
+# The pool and its login are shared by the process, every session still has to log in itself
 auth_success = reactive.value(False)
 google_fetch_result = reactive.value(FetchingResult("", "", None))
 yandex_fetch_result = reactive.value(FetchingResult("", "", None))
 
-indicator_manager = Indicators.IndicatorsManager((
-    Indicators.GoogleRelativeIndicator,
-    Indicators.YandexRelativeIndicator,
-    Indicators.YandexAbsoluteIndicator,
-    Indicators.RelativeNormalizedSumIndicator)
-)
+indicator_manager = Indicators.IndicatorsManager(Pipeline.INDICATORS)
+
+
+@reactive.effect
+def prewarm_services():
+    # Effects only run for real sessions, so this starts once the server is already answering
+    prewarm()
 
 
 @reactive.calc
 @reactive.event(input.indicator_select)
 def get_selected_indicator() -> Indicators.BaseIndicator:
-    print(input.indicator_select())
     return indicator_manager.get_indicator_by_name(input.indicator_select())
 
 
 @reactive.calc
 @reactive.event(google_fetch_result)
 def calculate_preprocessed_google_data():
-    return Preprocessors.GooglePreprocessor.process(google_fetch_result.get().data, google_fetch_result.get().keywords, google_fetch_result.get().serialized_daterange)
+    result = google_fetch_result.get()
+    return Pipeline.preprocess_source(Pipeline.GOOGLE, result.data, result.keywords, result.serialized_daterange, result.frequency)
 
 
 @reactive.calc
 @reactive.event(yandex_fetch_result)
 def calculate_preprocessed_yandex_data():
-    return Preprocessors.YandexPreprocessor.process(yandex_fetch_result.get().data, yandex_fetch_result.get().keywords, yandex_fetch_result.get().serialized_daterange)
+    result = yandex_fetch_result.get()
+    return Pipeline.preprocess_source(Pipeline.YANDEX, result.data, result.keywords, result.serialized_daterange, result.frequency)
+
+
+@reactive.calc
+@reactive.event(calculate_preprocessed_google_data, calculate_preprocessed_yandex_data)
+def calculate_panel() -> MonthlyPanel:
+    return MonthlyPanel.from_frames({'google': calculate_preprocessed_google_data(), 'yandex': calculate_preprocessed_yandex_data()})
 
 
 @reactive.calc
-@reactive.event(get_selected_indicator, calculate_preprocessed_google_data, calculate_preprocessed_yandex_data)
+@reactive.event(get_selected_indicator, calculate_panel)
 def calculate_indicator_data():
-    return get_selected_indicator().aggregate(calculate_preprocessed_google_data(), calculate_preprocessed_yandex_data())
+    return indicator_manager.compute(get_selected_indicator(), calculate_panel())
+
+
+async def render_line_plot(output_id: str, data, x: str, y: str, alt: str) -> dict:
+    width = input[f".clientdata_output_{output_id}_width"]()
+    height = input[f".clientdata_output_{output_id}_height"]()
+    pixelratio = input[".clientdata_pixelratio"]()
+
+    path = await run_compute(plot_cache.render, data, x, y, width, height, pixelratio)
+    return {"src": path, "width": f"{width}px", "height": f"{height}px", "alt": alt}
+
+
+@reactive.calc
+def calculate_scan_target():
+    file = req(input.target_file())
+    return LeadLag.read_target(file[0]["datapath"])
+
+
+@reactive.calc
+def calculate_scan_candidates():
+    # Indicators of many keywords come from batch mode, otherwise the fetched keyword is scanned alone
+    file = input.candidates_file()
+    if file:
+        return pd.read_csv(file[0]["datapath"])
+    if input.scan_watchlist():
+        return watchlist.indicator_rows(input.frequency())
+    req(google_fetch_result.get().data is not None and yandex_fetch_result.get().data is not None)
+    return Pipeline.indicator_rows(google_fetch_result.get().keywords, indicator_manager, calculate_panel())
+
+
+def export_filename(name: str):
+    return lambda: f"{name}.{input.export_format()}"
+
+
+def export_stream(frame):
+    return Exports.iterate_blocking(Exports.stream(frame, input.export_format()), f'export.{input.export_format()}')
 
 
 def serialize_daterange(daterange: Tuple[datetime.datetime, datetime.datetime]) -> str:
-    d = f'{daterange[0].strftime("%Y-%m")}-01 {daterange[1].strftime("%Y-%m")}-{calendar.monthrange(daterange[1].year, daterange[1].month)[1]}'
-    print(d)
-    return d
+    return DateRange.from_months(*daterange).serialize()
 
 
-async def try_fetch_google_data(keywords: str, daterange_str: str):
+async def try_fetch_google_data(keywords: str, daterange_str: str, daterange, frequency: str):
     try:
-        google_client.BuildPayload([keywords], timeframe=daterange_str)
-        fetched = google_client.FetchInterestOverTime()
-
-        google_fetch_result.set(FetchingResult(keywords, daterange_str, fetched))
+        fetched = await fetch_cache.get_async(
+            (Pipeline.GOOGLE, keywords, daterange_str, '', frequency),
+            lambda: run_blocking(Pipeline.fetch_google_data, google_scheduler, series_store, keywords, DateRange.from_months(*daterange), priority=GoogleTrendsScheduler.INTERACTIVE, freq=frequency),
+        )
 
         msg = f"Successfully fetched Google Trends data"
         ui.notification_show(
@@ -87,6 +135,7 @@ async def try_fetch_google_data(keywords: str, daterange_str: str):
             duration=2,
         )
         print(msg)
+        return FetchingResult(keywords, daterange_str, fetched, frequency)
     except Exception as err:
         msg = f"Failed to fetch Google Trends data, try again later. Error {err}"
         ui.notification_show(
@@ -97,11 +146,12 @@ async def try_fetch_google_data(keywords: str, daterange_str: str):
         print(msg)
 
 
-async def try_fetch_yandex_data(keywords: str, daterange_str: str, daterange):
+async def try_fetch_yandex_data(keywords: str, daterange_str: str, daterange, frequency: str):
     try:
-        fetched = yandex_client.FetchInterestOverTime(keywords, daterange)
-
-        yandex_fetch_result.set(FetchingResult(keywords, daterange_str, fetched))
+        fetched = await fetch_cache.get_async(
+            (Pipeline.YANDEX, keywords, daterange_str, ''),
+            lambda: run_blocking(Pipeline.fetch_yandex_data, wordstat_pool, series_store, keywords, DateRange.from_months(*daterange)),
+        )
 
         msg = f"Successfully fetched Yandex Wordstat data"
         ui.notification_show(
@@ -110,6 +160,8 @@ async def try_fetch_yandex_data(keywords: str, daterange_str: str, daterange):
             duration=2,
         )
         print(msg)
+        # Wordstat is monthly whatever the frequency, only the preprocessing of the cached data differs
+        return FetchingResult(keywords, daterange_str, fetched, frequency)
 
     except Exception as err:
         msg = f"Failed to fetch Yandex Wordstat data, try again later. Error {err}"
@@ -121,33 +173,77 @@ async def try_fetch_yandex_data(keywords: str, daterange_str: str, daterange):
         print(msg)
 
 
+@ui.bind_task_button(button_id="action_button")
+@reactive.extended_task
+async def fetch_task(keywords: str, daterange_str: str, daterange, frequency: str, fetch_google: bool, fetch_yandex: bool):
+    jobs = {}
+    if fetch_google:
+        jobs['google'] = try_fetch_google_data(keywords, daterange_str, daterange, frequency)
+    if fetch_yandex:
+        jobs['yandex'] = try_fetch_yandex_data(keywords, daterange_str, daterange, frequency)
+
+    with ui.Progress(min=0, max=len(jobs)) as progress, Metrics.trace(f"fetch '{keywords}' {daterange_str}", enabled=TRACE_REQUESTS, log=True):
+        progress.set(0, message=f"Fetching search data for '{keywords}'")
+
+        async def track(name, job):
+            result = await job
+            progress.inc(1, detail=f"{name} finished")
+            return result
+
+        results = await asyncio.gather(*(track(name, job) for name, job in jobs.items()))
+
+    return dict(zip(jobs.keys(), results))
+
+
 @reactive.effect
-@reactive.event(input.action_button)
-async def fetch_data():
-    if not auth_success.get():
-        msg = f"You have to authorize with Yandex Passport first"
+def apply_fetch_results():
+    results = fetch_task.result()
+
+    if results.get('google') is not None:
+        google_fetch_result.set(results['google'])
+    if results.get('yandex') is not None:
+        yandex_fetch_result.set(results['yandex'])
+
+
+def serve_watched(keywords: str, daterange_str: str, frequency: str, fetch_google: bool, fetch_yandex: bool) -> Tuple[bool, bool]:
+    # Watched keywords are kept up to date in the background, what they cover needs no fetching
+    watched = watchlist.result(keywords, frequency)
+    if watched is None:
+        return fetch_google, fetch_yandex
+
+    daterange = DateRange.parse(daterange_str)
+    served = []
+    if fetch_google and watched.covers(daterange, [Pipeline.GOOGLE]):
+        google_fetch_result.set(FetchingResult(keywords, daterange_str, watched.raw[Pipeline.GOOGLE], frequency))
+        served.append("Google Trends")
+        fetch_google = False
+    if fetch_yandex and watched.covers(daterange, [Pipeline.YANDEX]):
+        yandex_fetch_result.set(FetchingResult(keywords, daterange_str, watched.raw[Pipeline.YANDEX], frequency))
+        served.append("Yandex Wordstat")
+        fetch_yandex = False
+
+    if served:
+        msg = f"Served {' and '.join(served)} data from the watchlist, refreshed {pd.Timestamp(watched.refreshed_at, unit='s').strftime('%Y-%m-%d %H:%M')} UTC"
         ui.notification_show(
             msg,
-            type="error",
+            type="message",
             duration=2,
         )
         print(msg)
-        return
+    return fetch_google, fetch_yandex
+
 
+@reactive.effect
+@reactive.event(input.action_button)
+def fetch_data():
     keywords = req(input.text())
     daterange_str = serialize_daterange(input.daterange())
+    frequency = input.frequency()
 
-    trying_to_fetch_new = False
+    fetch_google = not google_fetch_result.get().is_actual(keywords, daterange_str, frequency)
+    fetch_yandex = not yandex_fetch_result.get().is_actual(keywords, daterange_str, frequency)
 
-    if not google_fetch_result.get().is_actual(keywords, daterange_str):
-        trying_to_fetch_new = True
-        await try_fetch_google_data(keywords, daterange_str)
-
-    if not yandex_fetch_result.get().is_actual(keywords, daterange_str):
-        trying_to_fetch_new = True
-        await try_fetch_yandex_data(keywords, daterange_str, input.daterange())
-
-    if not trying_to_fetch_new:
+    if not fetch_google and not fetch_yandex:
         msg = f"Already fetched actual data"
         ui.notification_show(
             msg,
@@ -155,17 +251,68 @@ async def fetch_data():
             duration=2,
         )
         print(msg)
+        return
+
+    fetch_google, fetch_yandex = serve_watched(keywords, daterange_str, frequency, fetch_google, fetch_yandex)
+    if not fetch_google and not fetch_yandex:
+        return
+
+    if not auth_success.get():
+        msg = f"You have to authorize with Yandex Passport first"
+        ui.notification_show(
+            msg,
+            type="error",
+            duration=2,
+        )
+        print(msg)
+        return
+
+    fetch_task(keywords, daterange_str, input.daterange(), frequency, fetch_google, fetch_yandex)
+
+
+@reactive.effect
+@reactive.event(input.watch_button)
+def watch_keyword():
+    keywords = req(input.text())
+    watchlist.add(keywords, input.daterange()[0], input.frequency())
+    if watchlist_refresher is not None:
+        watchlist_refresher.wake()
+
+    msg = f"Watching '{keywords}', it is kept up to date in the background"
+    ui.notification_show(
+        msg,
+        type="message",
+        duration=2,
+    )
+    print(msg)
+
+
+@reactive.effect
+@reactive.event(input.cancel_button)
+def cancel_fetch():
+    if fetch_task.status() != "running":
+        return
+
+    fetch_task.cancel()
+
+    msg = f"Fetching cancelled"
+    ui.notification_show(
+        msg,
+        type="warning",
+        duration=2,
+    )
+    print(msg)
 
 
 @reactive.effect
 @reactive.event(input.yandex_auth_btn)
-def yandex_auth():
+async def yandex_auth():
     global auth_success
     login = req(input.yandex_login_text())
     password = req(input.yandex_password_text())
 
     try:
-        yandex_client.DoAuth(login, password)
+        await asyncio.wrap_future(wordstat_pool.DoAuth(login, password))
         auth_success.set(True)
     except Exception as err:
         msg = f"Yandex Passport authorization error: {err}"
@@ -181,7 +328,13 @@ with ui.sidebar(width=350):
     with ui.card():
         ui.input_text("text", "Search keywords", placeholder="Enter search keyword...")
         ui.input_date_range("daterange", "Search aggregation range", start="2020-05-03", min="2018-01-01", end="2022-06-12", max="2024-03-31")
-        ui.input_action_button("action_button", "Request search data")
+        ui.input_select("frequency", "Series frequency", Preprocessors.FREQUENCIES)
+        with ui.layout_columns():
+            ui.input_task_button("action_button", "Request search data")
+            ui.input_action_button("cancel_button", "Cancel")
+        ui.input_action_button("watch_button", "Watch keyword")
+        ui.input_switch("interactive_charts", "Interactive charts")
+        ui.input_select("export_format", "Export format", Exports.FORMATS)
 
 
     @render.express
@@ -208,12 +361,14 @@ with ui.layout_columns():
                 ui.p("Nothing to render yet. Make request with search keywords.")
                 return
 
-            @render.plot(alt=f"Relative popularity via Google Trends")
-            def _render_google_plot():
-                ax = sns.lineplot(data=calculate_preprocessed_google_data(), x='date', y='relative_value')
-                plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-                plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=365))
-                return ax
+            if input.interactive_charts():
+                @render.ui
+                def _render_google_chart():
+                    return Plots.interactive_chart("google_chart", calculate_preprocessed_google_data(), 'date', 'relative_value')
+            else:
+                @render.image
+                async def _render_google_plot():
+                    return await render_line_plot("_render_google_plot", calculate_preprocessed_google_data(), 'date', 'relative_value', "Relative popularity via Google Trends")
 
             @render.data_frame
             def _render_google_stats():
@@ -221,17 +376,13 @@ with ui.layout_columns():
                 return render.DataGrid(stats.loc[stats['index'] != 'date'])
 
             with ui.layout_columns():
-                @render.download(label='Download raw .csv', filename='raw_google_data.csv')
-                def _download_raw_google_csv():
-                    with io.BytesIO() as buf:
-                        google_fetch_result.get().data.to_csv(buf)
-                        yield buf.getvalue()
+                @render.download(label='Download raw data', filename=export_filename('raw_google_data'))
+                def _download_raw_google():
+                    return export_stream(google_fetch_result.get().data)
 
-                @render.download(label='Download preprocessed .csv', filename='preprocessed_google_data.csv')
-                def _download_preprocessed_google_csv():
-                    with io.BytesIO() as buf:
-                        calculate_preprocessed_google_data().to_csv(buf)
-                        yield buf.getvalue()
+                @render.download(label='Download preprocessed data', filename=export_filename('preprocessed_google_data'))
+                def _download_preprocessed_google():
+                    return export_stream(calculate_preprocessed_google_data())
 
 
     @render.express
@@ -243,13 +394,14 @@ with ui.layout_columns():
                 ui.p("Nothing to render yet. Make request with search keywords.")
                 return
 
-            @render.plot(alt=f"Relative popularity via Yandex Wordstat")
-            @reactive.event(input.yandex_plot_radio, calculate_preprocessed_yandex_data)
-            def _render_yandex_plot():
-                ax = sns.lineplot(data=calculate_preprocessed_yandex_data(), x='date', y=input.yandex_plot_radio())
-                plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-                plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=365))
-                return ax
+            if input.interactive_charts():
+                @render.ui
+                def _render_yandex_chart():
+                    return Plots.interactive_chart("yandex_chart", calculate_preprocessed_yandex_data(), 'date', input.yandex_plot_radio())
+            else:
+                @render.image
+                async def _render_yandex_plot():
+                    return await render_line_plot("_render_yandex_plot", calculate_preprocessed_yandex_data(), 'date', input.yandex_plot_radio(), "Relative popularity via Yandex Wordstat")
 
             ui.input_radio_buttons(
                 "yandex_plot_radio",
@@ -263,17 +415,13 @@ with ui.layout_columns():
                 return render.DataGrid(stats.loc[stats['index'] != 'date'])
 
             with ui.layout_columns():
-                @render.download(label='Download raw .csv', filename='raw_yandex_data.csv')
-                def _download_raw_yandex_csv():
-                    with io.BytesIO() as buf:
-                        yandex_fetch_result.get().data.to_csv(buf)
-                        yield buf.getvalue()
+                @render.download(label='Download raw data', filename=export_filename('raw_yandex_data'))
+                def _download_raw_yandex():
+                    return export_stream(yandex_fetch_result.get().data)
 
-                @render.download(label='Download preprocessed .csv', filename='preprocessed_yandex_data.csv')
-                def _download_preprocessed_yandex_csv():
-                    with io.BytesIO() as buf:
-                        calculate_preprocessed_yandex_data().to_csv(buf)
-                        yield buf.getvalue()
+                @render.download(label='Download preprocessed data', filename=export_filename('preprocessed_yandex_data'))
+                def _download_preprocessed_yandex():
+                    return export_stream(calculate_preprocessed_yandex_data())
 
 
 @render.express
@@ -293,11 +441,20 @@ def _render_indicator_card():
                     indicator_manager.get_names(),
                 )
 
-                @render.download(label='Download .csv', filename='indicator_data.csv')
-                def _download_indicator_csv():
-                    with io.BytesIO() as buf:
-                        calculate_indicator_data().to_csv(buf)
-                        yield buf.getvalue()
+                @render.download(label='Download indicator', filename=export_filename('indicator_data'))
+                def _download_indicator():
+                    return export_stream(calculate_indicator_data())
+
+                @render.download(label='Download all stages (.zip)', filename=lambda: f"bundle_{input.export_format()}.zip")
+                def _download_bundle():
+                    frames = {
+                        'raw_google_data': google_fetch_result.get().data,
+                        'raw_yandex_data': yandex_fetch_result.get().data,
+                        'preprocessed_google_data': calculate_preprocessed_google_data(),
+                        'preprocessed_yandex_data': calculate_preprocessed_yandex_data(),
+                        'indicator_data': Pipeline.indicator_rows(google_fetch_result.get().keywords, indicator_manager, calculate_panel()),
+                    }
+                    return Exports.iterate_blocking(Exports.stream_bundle(frames, input.export_format()), 'export.bundle')
 
             with ui.card():
                 @render.text
@@ -305,14 +462,37 @@ def _render_indicator_card():
                     return get_selected_indicator().description
 
             with ui.card():
-                @render.plot(alt=f"Indicator graph")
-                def _render_indicator_plot():
-                    ax = sns.lineplot(data=calculate_indicator_data(), x='date', y='value')
-                    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-                    plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=365))
-                    return ax
+                if input.interactive_charts():
+                    @render.ui
+                    def _render_indicator_chart():
+                        return Plots.interactive_chart("indicator_chart", calculate_indicator_data(), 'date', 'value')
+                else:
+                    @render.image
+                    async def _render_indicator_plot():
+                        return await render_line_plot("_render_indicator_plot", calculate_indicator_data(), 'date', 'value', "Indicator graph")
 
                 @render.data_frame
                 def _render_indicator_stats():
                     stats = calculate_indicator_data().describe().transpose().reset_index()
                     return render.DataGrid(stats.loc[stats['index'] != 'date'])
+
+
+@render.express
+def _render_lead_lag_card():
+    with ui.card():
+        ui.card_header("Lead/lag scan")
+
+        with ui.layout_columns(col_widths=(4, 4, 4)):
+            ui.input_file("target_file", "Target series .csv (date, value)", accept=[".csv"])
+            ui.input_file("candidates_file", "Indicators .csv from batch mode (optional)", accept=[".csv"])
+            ui.input_slider("lag_window", "Lag window, months", min=0, max=24, value=(0, 12))
+        ui.input_switch("scan_watchlist", "Scan all watched keywords when no indicators file is uploaded")
+
+        @render.data_frame
+        async def _render_lead_lag_table():
+            result = await run_compute(LeadLag.scan_frame, lead_lag_scanner, calculate_scan_candidates(), calculate_scan_target(), input.lag_window())
+            return render.DataGrid(result.round(4))
+
+
+
+Startup.ready()
@@ -0,0 +1,24 @@
+import io
+
+import pandas as pd
+
+import Exports
+
+
+def _exported(frame):
+    return pd.read_csv(io.BytesIO(b''.join(Exports.stream(frame, Exports.CSV, chunk_rows=2))))
+
+
+def test_row_numbers_of_a_filtered_frame_are_dropped():
+    frame = pd.DataFrame({'keyword': ['a', 'b', 'c', 'd', 'e'], 'value': [1, 2, 3, 4, 5]})
+    exported = _exported(frame[frame['value'] % 2 == 1])
+    assert list(exported.columns) == ['keyword', 'value']
+    assert exported['value'].tolist() == [1, 3, 5]
+
+
+def test_dates_and_named_indexes_become_columns():
+    dates = pd.date_range('2024-01-01', periods=3, freq='MS')
+    assert list(_exported(pd.DataFrame({'value': [1, 2, 3]}, index=dates)).columns) == ['index', 'value']
+
+    named = pd.DataFrame({'value': [1, 2, 3]}, index=pd.Index(['a', 'b', 'c'], name='keyword'))
+    assert list(_exported(named).columns) == ['keyword', 'value']
@@ -0,0 +1,43 @@
+import KeywordExpander as keyword_expander
+from KeywordExpander import QUERIES, KeywordExpander, RelatedStore
+
+
+class _CountingExpander(KeywordExpander):
+    # Answers from a fixed graph instead of the scheduler and counts what would have been requested
+    def __init__(self, graph, **kwargs):
+        super().__init__(scheduler=None, relations=[QUERIES], **kwargs)
+        self.graph = graph
+        self.fetched = []
+
+    def _fetch(self, relation, keyword):
+        self.fetched.append(keyword)
+        return [(relation, title, 100.0) for title in self.graph.get(keyword, [])]
+
+
+GRAPH = {'seed': ['alpha', 'beta'], 'alpha': ['gamma'], 'beta': ['gamma', 'delta']}
+
+
+def test_second_run_is_answered_from_the_store(tmp_path):
+    path = str(tmp_path / 'related.sqlite3')
+
+    first = _CountingExpander(GRAPH, store=RelatedStore(path))
+    expected = first.expand(['seed'], max_depth=2)
+    assert sorted(first.fetched) == ['alpha', 'beta', 'seed']
+
+    # A fresh expander has an empty in-memory cache, the store alone has to save the requests
+    store = RelatedStore(path)
+    second = _CountingExpander(GRAPH, store=store)
+    assert second.expand(['seed'], max_depth=2).equals(expected)
+    assert second.fetched == []
+    assert store.stats() == {'hits': 3, 'misses': 0}
+
+
+def test_stale_responses_are_fetched_again(monkeypatch, tmp_path):
+    path = str(tmp_path / 'related.sqlite3')
+    monkeypatch.setattr(keyword_expander.time, 'time', lambda: 0.0)
+    _CountingExpander(GRAPH, store=RelatedStore(path, ttl=60)).expand(['seed'], max_depth=1)
+
+    monkeypatch.setattr(keyword_expander.time, 'time', lambda: 61.0)
+    later = _CountingExpander(GRAPH, store=RelatedStore(path, ttl=60))
+    later.expand(['seed'], max_depth=1)
+    assert later.fetched == ['seed']
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import Indicators
+from DateRange import DateRange
+from Panel import KeywordPanel, MonthlyPanel
+from Preprocessors import GooglePreprocessor, YandexPreprocessor
+from benchmarks import synthetic
+
+METRIC = 'relative_value'
+COMPOSITES = (Indicators.FirstComponentIndicator, Indicators.DiffusionIndexIndicator, Indicators.WeightedZScoreIndicator)
+
+
+@pytest.fixture(scope='module')
+def frames():
+    keywords = synthetic.keywords(24)
+    daterange = DateRange.from_months(pd.Timestamp('2018-01-01'), pd.Timestamp('2022-12-01'))
+    google = GooglePreprocessor.process_batch(synthetic.google_frames(keywords, daterange.start, daterange.end, 'W'), daterange)
+    yandex = YandexPreprocessor.process_batch(synthetic.yandex_frames(keywords, daterange.start, daterange.end), daterange)
+
+    frames = {keyword: {'google': google[keyword], 'yandex': yandex[keyword]} for keyword in keywords}
+    # Gaps, so every pair is correlated over different dates
+    for i, keyword in enumerate(keywords[:8]):
+        frames[keyword]['google'] = frames[keyword]['google'].sample(frac=0.8, random_state=i).sort_values('date')
+    return frames
+
+
+def _warm(panel):
+    # Moments and the component are fitted lazily, an incremental update starts from fitted ones
+    for indicator in COMPOSITES:
+        indicator.aggregate(panel)
+    return panel
+
+
+def _assert_same_moments(updated, refit):
+    ours, theirs = updated.moments(METRIC), refit.moments(METRIC)
+    assert sorted(ours.labels) == sorted(theirs.labels)
+    order = [ours.labels.index(label) for label in theirs.labels]
+    for name in ('pair_count', 'cross', 'pair_sum', 'pair_square'):
+        np.testing.assert_allclose(getattr(ours, name)[np.ix_(order, order)], getattr(theirs, name), rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(ours.correlation()[np.ix_(order, order)], theirs.correlation(), atol=1e-9)
+
+
+def _assert_same_indicators(updated, refit):
+    for indicator in COMPOSITES:
+        ours, theirs = indicator.aggregate(updated), indicator.aggregate(refit)
+        pd.testing.assert_series_equal(ours['date'], theirs['date'])
+        np.testing.assert_allclose(ours['value'].to_numpy(), theirs['value'].to_numpy(), rtol=1e-6, atol=1e-6, err_msg=indicator.name)
+
+
+def test_correlation_is_pairwise_complete(frames):
+    panel = KeywordPanel.from_frames(frames)
+    _, values = panel.variables(METRIC)
+
+    expected = np.nan_to_num(pd.DataFrame(values).corr().to_numpy(), nan=0.0)
+    np.testing.assert_allclose(panel.moments(METRIC).correlation(), expected, atol=1e-10)
+
+
+def test_added_keyword_matches_refit(frames):
+    keywords = list(frames)
+    base = _warm(KeywordPanel.from_frames({keyword: frames[keyword] for keyword in keywords[:-1]}))
+
+    updated = base.with_keyword(keywords[-1], frames[keywords[-1]])
+    refit = KeywordPanel.from_frames(frames)
+
+    _assert_same_moments(updated, refit)
+    _assert_same_indicators(updated, refit)
+
+
+def test_replaced_keyword_matches_refit(frames):
+    keywords = list(frames)
+    replaced = {source: frame.assign(**{METRIC: frame[METRIC][::-1].to_numpy()}) for source, frame in frames[keywords[3]].items()}
+    base = _warm(KeywordPanel.from_frames(frames))
+
+    updated = base.with_keyword(keywords[3], replaced)
+    refit = KeywordPanel.from_frames({**frames, keywords[3]: replaced})
+
+    _assert_same_moments(updated, refit)
+    _assert_same_indicators(updated, refit)
+
+
+def test_removed_keyword_matches_refit(frames):
+    keywords = list(frames)
+    base = _warm(KeywordPanel.from_frames(frames))
+
+    updated = base.without_keyword(keywords[0])
+    refit = KeywordPanel.from_frames({keyword: frames[keyword] for keyword in keywords[1:]})
+
+    _assert_same_moments(updated, refit)
+    _assert_same_indicators(updated, refit)
+
+
+def test_added_month_matches_refit(frames):
+    full = KeywordPanel.from_frames(frames)
+    values = np.stack([np.column_stack([full.matrix(source, metric)[i] for source, metric in full.columns]) for i in range(len(full.index))])
+    short = _warm(KeywordPanel(full.index[:-1], full.keywords, full.columns, values[:-1]))
+
+    updated = short.with_month(full.index[-1], values[-1])
+
+    _assert_same_moments(updated, full)
+    _assert_same_indicators(updated, full)
+
+
+def test_updates_leave_the_original_panel_alone(frames):
+    keywords = list(frames)
+    base = _warm(KeywordPanel.from_frames({keyword: frames[keyword] for keyword in keywords[:-1]}))
+    before = base.moments(METRIC).cross.copy()
+
+    base.with_keyword(keywords[-1], frames[keywords[-1]])
+
+    assert keywords[-1] not in base.keywords
+    np.testing.assert_array_equal(base.moments(METRIC).cross, before)
+
+
+def test_monthly_panel_columns_follow_the_frames(frames):
+    keyword = next(iter(frames))
+    panel = MonthlyPanel.from_frames(frames[keyword])
+
+    assert panel.sources() == {'google', 'yandex'}
+    yandex = frames[keyword]['yandex'].set_index('date')[METRIC]
+    np.testing.assert_allclose(pd.Series(panel.column('yandex', METRIC), index=panel.index).reindex(yandex.index), yandex)
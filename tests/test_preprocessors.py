@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from DateRange import DateRange
+from Preprocessors import DAILY, MONTHLY, WEEKLY, GooglePreprocessor, YandexPreprocessor
+from benchmarks import synthetic
+
+START, END = pd.Timestamp('2021-01-01'), pd.Timestamp('2022-12-01')
+DATERANGE = DateRange.from_months(START, END)
+KEYWORDS = synthetic.keywords(6)
+
+
+def _assert_same(batch, single):
+    pd.testing.assert_frame_equal(batch.reset_index(drop=True), single.reset_index(drop=True), check_dtype=False)
+
+
+@pytest.mark.parametrize('resolution', ['D', 'W'])
+@pytest.mark.parametrize('freq', [MONTHLY, WEEKLY, DAILY])
+def test_google_batch_matches_keyword_by_keyword(resolution, freq):
+    frames = synthetic.google_frames(KEYWORDS, START, END, resolution)
+
+    batch = GooglePreprocessor.process_batch(frames, DATERANGE, freq)
+
+    assert list(batch) == KEYWORDS
+    for keyword in KEYWORDS:
+        _assert_same(batch[keyword], GooglePreprocessor.process(frames[keyword], keyword, DATERANGE, freq))
+
+
+@pytest.mark.parametrize('freq', [MONTHLY, WEEKLY, DAILY])
+def test_yandex_batch_matches_keyword_by_keyword(freq):
+    frames = synthetic.yandex_frames(KEYWORDS, START, END)
+
+    batch = YandexPreprocessor.process_batch(frames, DATERANGE, freq)
+
+    assert list(batch) == KEYWORDS
+    for keyword in KEYWORDS:
+        _assert_same(batch[keyword], YandexPreprocessor.process(frames[keyword], keyword, DATERANGE, freq))
+
+
+def test_keyword_without_rows_comes_back_empty():
+    frames = synthetic.yandex_frames(KEYWORDS[:2], START, END)
+    frames[KEYWORDS[1]] = frames[KEYWORDS[1]].iloc[0:0]
+
+    batch = YandexPreprocessor.process_batch(frames, DATERANGE)
+
+    assert batch[KEYWORDS[1]].empty
+    _assert_same(batch[KEYWORDS[0]], YandexPreprocessor.process(frames[KEYWORDS[0]], KEYWORDS[0], DATERANGE))
@@ -0,0 +1,55 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import SeriesStore as series_store
+from SeriesStore import SeriesStore
+
+
+def _at(year, month, day, hour=12):
+    return datetime.datetime(year, month, day, hour).timestamp()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SeriesStore(str(tmp_path / 'series.sqlite3'), partial_ttl=6 * 60 * 60)
+
+
+def _save_at(monkeypatch, store, when, months):
+    monkeypatch.setattr(series_store.time, 'time', lambda: when)
+    store.save('google', 'keyword', '', {month: pd.DataFrame({'keyword': [1.0]}) for month in months})
+
+
+def _load_at(monkeypatch, store, when, months):
+    monkeypatch.setattr(series_store.time, 'time', lambda: when)
+    return store.load('google', 'keyword', '', months)
+
+
+def test_month_fetched_mid_month_expires_after_month_end(monkeypatch, store):
+    _save_at(monkeypatch, store, _at(2024, 3, 15), ['2024-03'])
+
+    assert '2024-03' in _load_at(monkeypatch, store, _at(2024, 3, 15, 14), ['2024-03'])
+    # The calendar rolling over doesn't make the truncated figures final
+    assert '2024-03' not in _load_at(monkeypatch, store, _at(2024, 4, 2), ['2024-03'])
+
+
+def test_month_fetched_mid_month_is_partial_within_ttl_of_month_end(monkeypatch, store):
+    _save_at(monkeypatch, store, _at(2024, 3, 31, 22), ['2024-03'])
+
+    assert '2024-03' in _load_at(monkeypatch, store, _at(2024, 4, 1, 1), ['2024-03'])
+    assert '2024-03' not in _load_at(monkeypatch, store, _at(2024, 4, 1, 5), ['2024-03'])
+
+
+def test_month_fetched_after_month_end_is_final(monkeypatch, store):
+    _save_at(monkeypatch, store, _at(2024, 4, 2), ['2024-03'])
+
+    assert '2024-03' in _load_at(monkeypatch, store, _at(2030, 1, 1), ['2024-03'])
+
+
+def test_ttl_expires_final_months(monkeypatch, tmp_path):
+    store = SeriesStore(str(tmp_path / 'series.sqlite3'), ttl=24 * 60 * 60)
+    _save_at(monkeypatch, store, _at(2024, 4, 2), ['2024-03'])
+
+    assert '2024-03' in _load_at(monkeypatch, store, _at(2024, 4, 2, 20), ['2024-03'])
+    assert '2024-03' not in _load_at(monkeypatch, store, _at(2024, 4, 4), ['2024-03'])
@@ -0,0 +1,48 @@
+import Watchlist as watchlist_module
+from Watchlist import Watchlist, WatchlistRefresher
+
+
+def _refresher(watchlist, refreshed, **kwargs):
+    # Records what a pass would fetch instead of going upstream
+    refresher = WatchlistRefresher(watchlist, {}, interval=0, **kwargs)
+    refresher.refresh_group = lambda entries, sources=None: refreshed.extend(entry.keyword for entry in entries)
+    return refresher
+
+
+def test_lease_is_held_by_one_holder_until_it_expires(monkeypatch, tmp_path):
+    watchlist = Watchlist(str(tmp_path / 'watchlist.sqlite3'))
+    monkeypatch.setattr(watchlist_module.time, 'time', lambda: 0.0)
+    assert watchlist.hold_lease('refresher', 'app-1', ttl=60)
+    assert not watchlist.hold_lease('refresher', 'app-2', ttl=60)
+    assert watchlist.hold_lease('refresher', 'app-1', ttl=60)
+
+    monkeypatch.setattr(watchlist_module.time, 'time', lambda: 61.0)
+    assert watchlist.hold_lease('refresher', 'app-2', ttl=60)
+    assert not watchlist.hold_lease('refresher', 'app-1', ttl=60)
+
+
+def test_higher_priority_takes_the_lease_over(tmp_path):
+    watchlist = Watchlist(str(tmp_path / 'watchlist.sqlite3'))
+    assert watchlist.hold_lease('refresher', 'app', ttl=60)
+    assert watchlist.hold_lease('refresher', 'sidecar', ttl=60, priority=1)
+    assert not watchlist.hold_lease('refresher', 'app', ttl=60)
+
+    watchlist.release_lease('refresher', 'sidecar')
+    assert watchlist.hold_lease('refresher', 'app', ttl=60)
+
+
+def test_only_the_lease_holder_refreshes(tmp_path):
+    watchlist = Watchlist(str(tmp_path / 'watchlist.sqlite3'))
+    watchlist.add('keyword', '2024-01')
+    first, second = [], []
+    holder = _refresher(watchlist, first)
+    other = _refresher(watchlist, second)
+
+    holder.refresh_due()
+    other.refresh_due()
+    assert first == ['keyword'] and second == []
+
+    holder.stop()
+    other.refresh_due()
+    assert second == ['keyword']
+
@@ -0,0 +1,90 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import Preprocessors
+from DateRange import DateRange
+from WordstatPool import _BrowserlessWorker
+from YandexWordstatApiFetcher import YandexWordstatApiFetcher
+from benchmarks.wordstat_stub import WordstatStub
+
+SESSION = 'fresh'
+TIMEFRAME = (datetime.date(2022, 1, 1), datetime.date(2022, 12, 1))
+
+
+@pytest.fixture(scope='module')
+def stub():
+    with WordstatStub(session=SESSION) as stub:
+        yield stub
+
+
+class _Browser:
+    # Stands in for the shared browser, hands out cookies and counts what the worker asked for
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+        self.generation = 0
+        self.logins = 0
+        self.scrapes = 0
+
+    def ExportCookies(self, login, password, expired=None):
+        if self.generation == 0 or expired == self.generation:
+            self.logins += 1
+            self.generation += 1
+        session = self.sessions[min(self.generation, len(self.sessions)) - 1]
+        return [{'name': 'Session_id', 'value': session, 'domain': '127.0.0.1'}], self.generation
+
+    def FetchInterestOverTime(self, credentials, keyword, timeframe):
+        self.scrapes += 1
+        return pd.DataFrame({'Period': ['January 2022'], 'Number of queries': [1], 'Percentage of total queries, %': [0.1]})
+
+
+def _worker(stub, browser):
+    worker = _BrowserlessWorker(browser, YandexWordstatApiFetcher(base_url=stub.url))
+    worker.DoAuth('login', 'password')
+    return worker
+
+
+def test_dynamics_parse_into_the_csv_export_layout(stub):
+    worker = _worker(stub, _Browser([SESSION]))
+    data = worker.FetchInterestOverTime('query', TIMEFRAME)
+
+    assert list(data.columns) == ['Period', 'Number of queries', 'Percentage of total queries, %']
+    assert data['Period'].tolist() == [f'{month} 2022' for month in YandexWordstatApiFetcher.MONTH_NAMES]
+    assert data['Number of queries'].dtype == 'int64'
+
+    processed = Preprocessors.YandexPreprocessor.process(data, 'query', DateRange.from_months(*map(pd.Timestamp, TIMEFRAME)))
+    # Same frame the CSV export gives, so the Wordstat preprocessing takes it as it is
+    assert not processed.empty
+    assert processed['absolute_value'].isin(data['Number of queries']).all()
+
+
+def test_unexpected_payload_is_rejected():
+    with pytest.raises(ValueError):
+        YandexWordstatApiFetcher.ParseDynamics({'error': 'captcha'})
+
+
+def test_expired_cookies_are_refreshed_before_falling_back(stub):
+    browser = _Browser(['expired', SESSION])
+    worker = _worker(stub, browser)
+
+    assert len(worker.FetchInterestOverTime('query', TIMEFRAME)) == 12
+    assert browser.logins == 2
+    assert browser.scrapes == 0
+    assert worker.IsAlive()
+
+
+def test_rejected_fresh_cookies_fall_back_to_the_browser(stub):
+    browser = _Browser(['expired'])
+    worker = _worker(stub, browser)
+
+    assert len(worker.FetchInterestOverTime('query', TIMEFRAME)) == 1
+    assert browser.logins == 2
+    assert browser.scrapes == 1
+    assert not worker.IsAlive()
+
+
+def test_quit_worker_is_not_alive(stub):
+    worker = _worker(stub, _Browser([SESSION]))
+    worker.Quit()
+    assert not worker.IsAlive()
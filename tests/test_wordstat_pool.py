@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from WordstatPool import WordstatPool
+
+
+class _FakeScraper:
+    # Logs in only with the right password, and only once the test lets it
+    def __init__(self, release, download_dir=None):
+        self.release = release
+
+    def DoAuth(self, login, password):
+        self.release.wait(5)
+        if password != 'secret':
+            raise RuntimeError('wrong password')
+
+    def IsAlive(self):
+        return True
+
+    def Quit(self):
+        pass
+
+
+@pytest.fixture
+def release():
+    return threading.Event()
+
+
+@pytest.fixture
+def pool(release, tmp_path):
+    pool = WordstatPool(size=1, download_root=str(tmp_path), max_attempts=1, scraper_factory=lambda **kwargs: _FakeScraper(release, **kwargs))
+    yield pool
+    release.set()
+    pool.Shutdown()
+
+
+def test_login_in_progress_is_not_authorized(pool, release):
+    future = pool.DoAuth('login', 'secret')
+    assert not pool.IsAuthorized()
+
+    release.set()
+    future.result(timeout=5)
+    assert pool.IsAuthorized()
+
+
+def test_rejected_login_is_not_authorized(pool, release):
+    release.set()
+    pool.DoAuth('login', 'secret').result(timeout=5)
+
+    with pytest.raises(RuntimeError):
+        pool.DoAuth('login', 'wrong').result(timeout=5)
+    assert not pool.IsAuthorized()
@@ -0,0 +1,121 @@
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+import pandas as pd
+
+import Pipeline
+import Preprocessors
+from GoogleTrendsScheduler import GoogleTrendsScheduler
+from SeriesStore import SeriesStore
+from Watchlist import Watchlist, WatchlistRefresher
+from WordstatPool import WordstatPool
+from batch import read_keywords
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Keep the series and indicators of watched keywords up to date for the app')
+    parser.add_argument('--watchlist', default='./.cache/watchlist.sqlite3', help='watchlist shared with the app')
+    parser.add_argument('--store', default='./.cache/series.sqlite3', help='series store shared with the app')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='watch keywords from a month on')
+    add.add_argument('keywords', nargs='+', help='keywords, or @file with one keyword per line')
+    add.add_argument('--start', required=True, help='first month to keep, YYYY-MM')
+    add.add_argument('--frequency', choices=list(Preprocessors.FREQUENCIES), default=Preprocessors.MONTHLY)
+
+    remove = commands.add_parser('remove', help='stop watching keywords')
+    remove.add_argument('keywords', nargs='+', help='keywords, or @file with one keyword per line')
+    remove.add_argument('--frequency', choices=list(Preprocessors.FREQUENCIES), help='only this frequency, all of them by default')
+
+    commands.add_parser('list', help='show watched keywords and when they were refreshed')
+
+    run = commands.add_parser('run', help='refresh watched keywords as they fall due')
+    run.add_argument('--interval', type=float, default=60 * 60, help='seconds between refreshes of a keyword')
+    run.add_argument('--once', action='store_true', help='refresh what is due and exit')
+    run.add_argument('--sources', nargs='+', choices=[Pipeline.GOOGLE, Pipeline.YANDEX], default=[Pipeline.GOOGLE, Pipeline.YANDEX])
+    run.add_argument('--google-workers', type=int, default=1)
+    run.add_argument('--google-rate', type=float, default=0.2, help='Google Trends requests per second')
+    run.add_argument('--google-proxies', nargs='*', default=[], help='proxies to rotate through when Google throttles')
+    run.add_argument('--google-user-agents', nargs='*', default=[], help='user agents to rotate through when Google throttles')
+    run.add_argument('--yandex-workers', type=int, default=1)
+    run.add_argument('--browserless', action='store_true', help='fetch Wordstat data over HTTP after a browser login')
+    run.add_argument('--yandex-login', default=os.environ.get('YANDEX_LOGIN'))
+    run.add_argument('--yandex-password', default=os.environ.get('YANDEX_PASSWORD'), help='defaults to the YANDEX_PASSWORD environment variable')
+    return parser.parse_args(argv)
+
+
+def _keywords(arguments: List[str]) -> List[str]:
+    keywords = []
+    for argument in arguments:
+        keywords += read_keywords(argument[1:]) if argument.startswith('@') else [argument]
+    return list(dict.fromkeys(keywords))
+
+
+def list_watched(watchlist: Watchlist):
+    refreshed = watchlist.refreshed_at()
+    for entry in watchlist.entries():
+        at = refreshed.get(entry)
+        when = pd.Timestamp(at, unit='s').strftime('%Y-%m-%d %H:%M UTC') if at is not None else 'never'
+        print(f'{entry.keyword}\t{entry.freq}\tfrom {entry.start}\trefreshed {when}')
+
+
+def refresh(args: argparse.Namespace, watchlist: Watchlist) -> int:
+    store = SeriesStore(args.store)
+    scheduler = None
+    pool = None
+    try:
+        if Pipeline.GOOGLE in args.sources:
+            scheduler = GoogleTrendsScheduler(
+                rate=args.google_rate, workers=args.google_workers,
+                identities=GoogleTrendsScheduler.BuildIdentities(args.google_proxies, args.google_user_agents),
+            )
+        if Pipeline.YANDEX in args.sources:
+            if not args.yandex_login or not args.yandex_password:
+                raise SystemExit('Yandex credentials are required, pass --yandex-login and set YANDEX_PASSWORD')
+            pool = WordstatPool(size=args.yandex_workers, browserless=args.browserless)
+            pool.DoAuth(args.yandex_login, args.yandex_password).result()
+
+        # The sidecar has the credentials the app may lack, so the app's own refreshers leave the watchlist to it
+        refresher = WatchlistRefresher.for_services(watchlist, store, scheduler, pool, interval=args.interval, priority=1)
+        if args.once:
+            refreshed = refresher.refresh_due()
+            refresher.stop()
+            print(f'Refreshed {refreshed} of {len(watchlist.entries())} watched keywords')
+            return 0
+
+        refresher.start()
+        print(f'Refreshing {len(watchlist.entries())} watched keywords every {args.interval:g}s, Ctrl+C to stop')
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            refresher.stop()
+        return 0
+    finally:
+        if scheduler is not None:
+            scheduler.Shutdown()
+        if pool is not None:
+            pool.Shutdown()
+
+
+def run(args: argparse.Namespace) -> int:
+    watchlist = Watchlist(args.watchlist)
+
+    if args.command == 'add':
+        for keyword in _keywords(args.keywords):
+            watchlist.add(keyword, args.start, args.frequency)
+    elif args.command == 'remove':
+        for keyword in _keywords(args.keywords):
+            watchlist.remove(keyword, args.frequency)
+    elif args.command == 'list':
+        list_watched(watchlist)
+    else:
+        return refresh(args, watchlist)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args(sys.argv[1:])))